@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Produces the maps of a list of runs in a single process or a pool of
+worker processes, sharing the configuration and the loaded references.
+The run list is a CSV file with the columns run_number, folder, file_in,
+file_out_map and file_out_hists. A summary with the outcome and the
+wall time of each run is written to the output CSV file.
+
+    run_batch_maps.py -c $ICARO/conf/next-100/kr_only.conf -r runs.csv -j 4
+"""
+from invisible_cities.core.configure import configure
+from krcal.map_builder.batch_functions import read_run_list
+from krcal.map_builder.batch_functions import run_batch
+import sys
+import argparse
+import logging
+import warnings
+warnings.filterwarnings("ignore")
+logging.disable(logging.DEBUG)
+this_script_logger = logging.getLogger(__name__)
+this_script_logger.setLevel(logging.INFO)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--config" , required=True)
+    parser.add_argument("-r", "--runs"   , required=True)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("-o", "--output" , default="batch_summary.csv")
+    args    = parser.parse_args()
+
+    config  = configure(["maps", args.config]).as_namespace
+    summary = run_batch(config, read_run_list(args.runs), args.workers)
+    summary.to_csv(args.output, index=False)
+    print(summary.to_string(index=False))
+    sys.exit(int((summary.status != 'ok').any()))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Runs the map production benchmarks on synthetic kdsts and appends the
+results to a CSV history, reporting the regressions with respect to
+the previous commit in the history.
+
+    run_benchmarks.py -c $ICARO/conf/next-100/kr_only.conf -n 100000 1000000
+"""
+from invisible_cities.core.configure import configure
+from krcal.map_builder.benchmark_functions import BENCHMARK_CASES
+from krcal.map_builder.benchmark_functions import run_benchmarks
+from krcal.map_builder.benchmark_functions import append_results
+from krcal.map_builder.benchmark_functions import find_regressions
+import sys
+import argparse
+import tempfile
+import logging
+import warnings
+warnings.filterwarnings("ignore")
+logging.disable(logging.DEBUG)
+this_script_logger = logging.getLogger(__name__)
+this_script_logger.setLevel(logging.INFO)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--config"   , default="$ICARO/conf/next-100/kr_only.conf")
+    parser.add_argument("-n", "--nevents"  , type=float, nargs="+", default=[1e5])
+    parser.add_argument("-b", "--benchmark", nargs="+", choices=BENCHMARK_CASES, default=None)
+    parser.add_argument("-r", "--repeats"  , type=int, default=3)
+    parser.add_argument("-o", "--output"   , default="benchmarks.csv")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.2)
+    parser.add_argument("--chunk-size"     , type=float, default=1e6)
+    args   = parser.parse_args()
+
+    config = configure(["maps", args.config]).as_namespace
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(config,
+                                 sizes      = [int(n) for n in args.nevents],
+                                 workdir    = workdir,
+                                 cases      = args.benchmark,
+                                 repeats    = args.repeats,
+                                 chunk_size = int(args.chunk_size))
+
+    history     = append_results(results, args.output)
+    regressions = find_regressions(history, results[0].commit, tolerance=args.tolerance)
+    if len(regressions):
+        print("Regressions with respect to the previous commit:")
+        print(regressions.to_string(index=False))
+        sys.exit(1)
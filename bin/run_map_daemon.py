@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Watches the input folder of a run and keeps its map up to date: each
+newly closed kdst file is added to the accumulated statistics of the
+run, and the map, time evolution and control histograms are written
+again when enough new events have been selected. The work state is kept
+in a state file, so the daemon can be restarted without reprocessing.
+
+    run_map_daemon.py -c config.conf -s run_8000_state.json --min-new-events 200000
+"""
+from invisible_cities.core.configure import configure
+from krcal.map_builder.daemon_functions import run_daemon
+import argparse
+import logging
+import warnings
+warnings.filterwarnings("ignore")
+logging.disable(logging.DEBUG)
+this_script_logger = logging.getLogger(__name__)
+this_script_logger.setLevel(logging.INFO)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--config"        , required=True)
+    parser.add_argument("-s", "--state"         , required=True)
+    parser.add_argument("--poll-interval"       , type=float, default=60)
+    parser.add_argument("--settle-time"         , type=float, default=120)
+    parser.add_argument("--min-new-events"      , type=int  , default=100000)
+    parser.add_argument("--min-interval"        , type=float, default=600)
+    parser.add_argument("--max-attempts"        , type=int  , default=3)
+    args   = parser.parse_args()
+
+    config = configure(["maps", args.config]).as_namespace
+    run_daemon(config,
+               state_file     = args.state,
+               poll_interval  = args.poll_interval,
+               settle_time    = args.settle_time,
+               min_new_events = args.min_new_events,
+               min_interval   = args.min_interval,
+               max_attempts   = args.max_attempts)
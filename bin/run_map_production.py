@@ -1,7 +1,15 @@
 #!/usr/bin/env python
+"""
+Computes the correction map of a run:
 
+    run_map_production.py config.conf
+
+With --dry-run, the configuration and its files are only validated:
+only IC configure, to read the file, and config_functions are imported,
+not the map production modules.
+"""
 from invisible_cities.core.configure import configure
-from krcal.map_builder.map_builder_functions import map_builder
+from krcal.map_builder.config_functions import validate_config
 import sys
 import logging
 import warnings
@@ -11,5 +19,15 @@ this_script_logger = logging.getLogger(__name__)
 this_script_logger.setLevel(logging.INFO)
 
 if __name__ == "__main__":
-    config = configure(sys.argv).as_namespace
+    dry_run = "--dry-run" in sys.argv
+    argv    = [arg for arg in sys.argv if arg != "--dry-run"]
+    config  = configure(argv).as_namespace
+    if dry_run:
+        errors = validate_config(config)
+        for error in errors:
+            print("Configuration error: {0}".format(error))
+        print("Configuration {0}".format("not valid" if errors else "valid"))
+        sys.exit(int(bool(errors)))
+
+    from krcal.map_builder.map_builder_functions import map_builder
     map_builder(config)
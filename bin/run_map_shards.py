@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Runs the map production in shards. The band step writes the Z vs E
+histogram of a subset of the input files, from which the Kr band of the
+run is fitted; the map step selects the events of the same subset with
+that band and writes its partial result; the reduce step merges the
+partial results and writes the map and the control histograms. The
+local command runs all the steps, with the shards in parallel processes.
+
+    run_map_shards.py band   -c config.conf -n 10 -i 3 -o band_3.npy
+    run_map_shards.py map    -c config.conf -n 10 -i 3 -b band_*.npy -o partial_3.npz
+    run_map_shards.py reduce -c config.conf partial_*.npz
+    run_map_shards.py local  -c config.conf -n 8
+"""
+from invisible_cities.core.configure import configure
+from krcal.map_builder.map_builder_functions import get_dst_files
+from krcal.map_builder.map_builder_functions import load_references
+from krcal.map_builder.shard_functions       import shard_files
+from krcal.map_builder.shard_functions       import shard_band_histogram
+from krcal.map_builder.shard_functions       import process_shard
+from krcal.map_builder.shard_functions       import write_map_partial
+from krcal.map_builder.shard_functions       import read_map_partial
+from krcal.map_builder.shard_functions       import reduce_map_partials
+import numpy as np
+import argparse
+import multiprocessing
+import logging
+import warnings
+warnings.filterwarnings("ignore")
+logging.disable(logging.DEBUG)
+this_script_logger = logging.getLogger(__name__)
+this_script_logger.setLevel(logging.INFO)
+
+
+def load_config(conf):
+    return configure(["maps", conf]).as_namespace
+
+
+def run_band(conf, nshards, ishard):
+    config          = load_config(conf)
+    dst_files       = get_dst_files(config.folder, config.file_in)
+    bootstrapmap, _ = load_references(config.file_bootstrap_map,
+                                      **config.ref_Z_histogram )
+    return shard_band_histogram(config, shard_files(dst_files, nshards, ishard),
+                                bootstrapmap)
+
+
+def run_shard(conf, nshards, ishard, band_histo):
+    config                   = load_config(conf)
+    dst_files                = get_dst_files(config.folder, config.file_in)
+    bootstrapmap, ref_histos = load_references(config.file_bootstrap_map,
+                                               **config.ref_Z_histogram )
+    return process_shard(config, shard_files(dst_files, nshards, ishard),
+                         bootstrapmap, ref_histos, band_histo)
+
+
+def reduce_partials(conf, partials):
+    config        = load_config(conf)
+    _, ref_histos = load_references(config.file_bootstrap_map,
+                                    **config.ref_Z_histogram )
+    reduce_map_partials(config, partials, ref_histos)
+
+
+if __name__ == "__main__":
+    parser   = argparse.ArgumentParser(description=__doc__,
+                                       formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    band_cmd = commands.add_parser("band")
+    band_cmd.add_argument("-c", "--config" , required=True)
+    band_cmd.add_argument("-n", "--nshards", type=int, required=True)
+    band_cmd.add_argument("-i", "--ishard" , type=int, required=True)
+    band_cmd.add_argument("-o", "--output" , required=True)
+
+    map_cmd  = commands.add_parser("map")
+    map_cmd .add_argument("-c", "--config" , required=True)
+    map_cmd .add_argument("-n", "--nshards", type=int, required=True)
+    map_cmd .add_argument("-i", "--ishard" , type=int, required=True)
+    map_cmd .add_argument("-b", "--band"   , nargs="+", required=True)
+    map_cmd .add_argument("-o", "--output" , required=True)
+
+    red_cmd  = commands.add_parser("reduce")
+    red_cmd .add_argument("-c", "--config" , required=True)
+    red_cmd .add_argument("partials", nargs="+")
+
+    loc_cmd  = commands.add_parser("local")
+    loc_cmd .add_argument("-c", "--config" , required=True)
+    loc_cmd .add_argument("-n", "--nshards", type=int, default=multiprocessing.cpu_count())
+    args     = parser.parse_args()
+
+    if args.command == "band":
+        with open(args.output, "wb") as output:
+            np.save(output, run_band(args.config, args.nshards, args.ishard))
+    elif args.command == "map":
+        band_histo = sum(np.load(f) for f in args.band)
+        write_map_partial(run_shard(args.config, args.nshards, args.ishard, band_histo),
+                          args.output)
+    elif args.command == "reduce":
+        reduce_partials(args.config, [read_map_partial(f) for f in args.partials])
+    else:
+        config  = load_config(args.config)
+        nshards = max(1, min(args.nshards, len(get_dst_files(config.folder, config.file_in))))
+        shards  = [(args.config, nshards, i) for i in range(nshards)]
+        with multiprocessing.Pool(nshards) as pool:
+            band_histo = sum(pool.starmap(run_band, shards))
+            partials   = pool.starmap(run_shard, [shard + (band_histo,) for shard in shards])
+        reduce_partials(args.config, partials)
@@ -10,10 +10,12 @@ Documentation
 -------------
     Insert documentation https
 """
-import numpy as np
+import numpy  as np
+import pandas as pd
 from typing      import List
 from typing      import Tuple
 from typing      import Iterable
+from dataclasses import dataclass
 
 from   invisible_cities.core .core_functions import in_range
 from   invisible_cities.core .stat_functions import poisson_sigma
@@ -21,16 +23,19 @@ from   invisible_cities.core .core_functions import shift_to_bin_centers
 from   invisible_cities.types.ic_types       import NN
 import invisible_cities.core.fit_functions   as     fitf
 
-from .. core. fit_functions  import chi2
-from .. core. stat_functions import mean_and_std
-from .. core. kr_types       import GaussPar
-from .. core. kr_types       import FitPar
-from .. core. kr_types       import FitResult
-from .. core. kr_types       import HistoPar
-from .. core. kr_types       import FitCollection
-from .. core. kr_types       import Number
-from .. core. kr_types       import Range
-from .. core. kr_types       import Measurement
+from .. core. fit_functions      import chi2
+from .. core. histo_functions    import uniform_bin_index
+from .. core. lt_stats_functions import bin_index
+from .. core. stat_functions     import relative_error_ratio
+from .. core. stat_functions     import mean_and_std
+from .. core. kr_types           import GaussPar
+from .. core. kr_types           import FitPar
+from .. core. kr_types           import FitResult
+from .. core. kr_types           import HistoPar
+from .. core. kr_types           import FitCollection
+from .. core. kr_types           import Number
+from .. core. kr_types           import Range
+from .. core. kr_types           import Measurement
 
 from scipy.optimize          import OptimizeWarning
 
@@ -80,6 +85,32 @@ def gaussian_parameters(x : np.array, range : Tuple[Number], bin_size : float =
                     amp = Measurement(amp, amp_u))
 
 
+def gaussian_parameters_from_moments(n        : int,
+                                     n_in     : int,
+                                     sum_in   : float,
+                                     sum2_in  : float,
+                                     bin_size : float = 1)->GaussPar:
+    """
+    Same as gaussian_parameters, from the number of values (n) and the
+    number, sum and sum of squares of the values in range (n_in,
+    sum_in, sum2_in), so it can be computed for many sets of values
+    from their accumulated moments.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu    = sum_in / n_in if n_in else NN
+        std   = np.sqrt(max(sum2_in / n_in - mu**2, 0)) if n_in else NN
+        ff    = np.sqrt(2 * np.pi) * std
+        amp   = n * bin_size / ff
+
+        mu_u  = std / np.sqrt(n_in)
+        std_u = std / np.sqrt(2 * (n_in -1))
+        amp_u = np.sqrt(2 * np.pi) * std_u
+
+    return GaussPar(mu  = Measurement(mu, mu_u),
+                    std = Measurement(std, std_u),
+                    amp = Measurement(amp, amp_u))
+
+
 def gaussian_fit(x       : np.array,
                  y       : np.array,
                  seed    : GaussPar,
@@ -180,3 +211,112 @@ def gaussian_params_from_fcs(fcs : FitCollection) ->Iterable[np.array]:
     ustds = np.array([fc.fr.err[2] for fc in fcs])
     chi2s = np.array([fc.fr.chi2   for fc in fcs])
     return mus, umus, stds, ustds, chi2s
+
+
+@dataclass
+class resolution_scan:
+    Ri      : np.array      # upper R of the regions 0 <= R < r
+    Zi      : np.array      # upper Z of the regions 0 <= Z < z
+    edges   : np.array      # limits of the energy bins
+    entries : np.array      # number of events in each region, shape (nR, nZ)
+    histos  : np.array      # energy histogram of each region, shape (nR, nZ, nbins)
+    fits    : List[List[FitCollection]] # fit of each region (hp is None: the events are not kept)
+    fwhm    : pd.DataFrame  # resolution FWHM (%), one column per R and one row per Z
+    fwhmu   : pd.DataFrame  # error of fwhm
+
+
+def energy_histograms_r_z(Ri     : Iterable[float],
+                          Zi     : Iterable[float],
+                          R      : np.array,
+                          Z      : np.array,
+                          E      : np.array,
+                          nbins  : int,
+                          range  : Tuple[float, float])->Tuple[np.array, np.array, np.array]:
+    """
+    Energy histograms and moments of the nested regions
+    0 <= R < r, 0 <= Z < z for every r in Ri and z in Zi. The events are
+    binned once in a (R, Z, E) histogram, with the values of Ri and Zi
+    as R and Z limits, and the nested regions are its prefix sums
+    along R and Z.
+
+    Returns
+    -------
+        The histograms, shape (nR, nZ, nbins), the moments (number of
+        events and number, sum and sum of squares of the energies in
+        range), shape (nR, nZ, 4), and the limits of the energy bins.
+    """
+    Ri, Zi  = np.asarray(Ri, dtype=float), np.asarray(Zi, dtype=float)
+    R, Z, E = (np.asarray(v, dtype=float) for v in (R, Z, E))
+    r_edges = np.unique(np.concatenate([[0], Ri[Ri > 0]]))
+    z_edges = np.unique(np.concatenate([[0], Zi[Zi > 0]]))
+    e_edges = np.linspace(*range, nbins + 1)
+    nr, nz  = len(r_edges) - 1, len(z_edges) - 1
+
+    ir, iz  = bin_index(R, r_edges), bin_index(Z, z_edges)
+    cell    = np.where((ir >= 0) & (iz >= 0), ir * nz + iz, -1)
+    used    = cell >= 0
+    ie      = uniform_bin_index(E, e_edges)
+    filled  = used & (ie >= 0)
+    histos  = np.bincount(cell[filled] * nbins + ie[filled],
+                          minlength=nr * nz * nbins).reshape(nr, nz, nbins)
+
+    inside  = used & (E >= range[0]) & (E < range[1])
+    ein     = E[inside]
+    moments = np.stack([np.bincount(cell[used], minlength=nr * nz)] +
+                       [np.bincount(cell[inside], weights=w, minlength=nr * nz)
+                        for w in (np.ones_like(ein), ein, ein * ein)], axis=-1).reshape(nr, nz, 4)
+
+    def nested(values):
+        for axis in (0, 1):
+            zeros  = np.zeros_like(np.take(values, [0], axis=axis))
+            values = np.concatenate([zeros, np.cumsum(values, axis=axis)], axis=axis)
+        ri = np.searchsorted(r_edges, np.clip(Ri, 0, None))
+        zi = np.searchsorted(z_edges, np.clip(Zi, 0, None))
+        return values[ri][:, zi]
+
+    return nested(histos), nested(moments), e_edges
+
+
+def resolution_scan_r_z(Ri      : Iterable[float],
+                        Zi      : Iterable[float],
+                        R       : np.array,
+                        Z       : np.array,
+                        E       : np.array,
+                        enbins  : int   = 25,
+                        erange  : Range = (10e+3, 12500),
+                        n_sigma : float = 3.0)->resolution_scan:
+    """
+    Energy resolution in the nested regions 0 <= R < r, 0 <= Z < z for
+    every r in Ri and z in Zi: the same gaussian fits as fit_energy on
+    the energies of each region, with the histograms of all the
+    regions computed in a single pass (see energy_histograms_r_z).
+
+    Returns
+    -------
+        A resolution_scan.
+    """
+    histos, moments, edges = energy_histograms_r_z(Ri, Zi, R, Z, E, enbins, erange)
+    x        = shift_to_bin_centers(edges)
+    bin_size = (erange[1] - erange[0]) / enbins
+
+    fits     = [[None] * len(moments[0]) for _ in moments]
+    fwhm     = np.full(moments.shape[:2], np.nan)
+    fwhmu    = np.full(moments.shape[:2], np.nan)
+    for i, j in np.ndindex(moments.shape[:2]):
+        seed   = gaussian_parameters_from_moments(*moments[i, j], bin_size)
+        fp, fr = gaussian_fit(x, histos[i, j], seed, n_sigma)
+        fits[i][j] = FitCollection(fp = fp, hp = None, fr = fr)
+
+        par, err    = fr.par, fr.err
+        a           = 2.35 * 100 *  par[2]
+        fwhm [i, j] = 2.35 * 100 *  par[2] / par[1]
+        fwhmu[i, j] = relative_error_ratio(a, 2.35 * 100 * err[2], par[1], err[1]) * fwhm[i, j]
+
+    return resolution_scan(Ri      = np.asarray(Ri),
+                           Zi      = np.asarray(Zi),
+                           edges   = edges,
+                           entries = moments[..., 0],
+                           histos  = histos,
+                           fits    = fits,
+                           fwhm    = pd.DataFrame(fwhm .T),
+                           fwhmu   = pd.DataFrame(fwhmu.T))
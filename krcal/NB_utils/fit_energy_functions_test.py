@@ -15,6 +15,9 @@ from .  fit_energy_functions            import gaussian_parameters
 from .  fit_energy_functions            import fit_energy
 from .  fit_energy_functions            import fit_gaussian_experiments
 from .  fit_energy_functions            import gaussian_params_from_fcs
+from .  fit_energy_functions            import gaussian_parameters_from_moments
+from .  fit_energy_functions            import energy_histograms_r_z
+from .  fit_energy_functions            import resolution_scan_r_z
 
 @given(floats(min_value = -100,
               max_value = +100),
@@ -120,3 +123,50 @@ def test_fits_yield_good_pulls_variable_mean_and_std():
     print(f'(sigma-rms) / rms_u -> {p_mu}, {p_std}')
     assert p_mu   < 1
     assert p_std  == approx(1,  abs=0.3)
+
+
+def test_gaussian_parameters_from_moments_same_as_gaussian_parameters():
+    e        = np.random.normal(1e+4, 200, 10000)
+    r        = (9.5e+3, 10.5e+3)
+    bin_size = 20
+    inside   = e[(e >= r[0]) & (e < r[1])]
+    gp       = gaussian_parameters(e, r, bin_size)
+    gpm      = gaussian_parameters_from_moments(len(e), len(inside), inside.sum(), (inside**2).sum(), bin_size)
+    for field in ('mu', 'std', 'amp'):
+        assert getattr(gpm, field).value       == approx(getattr(gp, field).value      , rel=1e-6)
+        assert getattr(gpm, field).uncertainty == approx(getattr(gp, field).uncertainty, rel=1e-6)
+
+
+def test_energy_histograms_r_z_same_as_selections():
+    n       = 20000
+    R       = np.random.uniform(0, 200, n)
+    Z       = np.random.uniform(0, 500, n)
+    E       = np.random.normal(11e+3, 500, n)
+    Ri, Zi  = (150, 50, 100), (500, 250)
+    erange  = (10e+3, 12500)
+    histos, moments, edges = energy_histograms_r_z(Ri, Zi, R, Z, E, 25, erange)
+    for i, r in enumerate(Ri):
+        for j, z in enumerate(Zi):
+            sel    = (R >= 0) & (R < r) & (Z >= 0) & (Z < z)
+            e      = E[sel]
+            inside = e[(e >= erange[0]) & (e < erange[1])]
+            assert np.all(histos[i, j] == np.histogram(e, 25, erange)[0])
+            assert moments[i, j, 0] == len(e)
+            assert moments[i, j, 1] == len(inside)
+            assert moments[i, j, 2] == approx(inside.sum())
+            assert moments[i, j, 3] == approx((inside**2).sum())
+
+
+def test_resolution_scan_r_z_same_as_fit_energy():
+    n      = 100000
+    R      = np.random.uniform(0, 200, n)
+    Z      = np.random.uniform(0, 500, n)
+    E      = np.random.normal(11e+3, 250, n)
+    Ri, Zi = (100, 200), (250, 500)
+    scan   = resolution_scan_r_z(Ri, Zi, R, Z, E)
+    for i, r in enumerate(Ri):
+        for j, z in enumerate(Zi):
+            sel = (R < r) & (Z < z)
+            fc  = fit_energy(E[sel], nbins=25, range=(10e+3, 12500))
+            assert scan.fits[i][j].fr.par == approx(fc.fr.par, rel=1e-6)
+            assert scan.fwhm[i][j]        == approx(2.35 * 100 * fc.fr.par[2] / fc.fr.par[1], rel=1e-6)
@@ -25,23 +25,34 @@ from .. core. kr_types       import FitCollection
 from .. core. stat_functions import relative_error_ratio
 from .  plt_functions        import plot_histo
 from .  fit_energy_functions import fit_energy
+from .  fit_energy_functions import resolution_scan
+from .  fit_energy_functions import resolution_scan_r_z
 
 
 def plot_fit_energy(fc : FitCollection):
 
+    y, b = np.histogram(fc.hp.var, bins=fc.hp.nbins, range=fc.hp.range)
+    plot_fit_energy_histo(y, b, len(fc.hp.var), fc)
+
+
+def plot_fit_energy_histo(y    : np.array,
+                          b    : np.array,
+                          nevt : int,
+                          fc   : FitCollection):
+    """Same as plot_fit_energy, for an already computed histogram (y, b) of nevt events."""
+
     if fc.fr.valid:
         par  = fc.fr.par
-        x    = fc.hp.var
         r    = 2.35 * 100 *  par[2] / par[1]
-        entries  =  f'Entries = {len(x)}'
+        entries  =  f'Entries = {nevt}'
         mean     =  r'$\mu$ = {:7.2f}'.format(par[1])
         sigma    =  r'$\sigma$ = {:7.2f}'.format(par[2])
         rx       =  r'$\sigma/mu$ (FWHM)  = {:7.2f}'.format(r)
         stat     =  f'{entries}\n{mean}\n{sigma}\n{rx}'
 
-        _, _, _   = plt.hist(fc.hp.var,
-                             bins = fc.hp.nbins,
-                             range=fc.hp.range,
+        _, _, _   = plt.hist(b[:-1],
+                             bins = b,
+                             weights = y,
                              histtype='step',
                              edgecolor='black',
                              linewidth=1.5,
@@ -100,48 +111,42 @@ def resolution_r_z(Ri : Iterable[float],
                    fdraw = True,
                    fprint = True,
                    figsize = (14,10))->Tuple[DataFrame, DataFrame]:
+    """
+    Resolution FWHM (%) and its error in the regions 0 < R < r,
+    0 < Z < z for r in Ri and z in Zi (see resolution_scan_r_z),
+    drawing (plot_resolution_scan) and printing the fit of each
+    region if requested.
+    """
+    scan = resolution_scan_r_z(Ri, Zi, R, Z, E, enbins, erange)
     if fdraw:
-        fig       = plt.figure(figsize=figsize)
-    FC = {}
-    FCE = {}
-    FCE = {}
-    j=0
-    ix = ixy[0]
-    iy = ixy[1]
-    for i, r in enumerate(Ri):
-        ZR = []
-        ZRE = []
-        for z in Zi:
-            Rr = 0, r
-            Zr = 0, z
-            j+=1
-            if fdraw:
-                ax  = fig.add_subplot(ix, iy, j)
-            fc = resolution_selected_r_z(Rr, Zr, R, Z, E, enbins, erange)
-            if fdraw:
-                plot_fit_energy(fc)
-                plot_histo('E','Entries',f' 0 < R < {r} 0 < z < {z}', ax, legend= True,
-                        legendsize=10, legendloc='best', labelsize=11)
-            if fprint:
-                print(f'0 < R < {r} 0 < z < {z}')
-                print_fit_energy(fc)
-
-            par     = fc.fr.par
-            err     = fc.fr.err
-            fwhm    = 2.35 * 100 *  par[2] / par[1]
-            a       = 2.35 * 100 *  par[2]
-            b       = par[1]
-            sigma_a = 2.35 * 100 * err[2]
-            sigma_b = err[1]
-
-            rer = relative_error_ratio(a, sigma_a, b, sigma_b)
-            ZR.append(fwhm)
-            ZRE.append(rer*fwhm)
-        FC[i] = ZR
-        FCE[i] = ZRE
-
+        plot_resolution_scan(scan, ixy, figsize)
+    if fprint:
+        print_resolution_scan(scan)
+    return scan.fwhm, scan.fwhmu
+
+
+def plot_resolution_scan(scan    : resolution_scan,
+                         ixy     : Tuple[int, int] = (3,4),
+                         figsize : Tuple[int, int] = (14,10)):
+    """Draws the energy histogram and fit of each region of a resolution scan."""
+    fig = plt.figure(figsize=figsize)
+    j   = 0
+    for i, r in enumerate(scan.Ri):
+        for k, z in enumerate(scan.Zi):
+            j += 1
+            ax = fig.add_subplot(*ixy, j)
+            plot_fit_energy_histo(scan.histos[i, k], scan.edges, scan.entries[i, k], scan.fits[i][k])
+            plot_histo('E','Entries',f' 0 < R < {r} 0 < z < {z}', ax, legend= True,
+                    legendsize=10, legendloc='best', labelsize=11)
     plt.tight_layout()
-    return pd.DataFrame.from_dict(FC), pd.DataFrame.from_dict(FCE)
+
+
+def print_resolution_scan(scan : resolution_scan):
+    """Prints the fit of each region of a resolution scan."""
+    for i, r in enumerate(scan.Ri):
+        for k, z in enumerate(scan.Zi):
+            print(f'0 < R < {r} 0 < z < {z}')
+            print_fit_energy(scan.fits[i][k])
 
 
 
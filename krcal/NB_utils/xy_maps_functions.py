@@ -13,7 +13,6 @@ Documentation
 import matplotlib.pyplot as plt
 from matplotlib.colors import Colormap
 
-import seaborn as sns
 from ..core. kr_types        import MapType
 from ..core. kr_types        import ASectorMap
 
@@ -26,6 +25,12 @@ import logging
 log = logging.getLogger()
 
 
+def heatmap(*args, **kwargs):
+    """seaborn.heatmap, importing seaborn (slow) only when a map is drawn."""
+    import seaborn as sns
+    return sns.heatmap(*args, **kwargs)
+
+
 def draw_xy_maps(aMap    : ASectorMap,
                  e0lims   : Optional[Tuple[float, float]] = None,
                  ltlims   : Optional[Tuple[float, float]] = None,
@@ -79,19 +84,19 @@ def draw_xy_maps(aMap    : ASectorMap,
 
     ax = fig.add_subplot(2,2,1)
     vmin, vmax = vmin_max(e0lims)
-    sns.heatmap(aMap.e0.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
+    heatmap(aMap.e0.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
 
     ax = fig.add_subplot(2,2,2)
     vmin, vmax = vmin_max(eulims)
-    sns.heatmap(aMap.e0u.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
+    heatmap(aMap.e0u.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
 
     ax = fig.add_subplot(2,2,3)
     vmin, vmax = vmin_max(ltlims)
-    sns.heatmap(aMap.lt.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
+    heatmap(aMap.lt.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
 
     ax = fig.add_subplot(2,2,4)
     vmin, vmax = vmin_max(lulims)
-    sns.heatmap(aMap.ltu.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
+    heatmap(aMap.ltu.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
     plt.tight_layout()
     plt.show()
 
@@ -142,7 +147,7 @@ def draw_xy_map(aMap    : ASectorMap,
 
     fig = plt.figure(figsize=figsize)
     ax = fig.add_subplot(1,1,1)
-    sns.heatmap(xymap.fillna(0) /norm, vmin=vmin, vmax=vmax, cmap=cmap, square=True)
+    heatmap(xymap.fillna(0) /norm, vmin=vmin, vmax=vmax, cmap=cmap, square=True)
     plt.title(title)
     plt.tight_layout()
     plt.show()
@@ -199,7 +204,7 @@ def draw_xy_maps_ts(aMaps   : List[ASectorMap],
         ax = fig.add_subplot(ix, iy, i+1)
         xymap, title = which_map_(aMaps[i], wmap, index = i)
         vmin, vmax = get_limits_(ltlims)
-        sns.heatmap(xymap.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
+        heatmap(xymap.fillna(0), vmin=vmin, vmax=vmax, cmap=cmap, square=True)
         plt.title(title)
     plt.tight_layout()
     plt.show()
@@ -1,7 +1,9 @@
 import numpy as np
 
+from . map_cache_functions              import cached_map_from_amap
+from . map_cache_functions              import map_lookup
+
 from invisible_cities.reco.corrections import ASectorMap
-from invisible_cities.reco.corrections import maps_coefficient_getter
 from invisible_cities.reco.corrections import correct_geometry_
 from invisible_cities.types.symbols    import NormStrategy
 from invisible_cities.reco.corrections import get_normalization_factor
@@ -11,11 +13,13 @@ def e0_xy_correction(map            : ASectorMap,
                      norm_strategy  : NormStrategy,
                      **norm_options : dict):
     """
-    Temporal function to perfrom IC geometric corrections only
+    Temporal function to perfrom IC geometric corrections only.
+    The e0 lookup uses the vectorized map cache (map_lookup).
     """
-    normalization   = get_normalization_factor(map        , norm_strategy, **norm_options)
-    get_xy_corr_fun = maps_coefficient_getter (map.mapinfo, map.e0)
+    normalization   = get_normalization_factor(map, norm_strategy, **norm_options)
+    cmap            = cached_map_from_amap(map)
     def geo_correction_factor(x : np.array,
                               y : np.array) -> np.array:
-        return correct_geometry_(get_xy_corr_fun(x,y))* normalization
+        e0, = map_lookup(cmap, x, y, parameters=('e0',))
+        return correct_geometry_(e0)* normalization
     return geo_correction_factor
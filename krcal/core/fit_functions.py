@@ -17,7 +17,6 @@ from typing      import Tuple
 from typing      import Callable
 
 import invisible_cities.core    .fit_functions  as     fitf
-import invisible_cities.database.load_db        as     DB
 from   invisible_cities.core    .core_functions import in_range
 from   invisible_cities.core    .core_functions import shift_to_bin_centers
 from   invisible_cities.core    .stat_functions import poisson_sigma
@@ -82,7 +81,8 @@ def expo_seed(x, y, eps=1e-12):
     """
     Estimate the seed for a exponential fit to the input data.
     """
-    x, y  = zip(*sorted(zip(x, y)))
+    order = np.lexsort((y, x))
+    x, y  = np.asarray(x)[order], np.asarray(y)[order]
     const = y[0]
     slope = (x[-1] - x[0]) / np.log(y[-1] / (y[0] + eps))
     seed  = const, slope
@@ -118,7 +118,15 @@ def quick_gauss_fit(data, bins):
     automatically estimated.
     """
     y, x  = np.histogram(data, bins)
-    x     = shift_to_bin_centers(x)
+    return quick_gauss_fit_histo(y, x)
+
+
+def quick_gauss_fit_histo(y, bins):
+    """
+    Same as quick_gauss_fit, for an already computed histogram
+    (entries y and limits bins).
+    """
+    x     = shift_to_bin_centers(bins)
     seed  = gauss_seed(x, y)
     f     = fitf.fit(fitf.gauss, x, y, seed)
     assert np.all(f.values != seed)
@@ -197,6 +205,40 @@ def fit_slices_1d_gauss(xdata, ydata, xbins, ybins,
     return Measurement(mean, meanu), Measurement(sigma, sigmau), chi2, valid
 
 
+def fit_slices_1d_gauss_histo(counts, ybins,
+                              min_entries   = 1e2,
+                              ignore_errors = _FIT_EXCEPTIONS):
+    """
+    Same as fit_slices_1d_gauss, for the already computed histograms
+    of the slices (counts, shape (number of x slices, len(ybins) - 1)).
+    The results are the same as those of fit_slices_1d_gauss on the
+    data of the histograms.
+    """
+    nbins  = len(counts)
+    mean   = np.zeros(nbins)
+    sigma  = np.zeros(nbins)
+    meanu  = np.zeros(nbins)
+    sigmau = np.zeros(nbins)
+    chi2   = np.zeros(nbins)
+    valid  = np.zeros(nbins, dtype=bool)
+
+    for i in range(nbins):
+        if np.sum(counts[i]) < min_entries: continue
+
+        try:
+            f = quick_gauss_fit_histo(counts[i], ybins)
+            mean  [i] = f.values[1]
+            meanu [i] = f.errors[1]
+            sigma [i] = f.values[2]
+            sigmau[i] = f.errors[2]
+            chi2  [i] = f.chi2
+            valid [i] = True
+        except Exception as exc:
+            if not isinstance(exc, ignore_errors):
+                raise
+    return Measurement(mean, meanu), Measurement(sigma, sigmau), chi2, valid
+
+
 def fit_slices_2d_gauss(xdata, ydata, zdata, xbins, ybins, zbins,
                         min_entries   = 1e2,
                         ignore_errors = _FIT_EXCEPTIONS):
@@ -339,6 +381,7 @@ def compute_drift_v(zdata    : np.array,
                     zrange   : Tuple[float, float],
                     detector : str,
                     seed     : Tuple[float, float, float, float] = None,
+                    dv_prior : float = None,
                     )->Tuple[float, float]:
     """
     Computes the drift velocity for a given distribution
@@ -354,6 +397,9 @@ def compute_drift_v(zdata    : np.array,
         Fix the range in z.
     seed: length-4 tuple (optional)
         Seed for the fit.
+    dv_prior: float (optional)
+        Expected drift velocity (e.g. from a previous run), used to
+        seed the inflection point if seed is not given.
     detector: string (optional)
         Used to get the cathode position from DB.
     plot_fit: boolean (optional)
@@ -368,14 +414,32 @@ def compute_drift_v(zdata    : np.array,
     """
 
     y, x = np.histogram(zdata, nbins, zrange)
-    x    = shift_to_bin_centers(x)
+    return drift_v_from_histogram(y, x, zrange, detector, seed, dv_prior)
 
-    if seed is None: seed = np.max(y), np.mean(zrange), 0.5, np.min(y)
+
+def drift_v_from_histogram(y        : np.array,
+                           bins     : np.array,
+                           zrange   : Tuple[float, float],
+                           detector : str,
+                           seed     : Tuple[float, float, float, float] = None,
+                           dv_prior : float = None,
+                           )->Tuple[float, float]:
+    """
+    Same as compute_drift_v, for an already computed Z histogram
+    (entries y and limits bins).
+    """
+    x    = shift_to_bin_centers(bins)
 
     if detector == "new":
+        # the DB module is slow to import and only needed here
+        import invisible_cities.database.load_db as DB
         z_cathode = DB.DetectorGeo(detector).ZMAX[0]
     elif detector == "next100":
         z_cathode = 1187 # TEMPORARY
+
+    if seed is None:
+        inflection = np.mean(zrange) if dv_prior is None else z_cathode / dv_prior
+        seed       = np.max(y), inflection, 0.5, np.min(y)
     try:
         f = fitf.fit(sigmoid, x, y, seed, sigma=poisson_sigma(y), fit_range=zrange)
         dv  = z_cathode/f.values[1]
@@ -32,7 +32,10 @@ from . fit_functions                        import relative_errors
 from . fit_functions                        import to_relative
 from . fit_functions                        import fit_profile_1d_expo
 from . fit_functions                        import fit_slices_2d_gauss
+from . fit_functions                        import fit_slices_1d_gauss
+from . fit_functions                        import fit_slices_1d_gauss_histo
 from . fit_functions                        import fit_slices_2d_expo
+from . fit_functions                        import expo_seed
 
 from . kr_types                             import Measurement
 sensible_floats          = floats(-1e4, +1e4)
@@ -340,8 +343,38 @@ def test_compute_drift_v_when_moving_edge():
 
     assert dv_th == approx(dv, abs=5*dvu)
 
+def test_compute_drift_v_with_prior():
+    edge    = np.random.uniform(1100, 1150)
+    data    = np.random.normal(np.random.uniform(1000, edge, 100 * 1000), 1)
+    dv_th   = 1187 / edge
+    dv, dvu = compute_drift_v(data, 60, [1050, 1200], "next100", dv_prior=1.01 * dv_th)
+    assert dv_th == approx(dv, abs=5*dvu)
+
+
+@given(random_length_float_arrays(2, 20, min_value=1, max_value=1e4))
+def test_expo_seed_same_as_sorting_pairs(y):
+    x        = np.round(np.linspace(0, 1, len(y)))[::-1] # with repeated x values
+    xs, ys   = zip(*sorted(zip(x, y)))
+    expected = ys[0], (xs[-1] - xs[0]) / np.log(ys[-1] / (ys[0] + 1e-12))
+    assert_allclose(expo_seed(x, y), expected)
+
+
 def test_sigmoid_failing_fit_return_nan():
     dst     = np.random.rand(1000)
     dv_vect = compute_drift_v(dst, nbins=35, zrange=(500, 640), seed=None, detector="new")
     nans    = np.array([np.nan, np.nan])
     assert dv_vect, nans
+
+
+def test_fit_slices_1d_gauss_histo_same_as_fit_slices_1d_gauss():
+    xdata  = np.random.uniform( 0,  10, 20000)
+    ydata  = np.random.normal (50, 1 + xdata / 10)
+    xbins  = np.linspace( 0, 10,  5)
+    ybins  = np.linspace(40, 60, 41)
+    counts = np.histogram2d(xdata, ydata, (xbins, ybins))[0]
+
+    expected = fit_slices_1d_gauss      (xdata , ydata, xbins, ybins)
+    result   = fit_slices_1d_gauss_histo(counts,        ybins)
+    assert_allclose(result[0].value, expected[0].value)
+    assert_allclose(result[1].value, expected[1].value)
+    assert np.all  (result[3] == expected[3])
@@ -45,7 +45,8 @@ def fit_lifetime(z       : np.array,
                  nbins_e : int,
                  range_z : Tuple[float,float],
                  range_e : Tuple[float,float],
-                 fit     : FitType = FitType.unbined)->FitCollection2:
+                 fit     : FitType = FitType.unbined,
+                 seed    : Tuple[float,float] = None)->FitCollection2:
     """
     Fits the lifetime using a profile (FitType.profile) or an unbined
     fit (FitType.unbined).
@@ -66,6 +67,9 @@ def fit_lifetime(z       : np.array,
             Range in energy.
         fit
             Selects fit type.
+        seed
+            Optional (e0, lt) seed of the profile fit (e.g. from a
+            previous run).
 
 
     Returns
@@ -96,7 +100,7 @@ def fit_lifetime(z       : np.array,
                    range2 = range_e)
 
     if fit == FitType.profile:
-        fp, fp2, fr    = fit_lifetime_profile(z, e, nbins_z, range_z)
+        fp, fp2, fr    = fit_lifetime_profile(z, e, nbins_z, range_z, seed)
     else:
         fp, fp2, fr, _ = fit_lifetime_unbined(z, e, nbins_z, range_z)
 
@@ -106,7 +110,8 @@ def fit_lifetime(z       : np.array,
 def fit_lifetime_profile(z : np.array,
                          e : np.array,
                          nbins_z : int,
-                         range_z : Tuple[float,float])->Tuple[FitPar, FitPar, FitResult]:
+                         range_z : Tuple[float,float],
+                         seed    : Tuple[float,float] = None)->Tuple[FitPar, FitPar, FitResult]:
     """
     Make a profile of the input data and fit it to an exponential
     function.
@@ -120,6 +125,9 @@ def fit_lifetime_profile(z : np.array,
             Number of bins in Z for the profile fit.
         range_z
             Range in Z for fit.
+        seed
+            Optional (e0, lt) seed of the fit. By default it is
+            estimated from the profile (expo_seed).
 
 
     Returns
@@ -160,7 +168,7 @@ def fit_lifetime_profile(z : np.array,
 
     x, y, yu  = profile1d(z, e, nbins_z, range_z)
     xu        = np.diff(x) * 0.5
-    seed      = expo_seed(x, y)
+    seed      = expo_seed(x, y) if seed is None else (seed[0], -seed[1])
 
     logging.debug(f' after profile: len (x) ={len(x)}, len (y) ={len(y)} ')
     try:
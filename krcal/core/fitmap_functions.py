@@ -27,7 +27,21 @@ from . core_functions       import uncertainty_from_measurement
 from . fit_lt_functions     import fit_lifetime
 from . fit_lt_functions     import pars_from_fcs
 from . selection_functions  import get_time_series_df
+from . selection_functions  import rphi_cell_index
+from . lt_stats_functions   import bin_index
+from . lt_stats_functions   import combine_indices
+from . lt_stats_functions   import lifetime_stats
+from . lt_stats_functions   import xy_lifetime_stats
+from . lt_stats_functions   import fit_lifetime_from_stats
+from . lt_stats_functions   import fit_lifetime_robust
+from . lt_stats_functions   import fit_lifetime_linear
+from . lt_stats_functions   import fit_lifetime_ml
+from . lt_stats_functions   import fit_lifetime_joint
+from . lt_stats_functions   import fit_lifetime_warm
 from . kr_types             import FitType, FitParTS
+from . kr_types             import RPhiMapDef
+
+from invisible_cities.core.core_functions import shift_to_bin_centers
 
 
 import logging
@@ -207,6 +221,226 @@ def fit_map_xy_df(selection_map : Dict[int, List[DataFrame]],
     return fMAP
 
 
+def fit_map_xyt_df(dst         : DataFrame,
+                   bins_x      : np.array,
+                   bins_y      : np.array,
+                   n_time_bins : int,
+                   time_range  : Tuple[float, float],
+                   nbins_z     : int,
+                   range_z     : Tuple[float, float],
+                   energy      : str                 = 'S2e',
+                   z           : str                 = 'Z',
+                   time        : str                 = 'time',
+                   n_min       : int                 = 100)->Dict[int, List[FitParTS]]:
+    """
+    Produce a XY map of unbined lifetime fits in time series, as
+    fit_map_xy_df with FitType.unbined, in a single pass over the dst.
+    Each event gets one (x, y, t) bin index and all the (cell, time bin)
+    fits are computed together from their sufficient statistics, so the
+    cost barely depends on n_time_bins.
+
+    Parameters
+    ----------
+        dst
+            The input data frame.
+        bins_x, bins_y
+            Arrays of bins along x and y.
+        n_time_bins
+            Number of time bins for the time series.
+        time_range
+            Time range of the time series (both ends included).
+        nbins_z
+            Number of bins in Z for the chi2 profile.
+        range_z
+            Range in Z for fit.
+        energy:
+            Takes by default S2e (uses S2e field in dst) but can take any value specified by str.
+        z:
+            Takes by default Z (uses Z field in dst) but can take any value specified by str.
+        time:
+            Column used for the time series.
+        n_min
+            Minimum number of events in a XY bin for fit.
+
+    Returns
+    -------
+        A Dict[int, List[FitParTS]] (see fit_map_xy_df).
+    """
+    nx, ny    = len(bins_x) - 1, len(bins_y) - 1
+    tbins     = np.linspace(time_range[0], np.nextafter(time_range[-1], np.inf), n_time_bins + 1)
+    ts        = shift_to_bin_centers(tbins)
+
+    nevt, stats = xy_lifetime_stats(dst, bins_x, bins_y, nbins_z, range_z, energy, z,
+                                    extra_index = (bin_index(dst[time].values, tbins), n_time_bins))
+    fits        = fit_lifetime_from_stats(stats, range_z)
+
+    fitted    = nevt > n_min
+    for i, j in zip(*np.where(~fitted)):
+        warnings.warn(f'Cannot fit: events in bin[{i}][{j}] ={nevt[i, j]} < {n_min}',
+                      UserWarning)
+
+    def values(array):
+        return np.where(fitted[..., np.newaxis], array, np.nan)
+
+    e0, e0u, lt, ltu, c2 = map(values, (fits.e0, fits.e0u, fits.lt, fits.ltu, fits.chi2))
+    return {i: [FitParTS(ts, e0[i, j], lt[i, j], c2[i, j], e0u[i, j], ltu[i, j])
+                for j in range(ny)]
+            for i in range(nx)}
+
+
+BATCHED_FITS = {FitType.robust: fit_lifetime_robust,
+                FitType.ml    : fit_lifetime_ml    }
+WARM_FITS    = {**BATCHED_FITS,
+                FitType.unbined: fit_lifetime_linear} # fits that can be warm started
+
+
+def fit_map_xy_batched_df(dst        : DataFrame,
+                          bins_x     : np.array,
+                          bins_y     : np.array,
+                          nbins_z    : int,
+                          range_z    : Tuple[float, float],
+                          fit        : FitType,
+                          energy     : str                 = 'S2e',
+                          z          : str                 = 'Z',
+                          time       : str                 = 'time',
+                          n_min      : int                 = 100,
+                          prior_e0   : np.array            = None,
+                          prior_lt   : np.array            = None,
+                          tolerance  : float               = 6.,
+                          **fit_params)->Dict[int, List[FitParTS]]:
+    """
+    Produce a XY map of lifetime fits with a single time bin, with the
+    layout of fit_map_xy_df, for the fit types in BATCHED_FITS, which
+    fit all the cells together: FitType.robust (fit_lifetime_robust)
+    and FitType.ml (fit_lifetime_ml), and for the fit types in
+    WARM_FITS when warm started from a prior (FitType.unbined is
+    then fit_lifetime_linear, the same fit from the sufficient
+    statistics).
+
+    Parameters
+    ----------
+        dst, bins_x, bins_y, nbins_z, range_z, energy, z, n_min
+            See fit_map_xyt_df.
+        fit
+            Selects fit type.
+        time:
+            Column used for the central time of the map.
+        prior_e0, prior_lt
+            Optional e0 and lt of each cell, shape (nx, ny), to warm
+            start the fits (see fit_lifetime_warm).
+        tolerance
+            Maximum distance to the prior to accept it without a fit.
+        fit_params
+            Parameters of the fit function of the fit type.
+
+    Returns
+    -------
+        A Dict[int, List[FitParTS]] (see fit_map_xy_df).
+    """
+    nx, ny = len(bins_x) - 1, len(bins_y) - 1
+    cell   = combine_indices((bin_index(dst.X.values, bins_x),
+                              bin_index(dst.Y.values, bins_y)), (nx, ny))
+    nevt   = np.bincount(cell + 1, minlength=nx * ny + 1)[1:].reshape(nx, ny)
+    if prior_e0 is None:
+        fits = BATCHED_FITS[fit](cell, nx * ny, dst[z].values, dst[energy].values,
+                                 nbins_z, range_z, **fit_params)
+    else:
+        fits = fit_lifetime_warm(WARM_FITS[fit], cell, nx * ny, dst[z].values, dst[energy].values,
+                                 nbins_z, range_z, np.ravel(prior_e0), np.ravel(prior_lt),
+                                 tolerance, **fit_params)
+    ts     = np.array([(dst[time].min() + dst[time].max()) / 2])
+
+    fitted = nevt > n_min
+    for i, j in zip(*np.where(~fitted)):
+        warnings.warn(f'Cannot fit: events in bin[{i}][{j}] ={nevt[i, j]} < {n_min}',
+                      UserWarning)
+    if fits.niter is not None:
+        for i, j in zip(*np.where(fitted & (fits.niter.reshape(nx, ny) < 0))):
+            warnings.warn(f'Fit did not converge in bin[{i}][{j}]', UserWarning)
+
+    def values(array):
+        return np.where(fitted, array.reshape(nx, ny), np.nan)[..., np.newaxis]
+
+    e0, e0u, lt, ltu, c2 = map(values, (fits.e0, fits.e0u, fits.lt, fits.ltu, fits.chi2))
+    return {i: [FitParTS(ts, e0[i, j], lt[i, j], c2[i, j], e0u[i, j], ltu[i, j])
+                for j in range(ny)]
+            for i in range(nx)}
+
+
+def fit_map_xy_joint_df(dst         : DataFrame,
+                        bins_x      : np.array,
+                        bins_y      : np.array,
+                        nbins_z     : int,
+                        range_z     : Tuple[float, float],
+                        energy      : str                 = 'S2e',
+                        z           : str                 = 'Z',
+                        time        : str                 = 'time',
+                        n_min       : int                 = 100,
+                        zone_radii  : Tuple[float, ...]   = (),
+                        n_time_bins : int                 = 1)->Tuple[Dict[int, List[FitParTS]],
+                                                                       DataFrame]:
+    """
+    Produce a XY map of joint lifetime fits (FitType.joint, see
+    fit_lifetime_joint), with the layout of fit_map_xy_df: a lifetime
+    per radial zone and time bin, shared by the cells of the zone, and
+    an e0 per cell. All the cells with events are used for the
+    lifetimes, but only the cells with more than n_min events get map
+    values.
+
+    Parameters
+    ----------
+        dst, bins_x, bins_y, nbins_z, range_z, energy, z, time, n_min
+            See fit_map_xyt_df.
+        zone_radii
+            Radii of the boundaries between zones (empty: one zone).
+            The zone of a cell is given by the radius of its center.
+        n_time_bins
+            Number of time bins of the lifetimes.
+
+    Returns
+    -------
+        fmap
+            A Dict[int, List[FitParTS]] (see fit_map_xy_df).
+        lt_zones
+            A DataFrame with the lifetime (lt, ltu) of each zone (zone,
+            r_min, r_max) and time bin (ts).
+    """
+    nx, ny    = len(bins_x) - 1, len(bins_y) - 1
+    tbins     = np.linspace(dst[time].min(), np.nextafter(dst[time].max(), np.inf), n_time_bins + 1)
+    ts        = shift_to_bin_centers(tbins)
+    nevt, stats = xy_lifetime_stats(dst, bins_x, bins_y, nbins_z, range_z, energy, z,
+                                    extra_index = (bin_index(dst[time].values, tbins), n_time_bins))
+
+    xc, yc    = np.meshgrid(shift_to_bin_centers(bins_x), shift_to_bin_centers(bins_y), indexing='ij')
+    zone      = np.searchsorted(zone_radii, np.hypot(xc, yc).ravel(), side='right')
+    nzones    = len(zone_radii) + 1
+    fits, lt, ltu = fit_lifetime_joint(stats.reshape(nx * ny, *stats.shape[2:]), zone, nzones, range_z)
+
+    fitted    = nevt > n_min
+    for i, j in zip(*np.where(~fitted)):
+        warnings.warn(f'Cannot fit: events in bin[{i}][{j}] ={nevt[i, j]} < {n_min}',
+                      UserWarning)
+
+    def values(array):
+        return np.where(fitted, array.reshape(nx, ny), np.nan)[..., np.newaxis]
+
+    tmap  = np.array([np.mean(ts)])
+    e0, e0u, lt_c, ltu_c, c2 = map(values, (fits.e0, fits.e0u, fits.lt, fits.ltu, fits.chi2))
+    fmap  = {i: [FitParTS(tmap, e0[i, j], lt_c[i, j], c2[i, j], e0u[i, j], ltu_c[i, j])
+                 for j in range(ny)]
+             for i in range(nx)}
+
+    radii    = np.concatenate([[0], zone_radii, [np.inf]])
+    izone, t = np.meshgrid(np.arange(nzones), np.arange(n_time_bins), indexing='ij')
+    lt_zones = DataFrame(dict(zone  = izone.ravel(),
+                              r_min = radii[:-1][izone.ravel()],
+                              r_max = radii[1: ][izone.ravel()],
+                              ts    = ts[t.ravel()],
+                              lt    = lt .ravel(),
+                              ltu   = ltu.ravel()))
+    return fmap, lt_zones
+
+
 def fit_fcs_in_rphi_sectors_df(sector        : int,
                                selection_map : Dict[int, List[DataFrame]],
                                event_map     : DataFrame,
@@ -267,13 +501,13 @@ def fit_fcs_in_rphi_sectors_df(sector        : int,
     """
 
     wedges    =[len(kre) for kre in selection_map.values() ]  # number of wedges per sector
-    tfrst     = time_diffs[0]
-    tlast     = time_diffs[-1]
+    tfrst     = time_diffs.min()
+    tlast     = time_diffs.max()
 
     fps =[]
     for i in range(wedges[sector]):
+        ts, masks =  get_time_series_df(n_time_bins, (tfrst, tlast), selection_map[sector][i])
         if event_map[sector][i] > n_min:
-            ts, masks =  get_time_series_df(n_time_bins, (tfrst, tlast), selection_map[sector][i])
             fp  = time_fcs_df(ts, masks, selection_map[sector][i],
                               nbins_z, nbins_e, range_z, range_e, energy, z, fit)
         else:
@@ -286,3 +520,62 @@ def fit_fcs_in_rphi_sectors_df(sector        : int,
 
         fps.append(fp)
     return fps
+
+
+def fit_map_rphi_df(dst         : DataFrame,
+                    rpmd        : RPhiMapDef,
+                    n_time_bins : int,
+                    time_range  : Tuple[float, float],
+                    nbins_z     : int,
+                    range_z     : Tuple[float, float],
+                    energy      : str                 = 'S2e',
+                    z           : str                 = 'Z',
+                    time        : str                 = 'time',
+                    n_min       : int                 = 100)->Dict[int, List[FitParTS]]:
+    """
+    Produce a RPHI map of unbined lifetime fits in time series, with
+    the same results as fit_fcs_in_rphi_sectors_df for every sector
+    (FitType.unbined), in a single pass over the dst: the (sector,
+    wedge, t) cell of each event is computed once and all the fits
+    are computed together from their sufficient statistics.
+
+    Parameters
+    ----------
+        dst
+            The input data frame (with R and Phi columns).
+        rpmd
+            Definition of the RPHI map.
+        Rest of parameters: see fit_map_xyt_df.
+
+    Returns
+    -------
+        A Dict[int, List[FitParTS]], one FitParTs per PHI wedge of each
+        radial sector.
+    """
+    sectors       = sorted(rpmd.phi)
+    offsets       = np.cumsum([0] + [len(rpmd.phi[s]) for s in sectors])
+    ncells        = offsets[-1]
+    tbins         = np.linspace(time_range[0], np.nextafter(time_range[-1], np.inf), n_time_bins + 1)
+    ts            = shift_to_bin_centers(tbins)
+
+    sector, wedge = rphi_cell_index(dst.R.values, dst.Phi.values, rpmd)
+    rphi          = np.where(sector >= 0, offsets[sector] + wedge, -1)
+    nevt          = np.bincount(rphi + 1, minlength=ncells + 1)[1:]
+    cell          = combine_indices((rphi, bin_index(dst[time].values, tbins)), (ncells, n_time_bins))
+    stats         = lifetime_stats(cell, ncells * n_time_bins,
+                                   dst[z].values, dst[energy].values, nbins_z, range_z)
+    fits          = fit_lifetime_from_stats(stats.reshape(ncells, n_time_bins, nbins_z, -1), range_z)
+
+    fitted        = nevt > n_min
+    for s in sectors:
+        for w in np.where(~fitted[offsets[s]: offsets[s + 1]])[0]:
+            warnings.warn(f'Cannot fit: events in s/w[{s}][{w}] ={nevt[offsets[s] + w]} < {n_min}',
+                          UserWarning)
+
+    def values(array):
+        return np.where(fitted[:, np.newaxis], array, np.nan)
+
+    e0, e0u, lt, ltu, c2 = map(values, (fits.e0, fits.e0u, fits.lt, fits.ltu, fits.chi2))
+    return {s: [FitParTS(ts, e0[c], lt[c], c2[c], e0u[c], ltu[c])
+                for c in range(offsets[s], offsets[s + 1])]
+            for s in sectors}
@@ -1,5 +1,10 @@
-import numpy as np
+import numpy  as np
+import pandas as pd
+from copy                  import deepcopy
 from dataclasses           import dataclass
+from typing                import Dict
+from typing                import Optional
+from typing                import Sequence
 from typing                import Tuple
 from invisible_cities.core import fit_functions as fitf
 
@@ -9,6 +14,7 @@ class ref_hist:
     bin_centres     : np.array
     bin_entries     : np.array
     err_bin_entries : np.array
+    bin_edges       : Optional[np.array] = None # limits of the bins (from bin_centres if None)
 
 
 def profile1d(z : np.array,
@@ -25,6 +31,50 @@ def profile1d(z : np.array,
 
 
 
+def uniform_bin_index(values : np.array,
+                      edges  : np.array)->np.array:
+    """
+    Index of the bin of each value in the uniform bins edges, as
+    np.histogram (the last bin includes its upper edge). The index
+    from the bin width is corrected against the edges, so it is exact
+    at the bin boundaries. Values outside the bins get -1.
+    """
+    nbins  = len(edges) - 1
+    index  = np.floor((values - edges[0]) * (nbins / (edges[-1] - edges[0])))
+    index  = np.clip(np.nan_to_num(index), 0, nbins - 1).astype(int)
+    index -= values <  edges[index]
+    index += values >= edges[index + 1]
+    index[values == edges[-1]] = nbins - 1
+    index[~((values >= edges[0]) & (values <= edges[-1]))] = -1
+    return index
+
+
+def centres_to_edges(bin_centres : np.array)->np.array:
+    """Limits of the uniform bins with centres bin_centres."""
+    bin_size = bin_centres[1] - bin_centres[0]
+    return np.linspace(bin_centres[0] - bin_size/2, bin_centres[-1] + bin_size/2, len(bin_centres) + 1)
+
+
+def histo_bin_edges(reference : ref_hist)->np.array:
+    """Limits of the bins of a reference histogram."""
+    if reference.bin_edges is not None:
+        return reference.bin_edges
+    return centres_to_edges(np.asarray(reference.bin_centres, dtype=float))
+
+
+def ref_hist_from_table(table : pd.DataFrame)->ref_hist:
+    """
+    Reference histogram from its table (bin_centres, bin_entries and
+    err_bin_entries columns) as plain arrays, with the limits of the
+    bins precomputed.
+    """
+    centres = np.asarray(table.bin_centres, dtype=float)
+    return ref_hist(bin_centres     = centres,
+                    bin_entries     = np.asarray(table.bin_entries    , dtype=float),
+                    err_bin_entries = np.asarray(table.err_bin_entries, dtype=float),
+                    bin_edges       = centres_to_edges(centres))
+
+
 def compute_similar_histo(param     : np.array,
                           reference : ref_hist
                           )-> Tuple[np.array, np.array]:
@@ -35,17 +85,15 @@ def compute_similar_histo(param     : np.array,
     ----------
     param : np.array
         Array to be represented in the histogram.
-    reference: pd.DataFrame
-        Dataframe with the information of a reference histogram.
+    reference: ref_hist
+        Reference histogram.
     Returns
     ----------
         Two arrays with the entries and the limits of each bin.
     """
-    bin_size   = np.diff(reference.bin_centres)[0]
-    min_Z_hist = reference.bin_centres.values[ 0] - bin_size/2
-    max_Z_hist = reference.bin_centres.values[-1] + bin_size/2
-    N, b = np.histogram(param, bins = len(reference.bin_centres),
-                        range =(min_Z_hist, max_Z_hist));
+    b     = histo_bin_edges(reference)
+    index = uniform_bin_index(np.asarray(param, dtype=float), b)
+    N     = np.bincount(index[index >= 0], minlength=len(b) - 1)
     return N, b
 
 
@@ -69,8 +117,141 @@ def normalize_histo_and_poisson_error(N : np.array,
     """
     err_N = np.sqrt(N)
 
-    norm  = 1/sum(N)/((b[-1]-b[0])/(len(b)-1))
+    norm  = 1/np.sum(N)/((b[-1]-b[0])/(len(b)-1))
     N     = N*norm
     err_N = err_N*norm
 
     return N, err_N
+
+
+def compatibility_sigmas(N          : np.array,
+                         b          : np.array,
+                         references : Sequence[ref_hist])->np.array:
+    """
+    Difference, in sigmas, between the histogram N (limits b, the
+    binning of the references) normalized as the references and each
+    of them, shape (len(references), len(N)).
+    """
+    N, err_N = normalize_histo_and_poisson_error(N, b)
+    entries  = np.array([reference.bin_entries     for reference in references], dtype=float)
+    errors   = np.array([reference.err_bin_entries for reference in references], dtype=float)
+    return (N - entries) / np.sqrt(err_N**2 + errors**2)
+
+
+def max_deviations(param      : np.array,
+                   references : Dict[str, ref_hist])->pd.Series:
+    """
+    Maximum difference, in sigmas, between the normalized histogram of
+    param and each reference histogram. The bin of each value is
+    computed once for all the references with the same binning.
+
+    Returns
+    -------
+        The maximum absolute deviation for each reference name.
+    """
+    param  = np.asarray(param, dtype=float)
+    groups = {}
+    for name, reference in references.items():
+        edges = histo_bin_edges(reference)
+        groups.setdefault((len(edges), edges[0], edges[-1]), (edges, []))[1].append(name)
+
+    deviations = {}
+    for edges, names in groups.values():
+        index  = uniform_bin_index(param, edges)
+        N      = np.bincount(index[index >= 0], minlength=len(edges) - 1)
+        sigmas = compatibility_sigmas(N, edges, [references[name] for name in names])
+        deviations.update(zip(names, np.max(np.abs(sigmas), axis=1)))
+    return pd.Series(deviations)[list(references)]
+
+
+@dataclass
+class histo_accumulator:
+    bin_width : float    # width of the fine bins
+    origin    : float    # left edge of the first fine bin
+    counts    : np.array # entries in each fine bin
+    vmin      : float    # minimum value filled
+    vmax      : float    # maximum value filled
+
+
+def new_histo_accumulator(bin_width : float)->histo_accumulator:
+    """
+    Returns an empty streaming 1d-histogram with fine bins of
+    width bin_width. The range grows as values are filled.
+    """
+    return histo_accumulator(bin_width = bin_width,
+                             origin    = np.nan   ,
+                             counts    = np.zeros(0, dtype=int),
+                             vmin      =  np.inf  ,
+                             vmax      = -np.inf  )
+
+
+def fill_histo_accumulator(acc    : histo_accumulator,
+                           values : np.array         )->None:
+    """
+    Adds a chunk of values to a streaming histogram (in place).
+    Parameters
+    ----------
+    acc: histo_accumulator
+        Histogram to fill.
+    values: np.array
+        Chunk of values.
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(values): return
+
+    vmin, vmax = np.min(values), np.max(values)
+    if np.isnan(acc.origin):
+        acc.origin = np.floor(vmin / acc.bin_width) * acc.bin_width
+    if vmin < acc.origin:
+        nshift     = int(np.ceil((acc.origin - vmin) / acc.bin_width))
+        acc.counts = np.concatenate([np.zeros(nshift, dtype=int), acc.counts])
+        acc.origin = acc.origin - nshift * acc.bin_width
+
+    index  = np.maximum(((values - acc.origin) // acc.bin_width).astype(int), 0)
+    counts = np.bincount(index, minlength=len(acc.counts))
+    counts[:len(acc.counts)] += acc.counts
+
+    acc.counts = counts
+    acc.vmin   = min(acc.vmin, vmin)
+    acc.vmax   = max(acc.vmax, vmax)
+
+
+def histogram_from_accumulator(acc        : histo_accumulator  ,
+                               n_bins     : int                ,
+                               range_hist : Tuple[float, float]
+                               )->Tuple[np.array, np.array]:
+    """
+    Rebins a streaming histogram into n_bins in range_hist. The
+    result is equivalent to np.histogram of the filled values up
+    to the width of the fine bins.
+    Returns
+    ----------
+        Two arrays with the entries and the limits of each bin.
+    """
+    centres = acc.origin + (np.arange(len(acc.counts)) + 0.5) * acc.bin_width
+    centres = np.clip(centres, acc.vmin, acc.vmax)
+    return np.histogram(centres, bins=n_bins, range=range_hist, weights=acc.counts)
+
+
+def merge_histo_accumulators(acc1 : histo_accumulator,
+                             acc2 : histo_accumulator)->histo_accumulator:
+    """
+    Returns the streaming histogram of the values filled in acc1 and
+    acc2, which must have the same bin_width.
+    """
+    if acc1.bin_width != acc2.bin_width:
+        raise ValueError(f'Cannot merge histograms with bin widths {acc1.bin_width} and {acc2.bin_width}')
+    if not len(acc1.counts): return deepcopy(acc2)
+    if not len(acc2.counts): return deepcopy(acc1)
+
+    origin = min(acc1.origin, acc2.origin)
+    start1 = int(round((acc1.origin - origin) / acc1.bin_width))
+    start2 = int(round((acc2.origin - origin) / acc2.bin_width))
+    counts = np.zeros(max(start1 + len(acc1.counts), start2 + len(acc2.counts)), dtype=int)
+    counts[start1: start1 + len(acc1.counts)] += acc1.counts
+    counts[start2: start2 + len(acc2.counts)] += acc2.counts
+    return histo_accumulator(bin_width = acc1.bin_width,
+                             origin    = origin,
+                             counts    = counts,
+                             vmin      = min(acc1.vmin, acc2.vmin),
+                             vmax      = max(acc1.vmax, acc2.vmax))
@@ -0,0 +1,102 @@
+import numpy  as np
+import pandas as pd
+
+from numpy.testing import assert_array_equal
+
+from . histo_functions import new_histo_accumulator
+from . histo_functions import fill_histo_accumulator
+from . histo_functions import histogram_from_accumulator
+from . histo_functions import merge_histo_accumulators
+from . histo_functions import ref_hist
+from . histo_functions import uniform_bin_index
+from . histo_functions import ref_hist_from_table
+from . histo_functions import compute_similar_histo
+from . histo_functions import normalize_histo_and_poisson_error
+from . histo_functions import max_deviations
+
+
+def test_histo_accumulator_same_as_histogram_for_aligned_bins():
+    times  = np.random.randint(1000, 5001, 10000).astype(float)
+    times  = np.concatenate([times, [1000, 5000]])
+    acc    = new_histo_accumulator(bin_width = 1)
+    for chunk in np.array_split(times, 7):
+        fill_histo_accumulator(acc, chunk)
+
+    nbins  = 20
+    n, b   = histogram_from_accumulator(acc, nbins, (acc.vmin, acc.vmax))
+    n0, b0 = np.histogram(times, nbins, (times.min(), times.max()))
+    assert_array_equal(b, b0)
+    assert_array_equal(n, n0)
+
+
+def test_histo_accumulator_unsorted_chunks():
+    values = np.arange(100.)
+    acc    = new_histo_accumulator(bin_width = 10)
+    fill_histo_accumulator(acc, values[50:])
+    fill_histo_accumulator(acc, values[:50])
+
+    assert acc.vmin == 0
+    assert acc.vmax == 99
+    assert_array_equal(acc.counts, np.full(10, 10))
+
+
+def test_histo_accumulator_empty_chunk():
+    acc = new_histo_accumulator(bin_width = 1)
+    fill_histo_accumulator(acc, np.array([]))
+    assert len(acc.counts) == 0
+
+
+def test_merge_histo_accumulators_same_as_filling_all_values():
+    values = np.random.uniform(0, 1000, 5000)
+    acc1   = new_histo_accumulator(bin_width = 3)
+    acc2   = new_histo_accumulator(bin_width = 3)
+    acc    = new_histo_accumulator(bin_width = 3)
+    fill_histo_accumulator(acc1, values[values >  400])
+    fill_histo_accumulator(acc2, values[values <= 400])
+    fill_histo_accumulator(acc , values)
+
+    merged = merge_histo_accumulators(acc1, acc2)
+    assert merged.origin == acc.origin
+    assert merged.vmin   == acc.vmin
+    assert merged.vmax   == acc.vmax
+    assert_array_equal(merged.counts, acc.counts)
+
+
+def test_uniform_bin_index_same_as_histogram():
+    edges  = np.linspace(-1.3, 7.1, 37)
+    values = np.concatenate([np.random.uniform(-3, 9, 10000), edges, [np.nan]])
+    index  = uniform_bin_index(values, edges)
+    inside = index >= 0
+    assert np.all(np.bincount(index[inside], minlength=36) == np.histogram(values[~np.isnan(values)], edges)[0])
+    assert np.all(inside == ((values >= edges[0]) & (values <= edges[-1])))
+
+
+def test_compute_similar_histo_same_as_histogram():
+    centres   = np.arange(5., 1300., 10.)
+    table     = pd.DataFrame(dict(bin_centres     = centres,
+                                  bin_entries     = np.ones_like(centres),
+                                  err_bin_entries = np.ones_like(centres)))
+    reference = ref_hist_from_table(table)
+    values    = np.concatenate([np.random.uniform(-100, 1400, 10000), reference.bin_edges])
+
+    N , b  = compute_similar_histo(values, reference)
+    N0, b0 = np.histogram(values, len(centres), (0, 1300))
+    assert_array_equal(b, b0)
+    assert_array_equal(N, N0)
+
+
+def test_max_deviations_same_as_each_reference():
+    values     = np.random.uniform(0, 100, 10000)
+    references = {}
+    for name, nbins in (('HE', 20), ('LB', 20), ('HighKrRate', 25)):
+        b       = np.linspace(0, 100, nbins + 1)
+        N, errN = normalize_histo_and_poisson_error(np.random.poisson(500, nbins), b)
+        references[name] = ref_hist((b[1:] + b[:-1]) / 2, N, errN)
+
+    deviations = max_deviations(values, references)
+    assert list(deviations.index) == list(references)
+    for name, reference in references.items():
+        N, b     = np.histogram(values, len(reference.bin_centres), (0, 100))
+        N, errN  = normalize_histo_and_poisson_error(N, b)
+        expected = np.max(np.abs(N - reference.bin_entries) / np.hypot(errN, reference.err_bin_entries))
+        assert np.isclose(deviations[name], expected)
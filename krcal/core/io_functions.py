@@ -1,8 +1,13 @@
 import numpy  as np
 import pandas as pd
+import tables as tb
 from   invisible_cities.core.core_functions import shift_to_bin_centers
 from   typing         import Tuple
+from   typing         import Dict
 from . kr_types       import ASectorMap
+from . kr_types       import ASectorMapTS
+
+MAP_TABLES = ('chi2', 'e0', 'e0u', 'lt', 'ltu')
 
 def write_complete_maps(asm      : ASectorMap,
                         filename : str       )->None:
@@ -14,8 +19,67 @@ def write_complete_maps(asm      : ASectorMap,
     asm.ltu .to_hdf(filename, key='ltu' , mode='a')
     if hasattr(asm, 'mapinfo'):
         asm.mapinfo.to_hdf(filename, key='mapinfo'       , mode='a')
+    if hasattr(asm, 'e0u_boot'):
+        asm.e0u_boot.to_hdf(filename, key='e0u_boot', mode='a')
+        asm.ltu_boot.to_hdf(filename, key='ltu_boot', mode='a')
+    if hasattr(asm, 'lt_zones'):
+        asm.lt_zones.to_hdf(filename, key='lt_zones', mode='a')
     if hasattr(asm, 't_evol'):
         asm.t_evol .to_hdf(filename, key='time_evolution', mode='a')
+    if hasattr(asm, 't_maps'):
+        write_time_maps(asm.t_maps, filename)
+    if hasattr(asm, 'pyramid'):
+        write_map_pyramid(asm.pyramid, filename)
+    if hasattr(asm, 'quadtree'):
+        asm.quadtree.to_hdf(filename, key='quadtree', mode='a')
+    if hasattr(asm, 'rphi'):
+        for table in MAP_TABLES + ('mapinfo',):
+            getattr(asm.rphi, table).to_hdf(filename, key=f'rphi/{table}', mode='a')
+
+
+def write_time_maps(tmaps    : ASectorMapTS,
+                    filename : str         )->None:
+    """
+    Appends a time series of maps to filename, under the group
+    time_maps: the central times in time_maps/ts and the tables of
+    the i-th map in time_maps/t<i>/.
+    """
+    pd.Series(tmaps.ts).to_hdf(filename, key='time_maps/ts', mode='a')
+    for i, amap in enumerate(tmaps.maps):
+        for table in MAP_TABLES:
+            getattr(amap, table).to_hdf(filename, key=f'time_maps/t{i}/{table}', mode='a')
+
+
+def read_time_maps(filename : str)->ASectorMapTS:
+    """
+    Reads the time series of maps written by write_time_maps.
+    """
+    ts   = pd.read_hdf(filename, 'time_maps/ts').values
+    maps = [ASectorMap(**{table: pd.read_hdf(filename, f'time_maps/t{i}/{table}')
+                          for table in MAP_TABLES},
+                       mapinfo = None)
+            for i in range(len(ts))]
+    return ASectorMapTS(ts = ts, maps = maps)
+
+
+def write_map_pyramid(maps     : Dict[int, ASectorMap],
+                      filename : str                  )->None:
+    """
+    Appends maps with several binnings to filename, under the group
+    pyramid: the tables of the map with n x n bins in pyramid/n<n>/.
+    """
+    for nbins, amap in maps.items():
+        for table in MAP_TABLES + ('mapinfo',):
+            getattr(amap, table).to_hdf(filename, key=f'pyramid/n{nbins}/{table}', mode='a')
+
+
+def read_map_pyramid(filename : str,
+                     nbins    : int)->ASectorMap:
+    """
+    Reads the map with nbins x nbins bins written by write_map_pyramid.
+    """
+    return ASectorMap(**{table: pd.read_hdf(filename, f'pyramid/n{nbins}/{table}')
+                         for table in MAP_TABLES + ('mapinfo',)})
 
 
 def compute_and_save_hist_as_pd(values     : np.array           ,
@@ -43,8 +107,33 @@ def compute_and_save_hist_as_pd(values     : np.array           ,
         If True, histogram will be normalized.
     """
     n, b = np.histogram(values, bins = n_bins,
-                        range = range_hist,
-                        density = norm)
+                        range = range_hist)
+    save_hist_as_pd(n, b, out_file, hist_name, norm)
+
+    return
+
+def save_hist_as_pd(n         : np.array   ,
+                    b         : np.array   ,
+                    out_file  : pd.HDFStore,
+                    hist_name : str        ,
+                    norm      : bool = False)->None:
+    """
+    Saves an already computed 1d-histogram in a file.
+    Parameters
+    ----------
+    n : np.array
+        Entries in each bin.
+    b : np.array
+        Limits of each bin.
+    out_file: pd.HDFStore
+        File where histogram will be saved.
+    hist_name: string
+        Name of the pd.Dataframe to contain the histogram.
+    norm: bool
+        If True, histogram will be normalized (as a density).
+    """
+    if norm:
+        n = n / np.diff(b) / n.sum()
     table = pd.DataFrame({'entries': n,
                           'magnitude': shift_to_bin_centers(b)})
     out_file.put(hist_name, table, format='table', data_columns=True)
@@ -78,6 +167,33 @@ def compute_and_save_hist2d_as_pd(values     : np.array           ,
     n, bx, by = np.histogram2d(*values, bins = n_bins,
                                range = range_hist,
                                density = norm)
+    save_hist2d_as_pd(n, bx, by, out_file, hist_name)
+
+    return
+
+def save_hist2d_as_pd(n         : np.array   ,
+                      bx        : np.array   ,
+                      by        : np.array   ,
+                      out_file  : pd.HDFStore,
+                      hist_name : str        ,
+                      norm      : bool = False)->None:
+    """
+    Saves an already computed 2d-histogram in a file.
+    Parameters
+    ----------
+    n : np.array
+        Entries in each bin.
+    bx, by : np.array
+        Limits of the bins in each axis.
+    out_file: pd.HDFStore
+        File where histogram will be saved.
+    hist_name: string
+        Name of the pd.Dataframe to contain the histogram.
+    norm: bool
+        If True, histogram will be normalized (as a density).
+    """
+    if norm:
+        n = n / n.sum() / np.outer(np.diff(bx), np.diff(by))
     bx = shift_to_bin_centers(np.unique(bx))
     by = shift_to_bin_centers(np.unique(by))
     bx, by = map(np.ravel, np.meshgrid(bx, by, indexing="ij"))
@@ -88,3 +204,17 @@ def compute_and_save_hist2d_as_pd(values     : np.array           ,
     out_file.put(hist_name, table, format='table', data_columns=True)
 
     return
+
+def write_kdst(dst      : pd.DataFrame,
+               filename : str         )->None:
+    """
+    Writes a DataFrame as a kdst file (table /DST/Events),
+    readable with IC's load_dst(s).
+    """
+    dst.to_hdf(filename,
+               key     = "DST"  , mode         = "w",
+               format  = "table", data_columns = True,
+               complib = "zlib" , complevel    = 4)
+    with tb.open_file(filename, "r+") as file:
+        file.rename_node(file.root.DST.table, "Events")
+        file.root.DST.Events.title = "Events"
@@ -2,6 +2,11 @@ from . fit_lt_functions     import fit_lifetime_profile
 from . correction_functions import e0_xy_correction
 from . fit_functions        import compute_drift_v
 from . fit_functions        import quick_gauss_fit
+from . fit_functions        import quick_gauss_fit_histo
+from . fit_functions        import drift_v_from_histogram
+from . lt_stats_functions   import lifetime_stats
+from . lt_stats_functions   import fit_lifetime_from_stats
+from . histo_functions      import uniform_bin_index
 from . kr_types             import ASectorMap
 from . kr_types             import masks_container
 from . core_functions       import resolution
@@ -9,8 +14,9 @@ from . core_functions       import resolution
 from invisible_cities.reco .corrections import apply_all_correction
 from invisible_cities.types.symbols     import NormStrategy
 
-from typing import List
-from typing import Tuple
+from typing      import List
+from typing      import Tuple
+from dataclasses import dataclass
 
 import pandas as pd
 import numpy  as np
@@ -52,6 +58,7 @@ def computing_kr_parameters(data           : pd.DataFrame,
                             nbins_dv       : int,
                             zrange_dv      : Tuple[float, float],
                             detector       : str,
+                            prior_evol     : pd.Series = None,
                             **norm_options : dict)->pd.DataFrame:
 
     """
@@ -86,6 +93,9 @@ def computing_kr_parameters(data           : pd.DataFrame,
     detector: string (optional)
         Used to get the cathode position from DB for the drift velocity
         computation.
+    prior_evol: Series (optional)
+        Expected e0, lt and dv (e.g. from a previous run), used to
+        seed the lifetime and drift velocity fits.
 
     Returns
     -------
@@ -101,13 +111,16 @@ def computing_kr_parameters(data           : pd.DataFrame,
     _, _, fr = fit_lifetime_profile(data.Z,
                                     data.S2e.values*geo_correction_factor(data.X.values,
                                                                           data.Y.values),
-                                    zslices_lt, zrange_lt)
+                                    zslices_lt, zrange_lt,
+                                    seed = None if prior_evol is None else (prior_evol.e0,
+                                                                            prior_evol.lt))
     e0,  lt  = fr.par
     e0u, ltu = fr.err
 
     ## compute drift_v
     dv, dvu  = compute_drift_v(data.Z, nbins=nbins_dv,
-                               zrange=zrange_dv, detector=detector)
+                               zrange=zrange_dv, detector=detector,
+                               dv_prior = None if prior_evol is None else prior_evol.dv)
 
   ## energy resolution and error
     tot_corr_factor = apply_all_correction(maps          = emaps,
@@ -165,6 +178,7 @@ def kr_time_evolution(ts            : np.array,
                       nbins_dv      : int,
                       zrange_dv     : Tuple[float, float],
                       detector      : str,
+                      prior_evol    : pd.Series = None,
                       **norm_options)->pd.DataFrame:
     """
     Computes some average parameters (e0, lt, drift v,
@@ -201,6 +215,8 @@ def kr_time_evolution(ts            : np.array,
     detector: string (optional)
         Used to get the cathode position from DB for the drift velocity
         computation.
+    prior_evol: Series (optional)
+        Expected e0, lt and dv, see computing_kr_parameters.
 
     Returns
     -------
@@ -222,6 +238,7 @@ def kr_time_evolution(ts            : np.array,
                                           nbins_dv      = nbins_dv,
                                           zrange_dv     = zrange_dv,
                                           detector      = detector,
+                                          prior_evol    = prior_evol,
                                           **norm_options)
         frames.append(pars)
 
@@ -277,3 +294,222 @@ def cut_time_evolution(masks_time : List[np.array],
                                        S2eff   = nS2   / nS1,
                                        Bandeff = nBand / nS2)
     return pars_table_out
+
+
+KREVOL_AVERAGES      = ('S1w', 'S1h', 'S1e', 'S2w', 'S2h', 'S2e', 'S2q', 'Nsipm', 'Xrms', 'Yrms')
+KREVOL_COUNTERS      = ('physical', 's1', 's2', 'band')
+RESOLUTION_QUANTILES = (0.001, 0.999) # range of the energy histograms of the resolution
+
+
+@dataclass
+class krevol_stats:
+    t_edges : np.array # limits of the base time bins
+    counts  : np.array # events after each KREVOL_COUNTERS step, shape (nt, 4)
+    lt      : np.array # lifetime statistics (see lifetime_stats), shape (nt, zslices_lt, 6)
+    z_histo : np.array # Z histogram for the drift velocity, shape (nt, nbins_dv)
+    z_edges : np.array # limits of the Z bins
+    e_histo : np.array # corrected energy histogram for the resolution, shape (nt, nbins_e)
+    e_edges : np.array # limits of the energy bins
+    moments : np.array # n, sum and sum of squares of KREVOL_AVERAGES, shape (nt, 3, 10)
+
+
+def histograms_in_time_bins(tbin   : np.array,
+                            nt     : int,
+                            values : np.array,
+                            edges  : np.array)->np.array:
+    """Histogram of values in each time bin (tbin -1 not used), shape (nt, len(edges) - 1)."""
+    nbins = len(edges) - 1
+    index = uniform_bin_index(values, edges)
+    ok    = (tbin >= 0) & (index >= 0)
+    return np.bincount(tbin[ok] * nbins + index[ok], minlength=nt * nbins).reshape(nt, nbins)
+
+
+def parameter_moments(data : pd.DataFrame,
+                      tbin : np.array,
+                      nt   : int)->np.array:
+    """
+    Number of events, sum and sum of squares of the KREVOL_AVERAGES
+    columns of data in each of the nt time bins (rows with a negative
+    tbin are skipped), shape (nt, 3, len(KREVOL_AVERAGES)).
+    """
+    values = np.stack([data[parameter].values for parameter in KREVOL_AVERAGES], axis=-1)
+    used   = tbin >= 0
+    ones   = np.ones(np.count_nonzero(used))
+    return np.stack([np.stack([np.bincount(tbin[used], weights=moment, minlength=nt)
+                               for moment in (ones, v, v * v)], axis=-1)
+                     for v in values[used].T], axis=-1)
+
+
+def parameter_averages(moments : np.array)->dict:
+    """
+    Means and errors of the means of the KREVOL_AVERAGES columns, with
+    the names of the kr_time_evolution table, from parameter_moments.
+    """
+    averages = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n, s, ss = np.moveaxis(moments, 1, 0)
+        mean     = s / n
+        error    = np.sqrt(np.clip(ss / n - mean**2, 0, None) / n)
+    for k, parameter in enumerate(KREVOL_AVERAGES):
+        name = parameter if parameter in ('Nsipm', 'Xrms', 'Yrms') else parameter.lower()
+        averages[name      ] = mean [:, k]
+        averages[name + 'u'] = error[:, k]
+    return averages
+
+
+def krevol_base_stats(dst           : pd.DataFrame,
+                      masks_cuts    : masks_container,
+                      fiducial      : np.array,
+                      t_edges       : np.array,
+                      emaps         : ASectorMap,
+                      bootstrap_map : ASectorMap,
+                      norm_strategy : NormStrategy,
+                      zslices_lt    : int,
+                      zrange_lt     : Tuple[float, float],
+                      nbins_dv      : int,
+                      zrange_dv     : Tuple[float, float],
+                      nbins_e       : int = 100,
+                      **norm_options)->krevol_stats:
+    """
+    Sufficient statistics of the time evolution parameters in fine
+    (base) time bins, computed in a single pass over the events. The
+    statistics of any group of consecutive base bins are the sums of
+    theirs, see windowed_time_evolution.
+
+    Parameters
+    ----------
+    dst: DataFrame
+        Kdst distribution with the cuts masks_cuts.
+    masks_cuts: masks_container
+        Container for the S1, S2 and Band cuts masks (for the efficiencies).
+    fiducial: boolean np.array
+        Events used for the parameters (fiducial events passing all the cuts).
+    t_edges: np.array
+        Limits of the (uniform) base time bins.
+    emaps, bootstrap_map, norm_strategy, zslices_lt, zrange_lt, nbins_dv, zrange_dv:
+        See computing_kr_parameters.
+    nbins_e: int
+        Number of bins of the corrected energy histograms, in the
+        RESOLUTION_QUANTILES range of all the fiducial events.
+
+    Returns
+    -------
+        A krevol_stats.
+    """
+    nt     = len(t_edges) - 1
+    tbin   = uniform_bin_index(dst.time.values, t_edges)
+    events = dst.event.values
+    def count_events(mask):
+        _, first = np.unique(events[mask], return_index=True)
+        bins     = tbin[np.flatnonzero(mask)[first]]
+        return np.bincount(bins[bins >= 0], minlength=nt)
+
+    mask_s1 = np.asarray(masks_cuts.s1, dtype=bool)
+    mask_s2 = mask_s1 & np.asarray(masks_cuts.s2  , dtype=bool)
+    band    = mask_s2 & np.asarray(masks_cuts.band, dtype=bool)
+    counts  = np.stack([count_events(mask) for mask in (np.ones(len(dst), dtype=bool),
+                                                        mask_s1, mask_s2, band)], axis=-1)
+
+    data   = dst[fiducial]
+    ftbin  = tbin[fiducial]
+    x, y   = data.X.values, data.Y.values
+    geo    = e0_xy_correction(map           = bootstrap_map,
+                              norm_strategy = norm_strategy,
+                              **norm_options)
+    lt     = lifetime_stats(ftbin, nt, data.Z.values, data.S2e.values * geo(x, y),
+                            zslices_lt, zrange_lt)
+
+    z_edges = np.linspace(*zrange_dv, nbins_dv + 1)
+    z_histo = histograms_in_time_bins(ftbin, nt, data.Z.values, z_edges)
+
+    correction = apply_all_correction(maps = emaps, apply_temp = False)
+    ecorr      = data.S2e.values * correction(x, y, data.Z.values, data.time.values)
+    finite     = np.isfinite(ecorr)
+    erange     = np.quantile(ecorr[finite], RESOLUTION_QUANTILES) if finite.any() else (0, 1)
+    e_edges    = np.linspace(*erange, nbins_e + 1)
+    e_histo    = histograms_in_time_bins(np.where(finite, ftbin, -1), nt, ecorr, e_edges)
+
+    moments = parameter_moments(data, ftbin, nt)
+
+    return krevol_stats(t_edges = t_edges,
+                        counts  = counts,
+                        lt      = lt,
+                        z_histo = z_histo,
+                        z_edges = z_edges,
+                        e_histo = e_histo,
+                        e_edges = e_edges,
+                        moments = moments)
+
+
+def window_sums(base   : np.array,
+                width  : int,
+                stride : int)->np.array:
+    """
+    Sums of base along the first axis over windows of width
+    consecutive bins, starting every stride bins, from its prefix sums:
+    overlapping windows cost the same as disjoint ones. The windows
+    that do not fit in base are dropped (a single window with all the
+    bins if base has less than width bins).
+    """
+    width  = min(width, len(base))
+    cumsum = np.concatenate([np.zeros_like(base[:1]), np.cumsum(base, axis=0)])
+    starts = np.arange(0, len(base) - width + 1, stride)
+    return cumsum[starts + width] - cumsum[starts]
+
+
+def windowed_time_evolution(stats      : krevol_stats,
+                            width      : int,
+                            stride     : int,
+                            zrange_lt  : Tuple[float, float],
+                            zrange_dv  : Tuple[float, float],
+                            detector   : str,
+                            prior_evol : pd.Series = None)->pd.DataFrame:
+    """
+    Time evolution table, with the columns of kr_time_evolution and
+    cut_time_evolution, in windows of width base bins every stride
+    base bins (overlapping if stride < width) from the base bin
+    statistics (see window_sums).
+
+    Differences with kr_time_evolution: the lifetime is the fit of the
+    lifetime statistics (fit_lifetime_from_stats), and the drift
+    velocity and resolution are fitted on histograms with the binning
+    of the base statistics.
+
+    Returns
+    -------
+    pars: DataFrame
+        One row per window, ts being the center of the window.
+    """
+    t_edges = stats.t_edges
+    width   = min(width, len(t_edges) - 1)
+    starts  = np.arange(0, len(t_edges) - width, stride)
+    ts      = (t_edges[starts] + t_edges[starts + width]) / 2
+
+    fits    = fit_lifetime_from_stats(window_sums(stats.lt, width, stride), zrange_lt)
+    counts  = dict(zip(KREVOL_COUNTERS, window_sums(stats.counts, width, stride).T))
+    moments = window_sums(stats.moments, width, stride)
+
+    dv_seed = None if prior_evol is None else prior_evol.dv
+    dv      = [drift_v_from_histogram(z_histo, stats.z_edges, zrange_dv, detector, dv_prior=dv_seed)
+               for z_histo in window_sums(stats.z_histo, width, stride)]
+
+    resol   = []
+    for e_histo in window_sums(stats.e_histo, width, stride):
+        try:
+            f = quick_gauss_fit_histo(e_histo, stats.e_edges)
+            R = resolution(f.values, f.errors, 41.5)
+        except:
+            R = resolution((np.nan,)*3, (np.nan,)*3, 41.5)
+        resol.append(R[0])
+
+    pars = dict(ts = ts,
+                e0 = fits.e0, e0u = fits.e0u,
+                lt = fits.lt, ltu = fits.ltu)
+    pars['dv'   ], pars['dvu'   ] = np.array(dv   , dtype=float).reshape(-1, 2).T
+    pars['resol'], pars['resolu'] = np.array(resol, dtype=float).reshape(-1, 2).T
+    pars.update(parameter_averages(moments))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pars['S1eff'  ] = counts['s1'  ] / counts['physical']
+        pars['S2eff'  ] = counts['s2'  ] / counts['s1']
+        pars['Bandeff'] = counts['band'] / counts['s2']
+    return pd.DataFrame(pars)
@@ -5,12 +5,21 @@ import pandas as pd
 from numpy.testing              import assert_allclose
 from flaky                      import flaky
 
+from . kr_parevol_functions     import kr_time_evolution
 from . kr_parevol_functions     import cut_time_evolution
+from . kr_parevol_functions     import window_sums
+from . kr_parevol_functions     import histograms_in_time_bins
+from . kr_parevol_functions     import krevol_base_stats
+from . kr_parevol_functions     import windowed_time_evolution
+from . kr_parevol_functions     import KREVOL_AVERAGES
 from . selection_functions      import get_time_series_df
 from . kr_types                 import masks_container
+from . testing_utils            import kr_dst_experiment
 
 from invisible_cities.io  .dst_io        import load_dst
 from invisible_cities.core.testing_utils import assert_dataframes_close
+from invisible_cities.reco.corrections   import read_maps
+from invisible_cities.types.symbols      import NormStrategy
 
 
 
@@ -95,3 +104,69 @@ def test_cut_time_evolution_multievents(folder_test_dst,
     pars_out_ue  = cut_time_evolution(masks_ue, dst_uniquevs, mask_cut_ue, pars_ue)
     pars_out_me  = cut_time_evolution(masks_me, dst_multievs, mask_cut_me, pars_me)
     assert_dataframes_close(pars_out_ue, pars_out_me)
+
+
+def test_window_sums_same_as_explicit_sums():
+    base = np.random.poisson(10, (23, 4, 3)).astype(float)
+    for width, stride in ((1, 1), (5, 1), (6, 2), (4, 4), (30, 1)):
+        sums     = window_sums(base, width, stride)
+        width    = min(width, len(base))
+        expected = [base[start: start + width].sum(axis=0)
+                    for start in range(0, len(base) - width + 1, stride)]
+        assert_allclose(sums, expected)
+
+
+def test_histograms_in_time_bins_same_as_histogram():
+    tbin   = np.random.randint(-1, 5, 10000)
+    values = np.random.normal(50, 20, 10000)
+    edges  = np.linspace(0, 100, 41)
+    histos = histograms_in_time_bins(tbin, 5, values, edges)
+    for t in range(5):
+        assert np.all(histos[t] == np.histogram(values[tbin == t], edges)[0])
+
+
+def test_windowed_time_evolution_same_as_kr_time_evolution(test_map_file):
+    dst        = kr_dst_experiment(nevt = 30000, rmax = 180, zmax = 550, seed = 5)
+    rng        = np.random.default_rng(5)
+    masks_cuts = masks_container(s1   = rng.uniform(0, 1, len(dst)) < 0.9,
+                                 s2   = rng.uniform(0, 1, len(dst)) < 0.8,
+                                 band = rng.uniform(0, 1, len(dst)) < 0.7)
+    fiducial   = ((dst.R < 150).values & masks_cuts.s1 & masks_cuts.s2 & masks_cuts.band)
+    maps       = read_maps(test_map_file)
+    parameters = dict(emaps         = maps,
+                      bootstrap_map = maps,
+                      norm_strategy = NormStrategy.max,
+                      zslices_lt    = 10,
+                      zrange_lt     = (0, 550),
+                      nbins_dv      = 20,
+                      zrange_dv     = (400, 650))
+
+    ntime          = 4
+    time_range     = dst.time.min(), dst.time.max()
+    ts, masks_time = get_time_series_df(ntime, time_range, dst)
+    pars           = kr_time_evolution(ts         = ts,
+                                       masks_time = [mask[fiducial] for mask in masks_time],
+                                       dst        = dst[fiducial],
+                                       detector   = "next100",
+                                       **parameters)
+    expected       = cut_time_evolution(masks_time, dst, masks_cuts, pars)
+
+    t_edges = np.linspace(time_range[0], np.nextafter(time_range[1], np.inf), ntime + 1)
+    stats   = krevol_base_stats(dst        = dst,
+                                masks_cuts = masks_cuts,
+                                fiducial   = fiducial,
+                                t_edges    = t_edges,
+                                **parameters)
+    evol    = windowed_time_evolution(stats, width = 1, stride = 1,
+                                      zrange_lt = parameters['zrange_lt'],
+                                      zrange_dv = parameters['zrange_dv'],
+                                      detector  = "next100")
+
+    assert_allclose(evol.ts, expected.ts)
+    for column in ('S1eff', 'S2eff', 'Bandeff'):
+        assert_allclose(evol[column], expected[column])
+    for parameter in KREVOL_AVERAGES:
+        name = parameter if parameter in ('Nsipm', 'Xrms', 'Yrms') else parameter.lower()
+        assert_allclose(evol[name      ], expected[name      ], rtol=1e-10)
+        assert_allclose(evol[name + 'u'], expected[name + 'u'], rtol=1e-6 )
+    assert np.all(np.abs(evol['lt'] - expected['lt']) < 3 * np.hypot(evol.ltu, expected.ltu))
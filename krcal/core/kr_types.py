@@ -35,6 +35,9 @@ class type_of_signal(AutoNameEnumBase):
 class FitType(Enum):
     profile = 1
     unbined = 2
+    robust  = 3
+    ml      = 4
+    joint   = 5
 
 class MapType(Enum):
     LT   = 1
@@ -126,6 +129,18 @@ class FitParTS:             # Fit parameters Time Series
     ltu  : np.array
 
 
+@dataclass
+class LtFitArrays:          # Lifetime fits of many cells at once
+    e0    : np.array
+    e0u   : np.array
+    lt    : np.array
+    ltu   : np.array
+    chi2  : np.array
+    nevt  : np.array         # number of events in the fit
+    valid : np.array
+    niter : Optional[np.array] = None # iterations to converge of iterative fits (-1: not converged)
+
+
 @dataclass
 class FitParFB:            # Fit Parameters forward-backward
     c2  : Measurement
@@ -166,6 +181,12 @@ class ASectorMap:  # Map in chamber sector containing average of pars
     mapinfo : Optional[Series]
 
 
+@dataclass
+class ASectorMapTS:  # Time series of maps
+    ts   : np.array          # central times of the time bins
+    maps : List[ASectorMap]
+
+
 @dataclass
 class FitMapValue:  # A ser of values of a FitMap
     chi2  : float
@@ -0,0 +1,683 @@
+"""Module lt_stats_functions.
+This module computes lifetime fits from sufficient statistics, which
+are accumulated for many cells at once in a single pass over the
+events.
+
+Notes
+-----
+    KrCalib code depends on the IC library.
+    Public functions are documented using numpy style convention
+
+    The unbined lifetime fit (fit_lifetime_unbined) is a linear fit of
+    y = -log(E) versus z. The moments (n, sum z, sum z^2, sum y, sum zy,
+    sum y^2) in each (cell, z bin) are enough to compute the same fit,
+    its covariance and the chi2 of the profile of y in z bins. The
+    moments of coarser cells are the sums of the moments of the finer
+    ones.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import numpy as np
+
+from typing      import Tuple
+from typing      import Optional
+from typing      import Callable
+from dataclasses import replace
+from pandas  import DataFrame
+
+from invisible_cities.core.core_functions import shift_to_bin_centers
+
+from . kr_types import LtFitArrays
+
+
+LT_MOMENTS = ('n', 'sz', 'szz', 'sy', 'szy', 'syy')
+
+
+def bin_index(values : np.array,
+              bins   : np.array)->np.array:
+    """
+    Index of the bin of each value, with bins[i] <= value < bins[i+1]
+    as in_range. Values outside the bins get -1.
+    """
+    index = np.searchsorted(bins, values, side='right') - 1
+    index[(index < 0) | (index >= len(bins) - 1)] = -1
+    return index
+
+
+def combine_indices(indices : Tuple[np.array, ...],
+                    shape   : Tuple[int, ...])->np.array:
+    """
+    Flat index of a cell from the indices along each dimension
+    (e.g. x, y and time bins). Cells with any index equal to -1
+    get -1.
+    """
+    valid = np.all([index >= 0 for index in indices], axis=0)
+    flat  = np.full(len(valid), -1, dtype=int)
+    flat[valid] = np.ravel_multi_index(tuple(index[valid] for index in indices), shape)
+    return flat
+
+
+def lifetime_stats(cell    : np.array,
+                   ncells  : int,
+                   z       : np.array,
+                   e       : np.array,
+                   nbins_z : int,
+                   range_z : Tuple[float, float],
+                   weights : np.array = None)->np.array:
+    """
+    Sufficient statistics of the lifetime fit in each (cell, z bin).
+
+    Parameters
+    ----------
+        cell
+            Flat cell index of each event (-1 for events not used).
+        ncells
+            Number of cells.
+        z
+            Array of z values.
+        e
+            Array of energy values.
+        nbins_z
+            Number of bins in Z for the profile (chi2).
+        range_z
+            Range in Z for the fit.
+        weights
+            Optional weight of each event (e.g. bootstrap counts).
+
+    Returns
+    -------
+        Array of shape (ncells, nbins_z, 6) with the moments LT_MOMENTS.
+    """
+    index, z, y, ok = stats_index(cell, nbins_z, z, e, range_z)
+    w = np.ones_like(z) if weights is None else weights[ok]
+    return weighted_stats(index, ncells, nbins_z, z, y, w)
+
+
+def stats_index(cell    : np.array,
+                nbins_z : int,
+                z       : np.array,
+                e       : np.array,
+                range_z : Tuple[float, float])->Tuple[np.array, np.array, np.array, np.array]:
+    """
+    Flat (cell, z bin) index, z and y = -log(E) of the events used
+    in the lifetime statistics, and the mask of those events.
+    """
+    iz = bin_index(z, np.linspace(*range_z, nbins_z + 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = -np.log(e)
+    ok = (cell >= 0) & (iz >= 0) & np.isfinite(y)
+    return cell[ok] * nbins_z + iz[ok], z[ok], y[ok], ok
+
+
+def weighted_stats(index   : np.array,
+                   ncells  : int,
+                   nbins_z : int,
+                   z       : np.array,
+                   y       : np.array,
+                   w       : np.array)->np.array:
+    """Moments LT_MOMENTS of the events from stats_index with weights w."""
+    size  = ncells * nbins_z
+    stats = [np.bincount(index, weights=moment, minlength=size)
+             for moment in (w, w * z, w * z * z, w * y, w * z * y, w * y * y)]
+    return np.stack(stats, axis=-1).reshape(ncells, nbins_z, len(LT_MOMENTS))
+
+
+def profile_chi2(stats   : np.array,
+                 a       : np.array,
+                 b       : np.array,
+                 range_z : Tuple[float, float])->np.array:
+    """
+    Chi2 per degree of freedom of the line y = a z + b (y = -log(E))
+    to the profile of y in the z bins of stats (bins with less than
+    two events are not used).
+    """
+    nbins_z = stats.shape[-2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nz    = stats[..., 0]
+        ymean = stats[..., 3] / nz
+        yvar  = np.clip(stats[..., 5] / nz - ymean**2, 0, None)
+        yu    = np.sqrt(yvar / nz)
+        zc    = shift_to_bin_centers(np.linspace(*range_z, nbins_z + 1))
+        used  = nz > 1
+        yfit  = a[..., np.newaxis] * zc + b[..., np.newaxis]
+        terms = np.where(used, ((ymean - yfit) / yu)**2, 0).sum(axis=-1)
+        nused = used.sum(axis=-1)
+        return np.where(nused > 2, terms / (nused - 2), terms)
+
+
+def fit_lifetime_from_stats(stats   : np.array,
+                            range_z : Tuple[float, float])->LtFitArrays:
+    """
+    Unbined lifetime fit of every cell from its sufficient statistics.
+    It gives the same results as fit_lifetime_unbined: the parameters
+    and their errors come from the linear fit of -log(E) vs z, and the
+    chi2 from the profile of -log(E) in z bins (bins with less than
+    two events are not used).
+
+    Parameters
+    ----------
+        stats
+            Array of shape (..., nbins_z, 6) (see lifetime_stats).
+        range_z
+            Range in Z of the statistics.
+
+    Returns
+    -------
+        A LtFitArrays with arrays of shape stats.shape[:-2].
+    """
+    n, sz, szz, sy, szy, syy = np.moveaxis(stats.sum(axis=-2), -1, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Szz   = szz - sz * sz / n
+        Szy   = szy - sz * sy / n
+        Syy   = syy - sy * sy / n
+        a     = Szy / Szz
+        b     = (sy - a * sz) / n
+        resid = np.clip(Syy - a * Szy, 0, None)
+        fac   = resid / (n - 2)
+
+        lt    = 1 / a
+        ltu   = lt**2 * np.sqrt(fac / Szz)
+        e0    = np.exp(-b)
+        e0u   = e0    * np.sqrt(fac * szz / (n * Szz))
+        chi2  = profile_chi2(stats, a, b, range_z)
+
+    valid = (n > 2) & (Szz > 0) & np.isfinite(a) & (a != 0)
+    def masked(values):
+        return np.where(valid, values, np.nan)
+
+    return LtFitArrays(e0    = masked(e0),
+                       e0u   = masked(e0u),
+                       lt    = masked(lt),
+                       ltu   = masked(ltu),
+                       chi2  = masked(chi2),
+                       nevt  = n,
+                       valid = valid)
+
+
+def xy_lifetime_stats(dst         : DataFrame,
+                      bins_x      : np.array,
+                      bins_y      : np.array,
+                      nbins_z     : int,
+                      range_z     : Tuple[float, float],
+                      energy      : str = 'S2e',
+                      z           : str = 'Z',
+                      extra_index : Optional[Tuple[np.array, int]] = None,
+                      weights     : np.array = None)->Tuple[np.array, np.array]:
+    """
+    Lifetime statistics of a XY grid in one pass over the dst.
+
+    Parameters
+    ----------
+        dst
+            The input data frame.
+        bins_x, bins_y
+            Arrays of bins along x and y.
+        nbins_z, range_z
+            Z binning of the statistics.
+        energy, z
+            Columns used for the fit.
+        extra_index
+            Optional (index, number of bins) of an extra dimension of
+            the cells, e.g. the time bin of each event.
+        weights
+            Optional weight of each event.
+
+    Returns
+    -------
+        nevt
+            Number of events in each XY cell (any z), shape (nx, ny).
+        stats
+            Statistics of shape (nx, ny[, nextra], nbins_z, 6).
+    """
+    nx, ny = len(bins_x) - 1, len(bins_y) - 1
+    ix     = bin_index(dst.X.values, bins_x)
+    iy     = bin_index(dst.Y.values, bins_y)
+    xy     = combine_indices((ix, iy), (nx, ny))
+    nevt   = np.bincount(xy + 1, minlength=nx * ny + 1)[1:].reshape(nx, ny)
+
+    if extra_index is None:
+        cell, shape = xy, (nx, ny)
+    else:
+        index, nextra = extra_index
+        cell , shape  = combine_indices((ix, iy, index), (nx, ny, nextra)), (nx, ny, nextra)
+
+    stats = lifetime_stats(cell, int(np.prod(shape)), dst[z].values, dst[energy].values,
+                           nbins_z, range_z, weights)
+    return nevt, stats.reshape(shape + stats.shape[1:])
+
+
+def coarsen_stats(stats  : np.array,
+                  factor : int)->np.array:
+    """
+    Statistics of a grid coarser by factor along the first two
+    dimensions (x and y), summing blocks of factor x factor cells.
+    The number of cells must be divisible by factor.
+    """
+    nx, ny = stats.shape[:2]
+    if nx % factor or ny % factor:
+        raise ValueError(f'Grid {nx}x{ny} cannot be coarsened by a factor {factor}')
+    shape  = (nx // factor, factor, ny // factor, factor) + stats.shape[2:]
+    return stats.reshape(shape).sum(axis=(1, 3))
+
+
+def bootstrap_lifetime_spread(cell        : np.array,
+                              ncells      : int,
+                              z           : np.array,
+                              e           : np.array,
+                              nbins_z     : int,
+                              range_z     : Tuple[float, float],
+                              n_bootstrap : int,
+                              seed        : Optional[int] = None)->Tuple[np.array, np.array]:
+    """
+    Poisson-bootstrap spread of the lifetime fit of every cell. Each
+    replica weights every event with a Poisson(1) count, so it only
+    costs one weighted accumulation of the statistics and one fit of
+    all the cells from them (see fit_lifetime_from_stats).
+
+    Parameters
+    ----------
+        cell, ncells, z, e, nbins_z, range_z
+            See lifetime_stats.
+        n_bootstrap
+            Number of bootstrap replicas.
+        seed
+            Seed of the random generator of the weights.
+
+    Returns
+    -------
+        Standard deviation of e0 and lt over the replicas in each
+        cell, shape (ncells,). NaN where less than two replicas give
+        a valid fit.
+    """
+    index, z, y, _ = stats_index(cell, nbins_z, z, e, range_z)
+    rng  = np.random.default_rng(seed)
+    sums = np.zeros((3, 2, ncells)) # (replicas, sum, sum of squares) x (e0, lt)
+    for _ in range(n_bootstrap):
+        w     = rng.poisson(1., len(z)).astype(float)
+        fits  = fit_lifetime_from_stats(weighted_stats(index, ncells, nbins_z, z, y, w), range_z)
+        value = np.where(fits.valid, [fits.e0, fits.lt], 0)
+        sums += [np.broadcast_to(fits.valid, value.shape), value, value**2]
+
+    n, s, ss = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = np.sqrt(np.clip(ss - s * s / n, 0, None) / (n - 1))
+    spread[n < 2] = np.nan
+    return spread[0], spread[1]
+
+
+def xy_bootstrap_spread(dst         : DataFrame,
+                        bins_x      : np.array,
+                        bins_y      : np.array,
+                        nbins_z     : int,
+                        range_z     : Tuple[float, float],
+                        n_bootstrap : int,
+                        seed        : Optional[int] = None,
+                        energy      : str = 'S2e',
+                        z           : str = 'Z')->Tuple[np.array, np.array]:
+    """
+    Poisson-bootstrap spread of e0 and lt in a XY grid (see
+    bootstrap_lifetime_spread), arrays of shape (nx, ny).
+    """
+    nx, ny = len(bins_x) - 1, len(bins_y) - 1
+    cell   = combine_indices((bin_index(dst.X.values, bins_x),
+                              bin_index(dst.Y.values, bins_y)), (nx, ny))
+    e0s, lts = bootstrap_lifetime_spread(cell, nx * ny, dst[z].values, dst[energy].values,
+                                         nbins_z, range_z, n_bootstrap, seed)
+    return e0s.reshape(nx, ny), lts.reshape(nx, ny)
+
+
+def cell_medians(cell   : np.array,
+                 ncells : int,
+                 values : np.array)->np.array:
+    """
+    Median of the values in each cell (NaN in empty cells), for all
+    the cells at once sorting the values by (cell, value).
+    """
+    counts = np.bincount(cell, minlength=ncells)
+    starts = np.cumsum(counts) - counts
+    ranked = values[np.lexsort((values, cell))]
+    filled = counts > 0
+    median = np.full(ncells, np.nan)
+    median[filled] = (ranked[starts[filled] + (counts[filled] - 1) // 2] +
+                      ranked[starts[filled] +  counts[filled]      // 2]) / 2
+    return median
+
+
+def fit_lifetime_robust(cell         : np.array,
+                        ncells       : int,
+                        z            : np.array,
+                        e            : np.array,
+                        nbins_z      : int,
+                        range_z      : Tuple[float, float],
+                        n_iterations : int   = 5,
+                        tuning       : float = 4.685,
+                        seed_e0      : np.array = None,
+                        seed_lt      : np.array = None)->LtFitArrays:
+    """
+    Robust unbined lifetime fit of every cell: iteratively reweighted
+    least squares of -log(E) vs z with Tukey bisquare weights. Each
+    iteration weights the events with their residual to the previous
+    fit of their cell, in units of tuning times the robust sigma of the
+    cell (1.4826 x median absolute residual), and fits all the cells
+    from the weighted statistics, so it costs about n_iterations + 1
+    times the plain fit.
+
+    Parameters
+    ----------
+        cell, ncells, z, e, nbins_z, range_z
+            See lifetime_stats.
+        n_iterations
+            Number of reweighting iterations (0: plain fit).
+        tuning
+            Tukey constant: events beyond tuning robust sigmas get
+            zero weight.
+        seed_e0, seed_lt
+            Optional e0 and lt of each cell (e.g. from a previous run)
+            for the first weights, instead of the plain fit (NaN: no seed).
+
+    Returns
+    -------
+        A LtFitArrays with arrays of shape (ncells,). nevt is the sum
+        of the weights of the events in the fit.
+    """
+    index, z, y, _ = stats_index(cell, nbins_z, z, e, range_z)
+    cell = index // nbins_z
+    w    = np.ones_like(z)
+    fits = fit_lifetime_from_stats(weighted_stats(index, ncells, nbins_z, z, y, w), range_z)
+    if seed_e0 is not None:
+        seeded = np.isfinite(seed_e0) & np.isfinite(seed_lt) & fits.valid
+        fits   = replace(fits, e0 = np.where(seeded, seed_e0, fits.e0),
+                               lt = np.where(seeded, seed_lt, fits.lt))
+    for _ in range(n_iterations):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            resid = y - (z / fits.lt[cell] - np.log(fits.e0[cell]))
+            resid = np.where(fits.valid[cell], resid, 0)
+            scale = 1.4826 * cell_medians(cell, ncells, np.abs(resid))
+            u     = resid / (tuning * scale[cell])
+        w    = np.where(np.abs(u) < 1, (1 - u**2)**2, 0)
+        w    = np.where(fits.valid[cell] & (scale[cell] > 0), w, 1)
+        fits = fit_lifetime_from_stats(weighted_stats(index, ncells, nbins_z, z, y, w), range_z)
+    return fits
+
+
+def fit_lifetime_linear(cell    : np.array,
+                        ncells  : int,
+                        z       : np.array,
+                        e       : np.array,
+                        nbins_z : int,
+                        range_z : Tuple[float, float],
+                        seed_e0 : np.array = None,
+                        seed_lt : np.array = None)->LtFitArrays:
+    """
+    Unbined lifetime fit of every cell (fit_lifetime_from_stats of its
+    lifetime_stats) with the signature of the iterative fits, so that
+    the default fit can be warm started (see fit_lifetime_warm). The
+    fit is linear: the seeds are accepted and not needed.
+    """
+    return fit_lifetime_from_stats(lifetime_stats(cell, ncells, z, e, nbins_z, range_z), range_z)
+
+
+def fit_lifetime_ml(cell         : np.array,
+                    ncells       : int,
+                    z            : np.array,
+                    e            : np.array,
+                    nbins_z      : int,
+                    range_z      : Tuple[float, float],
+                    n_iterations : int   = 20,
+                    tolerance    : float = 1e-6,
+                    seed_e0      : np.array = None,
+                    seed_lt      : np.array = None)->LtFitArrays:
+    """
+    Unbined maximum likelihood lifetime fit of every cell, with a
+    gaussian smearing of the energy around E0 exp(-Z/lt). The
+    likelihood is maximized with Gauss-Newton steps (the scoring
+    iterations of the gaussian model) for all the cells at once,
+    starting from the linear fit of -log(E) vs z. The parameter errors
+    come from the inverse of the Fisher matrix, with the smearing
+    estimated from the residuals.
+
+    Parameters
+    ----------
+        cell, ncells, z, e, nbins_z, range_z
+            See lifetime_stats.
+        n_iterations
+            Maximum number of iterations.
+        tolerance
+            A cell converges when the relative change of E0 and 1/lt
+            in an iteration is below tolerance.
+        seed_e0, seed_lt
+            Optional starting e0 and lt of each cell (e.g. from a
+            previous run) instead of the linear fit (NaN: no seed).
+
+    Returns
+    -------
+        A LtFitArrays with arrays of shape (ncells,). niter has the
+        iterations needed by each cell (-1: not converged); the cells
+        that did not converge are not valid. chi2 is computed as in
+        fit_lifetime_from_stats.
+    """
+    index, z, y, ok = stats_index(cell, nbins_z, z, e, range_z)
+    e     = e[ok]
+    cell  = index // nbins_z
+    stats = weighted_stats(index, ncells, nbins_z, z, y, np.ones_like(z))
+    seed  = fit_lifetime_from_stats(stats, range_z)
+
+    def normal_equations(e0, a):
+        f = np.exp(-a[cell] * z)
+        g = -e0[cell] * z * f
+        r = e - e0[cell] * f
+        return [np.bincount(cell, weights=w, minlength=ncells)
+                for w in (f * f, f * g, g * g, f * r, g * r, r * r)]
+
+    e0, a  = seed.e0.copy(), 1 / seed.lt
+    if seed_e0 is not None:
+        seeded = np.isfinite(seed_e0) & np.isfinite(seed_lt) & seed.valid
+        e0     = np.where(seeded, seed_e0, e0)
+        a      = np.where(seeded, 1 / seed_lt, a)
+    niter  = np.full(ncells, -1)
+    active = seed.valid.copy()
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for iteration in range(1, n_iterations + 1):
+            sff, sfg, sgg, sfr, sgr, _ = normal_equations(e0, a)
+            det    = sff * sgg - sfg**2
+            de0    = (sgg * sfr - sfg * sgr) / det
+            da     = (sff * sgr - sfg * sfr) / det
+            finite = active & np.isfinite(de0) & np.isfinite(da)
+            e0     = np.where(finite, e0 + de0, e0)
+            a      = np.where(finite, a  + da , a )
+            done   = finite & (np.abs(de0) <= tolerance * np.abs(e0)) \
+                            & (np.abs(da ) <= tolerance * np.abs(a ))
+            niter[done] = iteration
+            active     &= finite & ~done
+            if not active.any(): break
+
+        sff, sfg, sgg, _, _, srr = normal_equations(e0, a)
+        n     = stats[..., 0].sum(axis=-1)
+        det   = sff * sgg - sfg**2
+        s2    = srr / (n - 2)
+        lt    = 1 / a
+        e0u   = np.sqrt(s2 * sgg / det)
+        ltu   = lt**2 * np.sqrt(s2 * sff / det)
+        chi2  = profile_chi2(stats, a, -np.log(e0), range_z)
+
+    valid = seed.valid & (niter > 0) & (det > 0) & (e0 > 0) & np.isfinite(lt)
+    def masked(values):
+        return np.where(valid, values, np.nan)
+
+    return LtFitArrays(e0    = masked(e0),
+                       e0u   = masked(e0u),
+                       lt    = masked(lt),
+                       ltu   = masked(ltu),
+                       chi2  = masked(chi2),
+                       nevt  = n,
+                       valid = valid,
+                       niter = niter)
+
+
+def fit_lifetime_joint(stats   : np.array,
+                       zone    : np.array,
+                       nzones  : int,
+                       range_z : Tuple[float, float])->Tuple[LtFitArrays, np.array, np.array]:
+    """
+    Joint lifetime fit of many cells: a lifetime per (zone, time bin),
+    shared by all the cells of the zone, and an e0 per cell. It is the
+    linear least squares fit of y = -log(E) = z / lt[zone, t] + b[cell]
+    to all the events at once. The cell intercepts are eliminated
+    analytically, which leaves a (time bins x time bins) system per
+    zone, so the cost is one pass over the statistics.
+
+    Parameters
+    ----------
+        stats
+            Statistics of shape (ncells, nt, nbins_z, 6), see lifetime_stats.
+        zone
+            Zone of each cell, shape (ncells,) (-1: cell not used).
+        nzones
+            Number of zones.
+        range_z
+            Range in Z of the statistics.
+
+    Returns
+    -------
+        fits
+            A LtFitArrays with arrays of shape (ncells,). The lifetime of
+            a cell is the one of its zone, averaged over the time bins
+            with the events of the cell.
+        lt, ltu
+            Lifetime of each (zone, time bin) and its error, shape (nzones, nt).
+    """
+    n_t, sz_t, szz_t, sy_t, szy_t, syy_t = np.moveaxis(stats.sum(axis=-2), -1, 0)
+    ncells, nt = n_t.shape
+    n, sy, syy = n_t.sum(axis=1), sy_t.sum(axis=1), syy_t.sum(axis=1)
+    used       = (n > 1) & (zone >= 0)
+    izone      = np.where(used, zone, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g  = np.where(used[:, np.newaxis], sz_t / n[:, np.newaxis], 0)
+        w  = np.where(used[:, np.newaxis], n_t  / n[:, np.newaxis], 0)
+        Mc = np.einsum('ct,tu->ctu', szz_t, np.eye(nt)) - sz_t[:, :, np.newaxis] * g[:, np.newaxis, :]
+        rc = szy_t - sz_t * (sy / n)[:, np.newaxis]
+        M  = np.zeros((nzones, nt, nt))
+        r  = np.zeros((nzones, nt))
+        np.add.at(M, izone[used], Mc[used])
+        np.add.at(r, izone[used], rc[used])
+
+        Minv   = np.linalg.pinv(M)
+        a      = np.einsum('ktu,ku->kt', Minv, r)
+        fitted = np.diagonal(M, axis1=1, axis2=2) > 0
+        a[~fitted] = np.nan
+
+        ac  = a[izone]                                   # slopes of the cell zone
+        b   = (sy - np.nansum(ac * sz_t, axis=1)) / n
+        ac0 = np.where(n_t > 0, ac, 0)
+        rss = (syy - 2 * (ac0 * szy_t).sum(axis=1) - 2 * b * sy + (ac0**2 * szz_t).sum(axis=1)
+               + 2 * b * (ac0 * sz_t).sum(axis=1) + n * b**2)
+        rss = np.where(used, np.clip(rss, 0, None), 0)
+        ndf = (np.bincount(izone, weights=np.where(used, n - 1, 0), minlength=nzones)
+               - fitted.sum(axis=1))
+        s2  = np.bincount(izone, weights=rss, minlength=nzones) / ndf
+
+        lt    = 1 / a
+        ltu   = lt**2 * np.sqrt(s2[:, np.newaxis] * np.diagonal(Minv, axis1=1, axis2=2))
+        slope = (ac0 * w).sum(axis=1)
+        Mz    = Minv[izone]
+        e0    = np.exp(-b)
+        e0u   = e0 * np.sqrt(s2[izone] * (1 / n + np.einsum('ct,ctu,cu->c', g, Mz, g)))
+        lt_c  = 1 / slope
+        ltu_c = lt_c**2 * np.sqrt(s2[izone] * np.einsum('ct,ctu,cu->c', w, Mz, w))
+        chi2  = profile_chi2(stats.sum(axis=1), slope, b, range_z)
+
+    valid = used & np.isfinite(lt_c) & np.isfinite(e0) & np.all(fitted[izone] | (n_t == 0), axis=1)
+    def masked(values):
+        return np.where(valid, values, np.nan)
+
+    fits = LtFitArrays(e0    = masked(e0),
+                       e0u   = masked(e0u),
+                       lt    = masked(lt_c),
+                       ltu   = masked(ltu_c),
+                       chi2  = masked(chi2),
+                       nevt  = n,
+                       valid = valid)
+    return fits, lt, ltu
+
+
+def prior_distance(stats    : np.array,
+                   prior_e0 : np.array,
+                   prior_lt : np.array)->np.array:
+    """
+    Distance between the linear fit of -log(E) vs z of each cell and a
+    prior (e0, lt), as the chi2 of the prior parameters with the fit
+    covariance (2 degrees of freedom). NaN where the fit or the prior
+    is not defined.
+    """
+    n, sz, szz, sy, szy, syy = np.moveaxis(stats.sum(axis=-2), -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Szz = szz - sz * sz / n
+        a   = (szy - sz * sy / n) / Szz
+        b   = (sy - a * sz) / n
+        fac = np.clip(syy - sy * sy / n - a * (szy - sz * sy / n), 0, None) / (n - 2)
+        da  = 1 / prior_lt - a
+        db  = -np.log(prior_e0) - b
+        return (szz * da**2 + 2 * sz * da * db + n * db**2) / fac
+
+
+def fit_lifetime_warm(fit       : Callable,
+                      cell      : np.array,
+                      ncells    : int,
+                      z         : np.array,
+                      e         : np.array,
+                      nbins_z   : int,
+                      range_z   : Tuple[float, float],
+                      prior_e0  : np.array,
+                      prior_lt  : np.array,
+                      tolerance : float = 6.,
+                      **fit_params)->LtFitArrays:
+    """
+    Lifetime fit of every cell warm-started from a prior (e.g. the map
+    of the previous run). The cells whose statistics agree with the
+    prior (prior_distance below tolerance) take the prior e0 and lt,
+    with the errors of the linear fit of their statistics, and are not
+    fitted again. The rest are fitted with fit (fit_lifetime_robust or
+    fit_lifetime_ml) seeded with the prior.
+
+    Parameters
+    ----------
+        fit
+            Iterative fit function of the cells that change.
+        cell, ncells, z, e, nbins_z, range_z
+            See lifetime_stats.
+        prior_e0, prior_lt
+            Prior e0 and lt of each cell, shape (ncells,) (NaN: no prior).
+        tolerance
+            Maximum prior_distance to accept the prior.
+        fit_params
+            Parameters of fit.
+
+    Returns
+    -------
+        A LtFitArrays with arrays of shape (ncells,). niter is 0 in
+        the cells that take the prior.
+    """
+    stats = lifetime_stats(cell, ncells, z, e, nbins_z, range_z)
+    plain = fit_lifetime_from_stats(stats, range_z)
+    keep  = plain.valid & (np.nan_to_num(prior_distance(stats, prior_e0, prior_lt), nan=np.inf) < tolerance)
+    refit = np.where((cell >= 0) & ~keep[np.clip(cell, 0, None)], cell, -1)
+    fits  = fit(refit, ncells, z, e, nbins_z, range_z,
+                seed_e0 = prior_e0, seed_lt = prior_lt, **fit_params)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = profile_chi2(stats, 1 / prior_lt, -np.log(prior_e0), range_z)
+    def merge(prior_values, values):
+        return np.where(keep, prior_values, values)
+
+    return LtFitArrays(e0    = merge(prior_e0  , fits.e0  ),
+                       e0u   = merge(plain.e0u , fits.e0u ),
+                       lt    = merge(prior_lt  , fits.lt  ),
+                       ltu   = merge(plain.ltu , fits.ltu ),
+                       chi2  = merge(chi2      , fits.chi2),
+                       nevt  = merge(plain.nevt, fits.nevt),
+                       valid = keep | fits.valid,
+                       niter = None if fits.niter is None else merge(0, fits.niter))
@@ -0,0 +1,252 @@
+import numpy  as np
+import pandas as pd
+
+from pytest import approx
+from pytest import mark
+from pytest import raises
+
+from . testing_utils      import energy_lt_experiment
+from . fit_lt_functions   import fit_lifetime_unbined
+from . fitmap_functions   import fit_map_xyt_df
+from . fitmap_functions   import fit_map_rphi_df
+from . selection_functions import rphi_sectors_map
+from . lt_stats_functions import bin_index
+from . lt_stats_functions import combine_indices
+from . lt_stats_functions import lifetime_stats
+from . lt_stats_functions import fit_lifetime_from_stats
+from . lt_stats_functions import xy_lifetime_stats
+from . lt_stats_functions import coarsen_stats
+from . lt_stats_functions import bootstrap_lifetime_spread
+from . lt_stats_functions import cell_medians
+from . lt_stats_functions import fit_lifetime_robust
+from . lt_stats_functions import fit_lifetime_ml
+from . lt_stats_functions import fit_lifetime_linear
+from . lt_stats_functions import fit_lifetime_joint
+from . lt_stats_functions import prior_distance
+from . lt_stats_functions import fit_lifetime_warm
+
+
+def test_bin_index_same_as_in_range():
+    bins   = np.array([0., 1., 2., 3.])
+    values = np.array([-1, 0, 0.5, 1, 2.9, 3, 4])
+    assert np.all(bin_index(values, bins) == [-1, 0, 0, 1, 2, -1, -1])
+
+
+def test_combine_indices_invalid():
+    index = combine_indices((np.array([0, 1, -1]), np.array([2, 0, 1])), (2, 3))
+    assert np.all(index == [2, 3, -1])
+
+
+@mark.parametrize("nbins_z range_z".split(), ((12, (1, 500)), (10, (100, 400))))
+def test_fit_lifetime_from_stats_same_as_fit_lifetime_unbined(nbins_z, range_z):
+    z, e = energy_lt_experiment(10000, 1e+4, 2000, 0.05 * 1e+4)
+    _, _, fr, valid = fit_lifetime_unbined(z, e, nbins_z, range_z)
+
+    stats = lifetime_stats(np.zeros(len(z), dtype=int), 1, z, e, nbins_z, range_z)
+    fits  = fit_lifetime_from_stats(stats, range_z)
+
+    assert valid and fits.valid[0]
+    assert fits.e0 [0] == approx(fr.par[0], rel=1e-8)
+    assert fits.lt [0] == approx(fr.par[1], rel=1e-8)
+    assert fits.e0u[0] == approx(fr.err[0], rel=1e-6)
+    assert fits.ltu[0] == approx(fr.err[1], rel=1e-6)
+    assert fits.chi2[0] == approx(fr.chi2, rel=0.05)
+
+
+def test_fit_lifetime_from_stats_invalid_with_two_events():
+    z, e  = np.array([10., 20.]), np.array([100., 90.])
+    stats = lifetime_stats(np.zeros(2, dtype=int), 1, z, e, 10, (0, 100))
+    fits  = fit_lifetime_from_stats(stats, (0, 100))
+    assert not fits.valid[0]
+    assert np.isnan(fits.lt[0])
+
+
+def test_lifetime_stats_sum_of_cells():
+    z, e  = energy_lt_experiment(1000, 1e+4, 2000, 0.05 * 1e+4)
+    cell  = np.random.randint(0, 4, len(z))
+    fine  = lifetime_stats(cell                 , 4, z, e, 10, (1, 500))
+    whole = lifetime_stats(np.zeros_like(cell)  , 1, z, e, 10, (1, 500))
+    assert np.allclose(fine.sum(axis=0), whole[0])
+
+
+def test_fit_map_xyt_df_time_bins_fit_their_events():
+    z, e = energy_lt_experiment(20000, 1e+4, 2000, 0.05 * 1e+4)
+    time = np.random.uniform(0, 100, len(z))
+    x    = np.random.uniform(-10, 10, len(z))
+    y    = np.random.uniform(-10, 10, len(z))
+    dst  = pd.DataFrame(dict(X=x, Y=y, Z=z, S2e=e, time=time))
+
+    bins  = np.linspace(-10, 10, 3)
+    fmap  = fit_map_xyt_df(dst, bins, bins, 4, (0, 100), 12, (1, 500), n_min=100)
+    assert len(fmap) == 2 and len(fmap[0]) == 2
+    assert len(fmap[1][0].lt) == 4
+
+    sel   = (x >= 0) & (y < 0) & (time >= fmap[1][0].ts[2] - 12.5) & (time < fmap[1][0].ts[2] + 12.5)
+    _, _, fr, _ = fit_lifetime_unbined(z[sel], e[sel], 12, (1, 500))
+    assert fmap[1][0].lt[2] == approx(fr.par[1], rel=1e-6)
+    assert fmap[1][0].e0[2] == approx(fr.par[0], rel=1e-6)
+
+
+def test_coarsen_stats_same_as_coarse_grid():
+    z, e = energy_lt_experiment(5000, 1e+4, 2000, 0.05 * 1e+4)
+    dst  = pd.DataFrame(dict(X   = np.random.uniform(-10, 10, len(z)),
+                             Y   = np.random.uniform(-10, 10, len(z)),
+                             Z   = z, S2e = e))
+
+    nevt_fine, fine = xy_lifetime_stats(dst, np.linspace(-10, 10, 9), np.linspace(-10, 10, 9), 10, (1, 500))
+    nevt     , grid = xy_lifetime_stats(dst, np.linspace(-10, 10, 3), np.linspace(-10, 10, 3), 10, (1, 500))
+
+    assert np.all    (coarsen_stats(nevt_fine, 4) == nevt)
+    assert np.allclose(coarsen_stats(fine     , 4),  grid)
+    with raises(ValueError):
+        coarsen_stats(fine, 3)
+
+
+def test_fit_map_rphi_df_wedges_fit_their_events():
+    z, e = energy_lt_experiment(20000, 1e+4, 2000, 0.05 * 1e+4)
+    r    = np.random.uniform(0, 100, len(z))
+    phi  = np.random.uniform(-np.pi, np.pi, len(z))
+    dst  = pd.DataFrame(dict(R=r, Phi=phi, Z=z, S2e=e, time=np.random.uniform(0, 100, len(z))))
+    rpmd = rphi_sectors_map(rmax=100, nsectors=2, nwedges=3)
+
+    fmap = fit_map_rphi_df(dst, rpmd, 1, (0, 100), 12, (1, 500), n_min=100)
+    assert len(fmap) == 2 and len(fmap[1]) == 3
+
+    sel  = (r >= 50) & (phi >= np.pi / 3)
+    _, _, fr, _ = fit_lifetime_unbined(z[sel], e[sel], 12, (1, 500))
+    assert fmap[1][2].lt[0] == approx(fr.par[1], rel=1e-6)
+    assert fmap[1][2].e0[0] == approx(fr.par[0], rel=1e-6)
+
+
+def test_bootstrap_lifetime_spread_compatible_with_fit_errors():
+    z, e   = energy_lt_experiment(10000, 1e+4, 2000, 0.05 * 1e+4)
+    cell   = np.zeros(len(z), dtype=int)
+    fits   = fit_lifetime_from_stats(lifetime_stats(cell, 1, z, e, 12, (1, 500)), (1, 500))
+    e0s, lts = bootstrap_lifetime_spread(cell, 1, z, e, 12, (1, 500), n_bootstrap=200, seed=1)
+    assert e0s[0] == approx(fits.e0u[0], rel=0.2)
+    assert lts[0] == approx(fits.ltu[0], rel=0.2)
+
+
+def test_bootstrap_lifetime_spread_reproducible_and_nan_in_empty_cells():
+    z, e   = energy_lt_experiment(1000, 1e+4, 2000, 0.05 * 1e+4)
+    cell   = np.zeros(len(z), dtype=int)
+    first  = bootstrap_lifetime_spread(cell, 2, z, e, 10, (1, 500), n_bootstrap=20, seed=3)
+    second = bootstrap_lifetime_spread(cell, 2, z, e, 10, (1, 500), n_bootstrap=20, seed=3)
+    assert np.array_equal(first, second, equal_nan=True)
+    assert np.all(np.isfinite(first[0][:1])) and np.all(np.isnan(first[0][1:]))
+
+
+def test_cell_medians_same_as_median():
+    values = np.random.normal(size=1001)
+    cell   = np.random.randint(0, 3, len(values))
+    median = cell_medians(cell, 4, values)
+    assert median[:3] == approx([np.median(values[cell == i]) for i in range(3)])
+    assert np.isnan(median[3])
+
+
+def test_fit_lifetime_robust_without_outliers_same_as_plain_fit():
+    z, e  = energy_lt_experiment(10000, 1e+4, 2000, 0.05 * 1e+4)
+    cell  = np.zeros(len(z), dtype=int)
+    plain = fit_lifetime_from_stats(lifetime_stats(cell, 1, z, e, 12, (1, 500)), (1, 500))
+    fits  = fit_lifetime_robust(cell, 1, z, e, 12, (1, 500))
+    assert fits.lt[0] == approx(plain.lt[0], abs=2 * plain.ltu[0])
+    assert fits.e0[0] == approx(plain.e0[0], abs=2 * plain.e0u[0])
+
+
+def test_fit_lifetime_robust_rejects_outliers():
+    z, e    = energy_lt_experiment(10000, 1e+4, 2000, 0.05 * 1e+4)
+    outlier = np.random.uniform(size=len(z)) < 0.1
+    e       = np.where(outlier & (z > 250), 0.6 * e, e)
+    cell    = np.zeros(len(z), dtype=int)
+    plain   = fit_lifetime_from_stats(lifetime_stats(cell, 1, z, e, 12, (1, 500)), (1, 500))
+    fits    = fit_lifetime_robust(cell, 2, z, e, 12, (1, 500))
+    assert abs(fits.lt[0] - 2000) < abs(plain.lt[0] - 2000) / 3
+    assert fits.lt[0] == approx(2000, rel=0.05)
+    assert not fits.valid[1]
+
+
+def test_fit_lifetime_ml_compatible_with_plain_fit():
+    z, e  = energy_lt_experiment(10000, 1e+4, 2000, 0.05 * 1e+4)
+    cell  = np.zeros(len(z), dtype=int)
+    plain = fit_lifetime_from_stats(lifetime_stats(cell, 1, z, e, 12, (1, 500)), (1, 500))
+    fits  = fit_lifetime_ml(cell, 1, z, e, 12, (1, 500))
+    assert fits.valid[0] and fits.niter[0] > 0
+    assert fits.lt [0] == approx(plain.lt [0], abs=plain.ltu[0])
+    assert fits.lt [0] == approx(2000, abs=3 * fits.ltu[0])
+    assert fits.e0 [0] == approx(1e+4, abs=3 * fits.e0u[0]) # no bias from the log of E
+    assert fits.ltu[0] == approx(plain.ltu[0], rel=0.1)
+    assert fits.e0u[0] == approx(plain.e0u[0], rel=0.1)
+
+
+def test_fit_lifetime_ml_low_statistics_cells():
+    ncells = 200
+    z, e   = energy_lt_experiment(20 * ncells, 1e+4, 2000, 0.05 * 1e+4)
+    cell   = np.repeat(np.arange(ncells), 20)
+    fits   = fit_lifetime_ml(cell, ncells + 1, z, e, 5, (1, 500))
+    assert np.all(fits.valid[:-1]) and not fits.valid[-1]
+    assert np.all(fits.niter[:-1] > 0) and fits.niter[-1] == -1
+    pulls  = (fits.lt[:-1] - 2000) / fits.ltu[:-1]
+    assert np.mean(pulls) == approx(0, abs=0.3)
+    assert np.std (pulls) == approx(1, abs=0.3)
+
+
+def test_fit_lifetime_ml_not_converged():
+    z, e = energy_lt_experiment(1000, 1e+4, 2000, 0.05 * 1e+4)
+    fits = fit_lifetime_ml(np.zeros(len(z), dtype=int), 1, z, e, 10, (1, 500), n_iterations=1)
+    assert fits.niter[0] == -1 and not fits.valid[0]
+
+
+def test_fit_lifetime_joint_one_cell_same_as_fit_lifetime_from_stats():
+    z, e   = energy_lt_experiment(1000, 1e+4, 2000, 0.05 * 1e+4)
+    stats  = lifetime_stats(np.zeros(len(z), dtype=int), 1, z, e, 10, (1, 500))
+    plain  = fit_lifetime_from_stats(stats, (1, 500))
+    fits, lt, ltu = fit_lifetime_joint(stats[:, np.newaxis], np.zeros(1, dtype=int), 1, (1, 500))
+    for par in ('e0', 'e0u', 'lt', 'ltu', 'chi2'):
+        assert getattr(fits, par)[0] == approx(getattr(plain, par)[0], rel=1e-8)
+    assert lt [0, 0] == approx(plain.lt [0], rel=1e-8)
+    assert ltu[0, 0] == approx(plain.ltu[0], rel=1e-8)
+
+
+def test_fit_lifetime_joint_zones_and_time_bins():
+    ncells, nt = 40, 3
+    zone       = np.arange(ncells) % 2
+    lifetimes  = np.array([[2000, 2300, 2600], [3000, 3000, 3000]])
+    cell, tbin, z, e = [], [], [], []
+    for c in range(ncells):
+        for t in range(nt):
+            zi, ei = energy_lt_experiment(200, 1e+4 * (1 + 0.01 * c), lifetimes[zone[c], t], 0.05 * 1e+4)
+            cell.append(np.full(len(zi), c)); tbin.append(np.full(len(zi), t))
+            z   .append(zi)                 ; e   .append(ei)
+    cell, tbin, z, e = map(np.concatenate, (cell, tbin, z, e))
+    stats = lifetime_stats(cell * nt + tbin, ncells * nt, z, e, 10, (1, 500)).reshape(ncells, nt, 10, 6)
+
+    fits, lt, ltu = fit_lifetime_joint(stats, zone, 2, (1, 500))
+    assert np.all(np.abs(lt - lifetimes) < 4 * ltu)
+    assert np.all(fits.valid)
+    assert fits.e0 == approx(1e+4 * (1 + 0.01 * np.arange(ncells)), rel=0.01)
+
+
+def test_prior_distance_of_the_fit_is_zero():
+    z, e  = energy_lt_experiment(1000, 1e+4, 2000, 0.05 * 1e+4)
+    stats = lifetime_stats(np.zeros(len(z), dtype=int), 1, z, e, 10, (1, 500))
+    fits  = fit_lifetime_from_stats(stats, (1, 500))
+    assert prior_distance(stats, fits.e0, fits.lt)[0] == approx(0, abs=1e-6)
+    assert prior_distance(stats, fits.e0, fits.lt + 3 * fits.ltu)[0] > 6
+
+
+@mark.parametrize("fit", (fit_lifetime_ml, fit_lifetime_robust, fit_lifetime_linear))
+def test_fit_lifetime_warm_keeps_compatible_cells(fit):
+    np.random.seed(12345)
+    z, e  = energy_lt_experiment(2000, 1e+4, 2000, 0.05 * 1e+4)
+    cell  = np.random.randint(0, 3, len(z))
+    cold  = fit(cell, 3, z, e, 10, (1, 500))
+    prior_e0 = np.array([cold.e0[0], cold.e0[1], np.nan])
+    prior_lt = np.array([cold.lt[0], 1.5 * cold.lt[1], np.nan])
+    fits  = fit_lifetime_warm(fit, cell, 3, z, e, 10, (1, 500), prior_e0, prior_lt)
+
+    assert np.all(fits.valid)
+    assert fits.lt[0] == prior_lt[0] and fits.e0[0] == prior_e0[0]
+    assert np.all(np.abs(fits.lt[1:] - cold.lt[1:]) < cold.ltu[1:])
+    assert np.all(np.abs(fits.e0[1:] - cold.e0[1:]) < cold.e0u[1:])
+    if cold.niter is not None:
+        assert fits.niter[0] == 0 and np.all(fits.niter[1:] > 0)
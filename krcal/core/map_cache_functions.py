@@ -0,0 +1,213 @@
+"""Module map_cache_functions.
+This module provides a read-only cache of correction maps.
+
+A map file is read once with IC and its parameters (e0, e0u, lt, ltu, chi2)
+are stored in a sidecar .npy file, named after the hash of the HDF5 file
+content. Later loads memory-map the sidecar instead of reading the HDF5
+file, and lookups are vectorized over numpy arrays (no pandas involved).
+read_cached_maps gives the cached map as an ASectorMap (without time
+evolution), for the code that takes IC maps (e.g. the bootstrap map).
+
+Sidecar layout (1d float64 array):
+    [nx, ny, xmin, xmax, ymin, ymax, run_number, values...]
+where values is the C-ordered array of shape (len(MAP_PARAMETERS), nx, ny).
+The layout version (CACHE_VERSION) is part of the sidecar name.
+
+Notes
+-----
+    KrCalib code depends on the IC library.
+    Public functions are documented using numpy style convention
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import hashlib
+import numpy  as np
+import pandas as pd
+
+from typing      import Dict
+from typing      import Tuple
+from typing      import Optional
+from typing      import Sequence
+from dataclasses import dataclass
+
+from invisible_cities.reco.corrections import read_maps
+from invisible_cities.reco.corrections import ASectorMap
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAP_PARAMETERS = ('e0', 'e0u', 'lt', 'ltu', 'chi2')
+HEADER_SIZE    = 7
+CACHE_VERSION  = 2
+
+_loaded_maps : Dict[Tuple[str, int, int], 'cached_map'] = {}
+
+
+@dataclass
+class cached_map:
+    values     : np.array # (len(MAP_PARAMETERS), nx, ny), read-only
+    xbins      : np.array
+    ybins      : np.array
+    run_number : int = -1
+
+
+def map_file_hash(filename : str, chunk_size : int = 2**20)->str:
+    """
+    Computes the sha1 hash of the content of a file.
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def map_cache_filename(filename  : str,
+                       file_hash : str,
+                       cache_dir : Optional[str] = None)->str:
+    """
+    Returns the name of the sidecar file of a map file. By default,
+    the sidecar lives next to the map file.
+    """
+    folder = os.path.dirname(filename) if cache_dir is None else cache_dir
+    name   = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(folder, f'{name}.{file_hash[:16]}.v{CACHE_VERSION}.npy')
+
+
+def flat_array_from_amap(amap : ASectorMap)->np.array:
+    """
+    Packs an ASectorMap into the 1d array stored in the sidecar files.
+    Map DataFrames have X bins as columns and Y bins as rows, the
+    values are transposed to be indexed as [ix, iy].
+    """
+    info   = amap.mapinfo
+    nx, ny = int(info.nx), int(info.ny)
+    run    = info.get('run_number', -1)
+    header = np.array([nx, ny, info.xmin, info.xmax, info.ymin, info.ymax, run], dtype=float)
+    values = [getattr(amap, par).reindex(index=range(ny), columns=range(nx)).values.T
+              for par in MAP_PARAMETERS]
+    return np.concatenate([header, np.ravel(values)])
+
+
+def cached_map_from_flat_array(flat : np.array)->cached_map:
+    """
+    Unpacks the sidecar array into a cached_map. The values are a view
+    of the input array, so memory-mapped inputs are not copied.
+    """
+    nx, ny, xmin, xmax, ymin, ymax, run = flat[:HEADER_SIZE]
+    nx, ny = int(nx), int(ny)
+    values = flat[HEADER_SIZE:].reshape(len(MAP_PARAMETERS), nx, ny)
+    return cached_map(values     = values,
+                      xbins      = np.linspace(xmin, xmax, nx + 1),
+                      ybins      = np.linspace(ymin, ymax, ny + 1),
+                      run_number = int(run))
+
+
+def cached_map_from_amap(amap : ASectorMap)->cached_map:
+    """Read-only cached_map of an in-memory ASectorMap (no sidecar)."""
+    flat = flat_array_from_amap(amap)
+    flat.setflags(write=False)
+    return cached_map_from_flat_array(flat)
+
+
+def load_cached_map(filename  : str,
+                    cache_dir : Optional[str] = None)->cached_map:
+    """
+    Loads a correction map through its sidecar file. The sidecar is
+    created the first time the map file (identified by its content hash)
+    is seen. Within a process, a map file is only hashed and loaded once
+    as long as its size and modification time do not change.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the map file (as produced by write_complete_maps).
+    cache_dir: str (optional)
+        Folder for the sidecar files. Defaults to the map folder.
+
+    Returns
+    -------
+    cached_map
+        Read-only map parameters and bin edges.
+    """
+    filename = os.path.abspath(os.path.expandvars(filename))
+    stat     = os.stat(filename)
+    key      = filename, stat.st_size, stat.st_mtime_ns
+    if key in _loaded_maps:
+        return _loaded_maps[key]
+
+    sidecar = map_cache_filename(filename, map_file_hash(filename), cache_dir)
+    if os.path.exists(sidecar):
+        flat = np.load(sidecar, mmap_mode='r')
+    else:
+        flat = flat_array_from_amap(read_maps(filename))
+        try:
+            tmp_file = sidecar + f'.{os.getpid()}.tmp'
+            with open(tmp_file, 'wb') as f:
+                np.save(f, flat)
+            os.replace(tmp_file, sidecar)
+            flat = np.load(sidecar, mmap_mode='r')
+        except OSError:
+            log.warning(f'Cannot write map cache {sidecar}, using in-memory map')
+            flat.setflags(write=False)
+
+    cmap = cached_map_from_flat_array(flat)
+    _loaded_maps[key] = cmap
+    return cmap
+
+
+def read_cached_maps(filename  : str,
+                     cache_dir : Optional[str] = None)->ASectorMap:
+    """
+    Same as IC's read_maps, through the map cache (see load_cached_map).
+    The DataFrames are built on the cached values, and the time
+    evolution (t_evol) is not part of the cache.
+    """
+    cmap      = load_cached_map(filename, cache_dir)
+    _, nx, ny = cmap.values.shape
+    mapinfo   = pd.Series([cmap.xbins[0], cmap.xbins[-1],
+                           cmap.ybins[0], cmap.ybins[-1],
+                           nx, ny, cmap.run_number],
+                          index=['xmin', 'xmax', 'ymin', 'ymax', 'nx', 'ny', 'run_number'])
+    tables    = {par: pd.DataFrame(cmap.values[i].T, index=range(ny), columns=range(nx))
+                 for i, par in enumerate(MAP_PARAMETERS)}
+    return ASectorMap(mapinfo = mapinfo, **tables)
+
+
+def map_lookup(cmap       : cached_map,
+               x          : np.array,
+               y          : np.array,
+               parameters : Sequence[str] = ('e0', 'lt'))->Tuple[np.array, ...]:
+    """
+    Vectorized lookup of map parameters at positions (x, y). Positions
+    outside the map get NaN, as in IC's maps_coefficient_getter.
+
+    Parameters
+    ----------
+    cmap: cached_map
+        Map to read from.
+    x, y: np.array
+        Positions.
+    parameters: sequence of str
+        Names of the parameters to return (from MAP_PARAMETERS).
+
+    Returns
+    -------
+        A tuple with one array per requested parameter.
+    """
+    x  = np.asarray(x, dtype=float)
+    y  = np.asarray(y, dtype=float)
+    ix = np.searchsorted(cmap.xbins, x, side='right') - 1
+    iy = np.searchsorted(cmap.ybins, y, side='right') - 1
+
+    _, nx, ny = cmap.values.shape
+    ok        = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    planes    = np.array([MAP_PARAMETERS.index(par) for par in parameters])
+
+    output        = np.full((len(planes), len(x)), np.nan)
+    output[:, ok] = cmap.values[planes[:, np.newaxis], ix[ok], iy[ok]]
+    return tuple(output)
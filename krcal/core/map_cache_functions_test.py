@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import numpy as np
+
+from pytest        import fixture
+from numpy.testing import assert_allclose
+
+from invisible_cities.reco.corrections import read_maps
+from invisible_cities.reco.corrections import maps_coefficient_getter
+
+from . map_cache_functions import load_cached_map
+from . map_cache_functions import map_cache_filename
+from . map_cache_functions import map_file_hash
+from . map_cache_functions import map_lookup
+from . map_cache_functions import read_cached_maps
+
+
+@fixture(scope='module')
+def map_copy(test_map_file, tmpdir_factory):
+    folder   = tmpdir_factory.mktemp('map_cache')
+    filename = os.path.join(folder, os.path.basename(test_map_file))
+    shutil.copy(test_map_file, filename)
+    return filename
+
+
+def test_load_cached_map_creates_sidecar(map_copy):
+    load_cached_map(map_copy)
+    sidecar = map_cache_filename(map_copy, map_file_hash(map_copy))
+    assert os.path.exists(sidecar)
+
+
+def test_load_cached_map_is_read_only(map_copy):
+    cmap = load_cached_map(map_copy)
+    assert not cmap.values.flags.writeable
+
+
+def test_map_lookup_same_as_ic_getter(map_copy):
+    maps   = read_maps(map_copy)
+    cmap   = load_cached_map(map_copy)
+    xmin, xmax = maps.mapinfo.xmin, maps.mapinfo.xmax
+    ymin, ymax = maps.mapinfo.ymin, maps.mapinfo.ymax
+    rng    = np.random.default_rng(26)
+    x      = rng.uniform(xmin - 50, xmax + 50, 1000)
+    y      = rng.uniform(ymin - 50, ymax + 50, 1000)
+
+    e0, lt = map_lookup(cmap, x, y)
+    get_e0 = maps_coefficient_getter(maps.mapinfo, maps.e0)
+    get_lt = maps_coefficient_getter(maps.mapinfo, maps.lt)
+    assert_allclose(e0, get_e0(x, y), equal_nan=True)
+    assert_allclose(lt, get_lt(x, y), equal_nan=True)
+
+
+def test_map_lookup_nan_outside_map(map_copy):
+    cmap   = load_cached_map(map_copy)
+    x      = np.array([cmap.xbins[0] - 1, cmap.xbins[-1], np.nan])
+    y      = np.zeros_like(x)
+    e0,    = map_lookup(cmap, x, y, parameters=('e0',))
+    assert np.all(np.isnan(e0))
+
+
+def test_read_cached_maps_same_as_read_maps(map_copy):
+    maps   = read_maps(map_copy)
+    cached = read_cached_maps(map_copy)
+    for par in ('e0', 'e0u', 'lt', 'ltu', 'chi2'):
+        assert_allclose(getattr(cached, par).values, getattr(maps, par).values, equal_nan=True)
+    for field in ('xmin', 'xmax', 'ymin', 'ymax', 'nx', 'ny', 'run_number'):
+        assert cached.mapinfo[field] == maps.mapinfo[field]
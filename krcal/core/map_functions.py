@@ -12,12 +12,16 @@ Documentation
 """
 
 
+import numpy  as np
 import pandas as pd
 
 from . kr_types       import FitParTS
 from . kr_types       import ASectorMap
 from . kr_types       import SectorMapTS
 from . kr_types       import FitMapValue
+from . kr_types       import LtFitArrays
+from . kr_types       import RPhiMapDef
+from . selection_functions import rphi_cell_index
 
 from typing           import List
 from typing           import Tuple
@@ -153,6 +157,66 @@ def amap_from_tsmap(tsMap      : SectorMapTS,
                       mapinfo = None)
 
 
+def amap_from_fit_arrays(fits   : LtFitArrays,
+                         fitted : np.array = None)-> ASectorMap:
+    """
+    Obtain the maps from the fits of a XY grid of cells (arrays of
+    shape (nx, ny)), with the same layout as amap_from_tsmap (columns
+    are x bins, rows are y bins). Cells where fitted is False are NaN.
+    """
+    fitted = np.ones(fits.e0.shape, dtype=bool) if fitted is None else fitted
+    def table(values):
+        return pd.DataFrame(np.where(fitted, values, np.nan).T)
+
+    return ASectorMap(chi2    = table(fits.chi2),
+                      e0      = table(fits.e0  ),
+                      lt      = table(fits.lt  ),
+                      e0u     = table(fits.e0u ),
+                      ltu     = table(fits.ltu ),
+                      mapinfo = None)
+
+
+def rphi_map_values(amap      : ASectorMap,
+                    rpmd      : RPhiMapDef,
+                    x         : np.array,
+                    y         : np.array,
+                    parameter : str = 'e0')->np.array:
+    """
+    Values of a RPHI map (columns are radial sectors, rows are phi
+    wedges) at points (x, y). Points outside the map get NaN.
+    """
+    sector, wedge = rphi_cell_index(np.hypot(x, y), np.arctan2(y, x), rpmd)
+    inside        = sector >= 0
+    values        = np.full(len(sector), np.nan)
+    values[inside] = getattr(amap, parameter).values[wedge[inside], sector[inside]]
+    return values
+
+
+def amap_from_rphi_map(amap    : ASectorMap,
+                       rpmd    : RPhiMapDef,
+                       nbins   : int,
+                       x_range : Tuple[float, float],
+                       y_range : Tuple[float, float])->ASectorMap:
+    """
+    Resamples a RPHI map in a regular nbins x nbins XY grid: each cell
+    takes the values of the RPHI cell containing its centre.
+    """
+    xc     = np.linspace(*x_range, nbins + 1)
+    yc     = np.linspace(*y_range, nbins + 1)
+    xx, yy = np.meshgrid(xc[:-1] + np.diff(xc) / 2, yc[:-1] + np.diff(yc) / 2, indexing='ij')
+    def values(parameter):
+        return rphi_map_values(amap, rpmd, xx.ravel(), yy.ravel(), parameter).reshape(nbins, nbins)
+
+    fits = LtFitArrays(e0    = values('e0'),
+                       e0u   = values('e0u'),
+                       lt    = values('lt'),
+                       ltu   = values('ltu'),
+                       chi2  = values('chi2'),
+                       nevt  = None,
+                       valid = None)
+    return amap_from_fit_arrays(fits)
+
+
 def add_mapinfo(asm        : ASectorMap,
                 xr         : Tuple[float, float],
                 yr         : Tuple[float, float],
@@ -9,11 +9,13 @@ from pytest import approx
 
 from invisible_cities.reco.corrections      import read_maps
 from                 .kr_types              import FitMapValue
+from                 .kr_types              import LtFitArrays
 from                 .map_functions         import add_mapinfo
 from                 .map_functions         import amap_max
 from                 .map_functions         import amap_min
 from                 .map_functions         import amap_replace_nan_by_mean
 from                 .map_functions         import amap_replace_nan_by_value
+from                 .map_functions         import amap_from_fit_arrays
 
 
 @fixture(scope='session')
@@ -86,3 +88,15 @@ def test_amap_replace_nan_by_something_still_contains_mapinfo(MAPS, replace_nans
     filled_nans = replace_nans(maps, *args)
 
     assert np.all(maps.mapinfo == filled_nans.mapinfo)
+
+
+def test_amap_from_fit_arrays_layout():
+    values = np.arange(6.).reshape(3, 2) # (nx, ny)
+    fits   = LtFitArrays(values, values, values, values, values, values, values > 0)
+    fitted = np.ones_like(values, dtype=bool)
+    fitted[2, 1] = False
+    amap   = amap_from_fit_arrays(fits, fitted)
+
+    assert amap.e0.shape         == (2, 3)
+    assert amap.e0.get(1).get(0) == values[1, 0]
+    assert np.isnan(amap.lt.get(2).get(1))
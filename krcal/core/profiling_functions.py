@@ -0,0 +1,98 @@
+"""Module profiling_functions.
+This module includes the instrumentation used to profile the stages
+of the map production.
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import json
+import time
+import resource
+
+from typing      import List
+from typing      import Optional
+from contextlib  import contextmanager
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import asdict
+
+
+@dataclass
+class stage_record:
+    name        : str
+    wall_time   : float = 0.  # s
+    cpu_time    : float = 0.  # s
+    peak_rss_mb : float = 0.  # peak resident memory of the process at the end of the stage
+    rows_in     : Optional[int]   = None
+    rows_out    : Optional[int]   = None
+    throughput  : Optional[float] = None # rows_in per second
+
+
+@dataclass
+class stage_profiler:
+    records : List[stage_record] = field(default_factory=list)
+
+
+def peak_rss_mb()->float:
+    """Peak resident set size of the process in MB (Linux units)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextmanager
+def profile_stage(profiler : Optional[stage_profiler],
+                  name     : str,
+                  rows_in  : Optional[int] = None):
+    """
+    Context manager measuring a stage of the map production. It yields
+    a stage_record, where the caller can set rows_out. If profiler is
+    None nothing is measured, so the hooks can be left in place.
+
+    Parameters
+    ----------
+    profiler: stage_profiler or None
+        Where the record is appended.
+    name: str
+        Name of the stage.
+    rows_in: int (optional)
+        Number of rows entering the stage.
+    """
+    record = stage_record(name = name, rows_in = rows_in)
+    if profiler is None:
+        yield record
+        return
+
+    t0   = time.perf_counter()
+    cpu0 = time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall_time   = time.perf_counter() - t0
+        record.cpu_time    = time.process_time() - cpu0
+        record.peak_rss_mb = peak_rss_mb()
+        if rows_in is not None and record.wall_time > 0:
+            record.throughput = rows_in / record.wall_time
+        profiler.records.append(record)
+
+
+def profile_report_filename(file_out_hists : str)->str:
+    """Name of the profile report, next to the control histograms file."""
+    return os.path.splitext(file_out_hists)[0] + '_profile.json'
+
+
+def write_profile_report(profiler : stage_profiler,
+                         filename : str)->None:
+    """
+    Writes the stage records in a JSON file.
+    """
+    report = dict(stages          = [asdict(record) for record in profiler.records],
+                  total_wall_time = sum(record.wall_time for record in profiler.records),
+                  total_cpu_time  = sum(record.cpu_time  for record in profiler.records),
+                  peak_rss_mb     = peak_rss_mb())
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,57 @@
+import os
+import json
+
+from pytest import approx
+
+from . profiling_functions import stage_profiler
+from . profiling_functions import profile_stage
+from . profiling_functions import profile_report_filename
+from . profiling_functions import write_profile_report
+
+
+def test_profile_stage_records_stage():
+    profiler = stage_profiler()
+    with profile_stage(profiler, "sum", rows_in=1000) as stage:
+        sum(range(100000))
+        stage.rows_out = 10
+
+    assert len(profiler.records) == 1
+    record = profiler.records[0]
+    assert record.name       == "sum"
+    assert record.rows_in    == 1000
+    assert record.rows_out   == 10
+    assert record.wall_time   > 0
+    assert record.peak_rss_mb > 0
+    assert record.throughput == approx(1000 / record.wall_time)
+
+
+def test_profile_stage_disabled_records_nothing():
+    with profile_stage(None, "nothing", rows_in=1) as stage:
+        stage.rows_out = 1
+    assert stage.wall_time == 0
+
+
+def test_profile_stage_records_failing_stage():
+    profiler = stage_profiler()
+    try:
+        with profile_stage(profiler, "fails"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert [record.name for record in profiler.records] == ["fails"]
+
+
+def test_write_profile_report(output_tmpdir):
+    profiler = stage_profiler()
+    for name in ("load", "fit"):
+        with profile_stage(profiler, name, rows_in=1):
+            pass
+
+    filename = profile_report_filename(os.path.join(output_tmpdir, "histos.h5"))
+    write_profile_report(profiler, filename)
+    with open(filename) as f:
+        report = json.load(f)
+
+    assert filename.endswith("histos_profile.json")
+    assert [stage["name"] for stage in report["stages"]] == ["load", "fit"]
+    assert "total_wall_time" in report
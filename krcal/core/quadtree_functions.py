@@ -0,0 +1,173 @@
+"""Module quadtree_functions.
+This module produces XY lifetime maps with a density-adaptive binning:
+square cells are split recursively in four until they hold a given
+number of events, so the dense core gets small cells and the sparse
+periphery big ones.
+
+Notes
+-----
+    KrCalib code depends on the IC library.
+    Public functions are documented using numpy style convention
+
+    The events are histogrammed once, with their lifetime statistics,
+    in the finest grid allowed (2**max_depth cells per side). Every
+    node of the tree is a block of that grid.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import numpy  as np
+import pandas as pd
+
+from typing  import Tuple
+
+from . lt_stats_functions import xy_lifetime_stats
+from . lt_stats_functions import coarsen_stats
+from . lt_stats_functions import fit_lifetime_from_stats
+from . lt_stats_functions import bin_index
+from . map_functions      import amap_from_fit_arrays
+from . kr_types           import LtFitArrays
+from . kr_types           import ASectorMap
+
+
+def build_quadtree(nevt : np.array,
+                   nmax : int,
+                   nmin : int = 0)->pd.DataFrame:
+    """
+    Splits recursively the root cell until each leaf holds nmax events
+    or less, or has the size of a cell of the finest grid. A cell is
+    only split if its four children hold more than nmin events.
+
+    Parameters
+    ----------
+        nevt
+            Number of events in each cell of the finest grid, a square
+            array with 2**max_depth cells per side.
+        nmax
+            Maximum number of events in a leaf.
+        nmin
+            Minimum number of events in the children of a split cell.
+
+    Returns
+    -------
+        DataFrame with the level, i and j (indices in the grid of that
+        level, of 2**level cells per side) and nevt of each leaf.
+    """
+    max_depth = int(np.log2(nevt.shape[0]))
+    if nevt.shape != (2**max_depth, 2**max_depth):
+        raise ValueError(f'The finest grid must be square with 2**n cells per side, got {nevt.shape}')
+
+    leaves = []
+    i, j   = np.zeros(1, dtype=int), np.zeros(1, dtype=int)
+    for level in range(max_depth + 1):
+        counts = coarsen_stats(nevt, 2**(max_depth - level))[i, j]
+        split  = (counts > nmax) & (level < max_depth)
+        if split.any():
+            children = coarsen_stats(nevt, 2**(max_depth - level - 1))
+            smallest = np.min([children[2 * i + di, 2 * j + dj]
+                               for di, dj in ((0, 0), (0, 1), (1, 0), (1, 1))], axis=0)
+            split   &= smallest > nmin
+        leaves.append(pd.DataFrame(dict(level = level, i = i[~split], j = j[~split],
+                                        nevt  = counts[~split])))
+        i = np.repeat(2 * i[split], 4) + np.tile([0, 0, 1, 1], np.count_nonzero(split))
+        j = np.repeat(2 * j[split], 4) + np.tile([0, 1, 0, 1], np.count_nonzero(split))
+    return pd.concat(leaves, ignore_index=True)
+
+
+def quadtree_map(dst       : pd.DataFrame,
+                 x_range   : Tuple[float, float],
+                 y_range   : Tuple[float, float],
+                 max_depth : int,
+                 nmin      : int,
+                 k         : float,
+                 nbins_z   : int,
+                 range_z   : Tuple[float, float],
+                 energy    : str = 'S2e',
+                 z         : str = 'Z')->pd.DataFrame:
+    """
+    Lifetime map with density-adaptive XY binning. Cells are split
+    while they hold more than k * nmin events and their four children
+    more than nmin, so most leaves end up with nmin to k * nmin events,
+    and every leaf is fitted with the unbined lifetime fit. Leaves with nmin events or less are not
+    fitted (NaN), as in fit_map_xy_df.
+
+    Parameters
+    ----------
+        dst
+            The input data frame.
+        x_range, y_range
+            Range of the root cell.
+        max_depth
+            Maximum number of splits (the smallest leaves have a side
+            of the root side / 2**max_depth).
+        nmin
+            Minimum number of events for fit.
+        k
+            Leaves hold up to k * nmin events (if not at max_depth and
+            their children would hold more than nmin events).
+        nbins_z, range_z
+            Z binning of the lifetime fit.
+        energy, z
+            Columns used for the fit.
+
+    Returns
+    -------
+        The tree as a DataFrame, one row per leaf, with the columns
+        level, i, j, nevt, xmin, xmax, ymin, ymax, e0, e0u, lt, ltu, chi2.
+    """
+    nside       = 2**max_depth
+    xbins       = np.linspace(*x_range, nside + 1)
+    ybins       = np.linspace(*y_range, nside + 1)
+    nevt, stats = xy_lifetime_stats(dst, xbins, ybins, nbins_z, range_z, energy, z)
+    tree        = build_quadtree(nevt, k * nmin, nmin)
+
+    leaf_stats  = np.empty((len(tree),) + stats.shape[2:])
+    for level, leaves in tree.groupby('level'):
+        blocks = coarsen_stats(stats, 2**(max_depth - level))
+        leaf_stats[leaves.index] = blocks[leaves.i.values, leaves.j.values]
+    fits        = fit_lifetime_from_stats(leaf_stats, range_z)
+
+    size        = 2**(max_depth - tree.level.values)
+    fitted      = tree.nevt.values > nmin
+    tree        = tree.assign(xmin = xbins[ tree.i.values      * size],
+                              xmax = xbins[(tree.i.values + 1) * size],
+                              ymin = ybins[ tree.j.values      * size],
+                              ymax = ybins[(tree.j.values + 1) * size])
+    for par in ('e0', 'e0u', 'lt', 'ltu', 'chi2'):
+        tree[par] = np.where(fitted, getattr(fits, par), np.nan)
+    return tree
+
+
+def amap_from_quadtree(tree    : pd.DataFrame,
+                       nbins   : int,
+                       x_range : Tuple[float, float],
+                       y_range : Tuple[float, float])->ASectorMap:
+    """
+    Resamples a quadtree map in a regular nbins x nbins grid: each cell
+    takes the values of the leaf containing its centre. Cells outside
+    the tree are NaN.
+    """
+    xc    = np.linspace(*x_range, nbins + 1)
+    yc    = np.linspace(*y_range, nbins + 1)
+    xc    = xc[:-1] + np.diff(xc) / 2
+    yc    = yc[:-1] + np.diff(yc) / 2
+
+    leaf  = np.full((nbins, nbins), -1, dtype=int)
+    for n, (xmin, xmax, ymin, ymax) in enumerate(tree[['xmin', 'xmax', 'ymin', 'ymax']].values):
+        ix = bin_index(xc, np.array([xmin, xmax])) == 0
+        iy = bin_index(yc, np.array([ymin, ymax])) == 0
+        leaf[np.ix_(ix, iy)] = n
+
+    inside = leaf >= 0
+    def values(par):
+        return np.where(inside, tree[par].values[leaf], np.nan)
+
+    fits = LtFitArrays(e0    = values('e0'),
+                       e0u   = values('e0u'),
+                       lt    = values('lt'),
+                       ltu   = values('ltu'),
+                       chi2  = values('chi2'),
+                       nevt  = np.where(inside, tree.nevt.values[leaf], 0),
+                       valid = inside)
+    return amap_from_fit_arrays(fits)
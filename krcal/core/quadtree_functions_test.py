@@ -0,0 +1,78 @@
+import numpy  as np
+import pandas as pd
+
+from pytest import approx
+
+from . testing_utils       import energy_lt_experiment
+from . quadtree_functions  import build_quadtree
+from . quadtree_functions  import quadtree_map
+from . quadtree_functions  import amap_from_quadtree
+
+
+def test_build_quadtree_uniform_density():
+    nevt = np.full((8, 8), 10)
+    tree = build_quadtree(nevt, nmax = 40)
+    assert len(tree) == 16
+    assert np.all(tree.level == 2)
+    assert np.all(tree.nevt  == 40)
+
+
+def test_build_quadtree_splits_dense_region_only():
+    nevt        = np.ones((4, 4), dtype=int)
+    nevt[0, 0]  = 100
+    tree        = build_quadtree(nevt, nmax = 10)
+    assert tree.nevt.sum() == nevt.sum()
+    assert set(tree.level) == {1, 2}
+    assert len(tree[tree.level == 2]) == 4
+    assert np.all(tree[tree.level == 1].nevt == 4)
+
+
+def test_build_quadtree_keeps_children_above_nmin():
+    nevt = np.full((8, 8), 10)
+    tree = build_quadtree(nevt, nmax = 100, nmin = 50)
+    assert len(tree) == 4
+    assert np.all(tree.level == 1)
+    assert np.all(tree.nevt  == 160)
+
+
+def quadtree_dst(nevt):
+    z, e = energy_lt_experiment(nevt, 1e+4, 2000, 0.05 * 1e+4)
+    r    = np.abs(np.random.normal(0, 50, nevt))
+    phi  = np.random.uniform(-np.pi, np.pi, nevt)
+    return pd.DataFrame(dict(X = r * np.cos(phi), Y = r * np.sin(phi), Z = z, S2e = e))
+
+
+def test_quadtree_map_leaves_tile_the_range():
+    dst  = quadtree_dst(50000)
+    tree = quadtree_map(dst, (-200, 200), (-200, 200), max_depth=6, nmin=100, k=4,
+                        nbins_z=10, range_z=(1, 500))
+
+    area = ((tree.xmax - tree.xmin) * (tree.ymax - tree.ymin)).sum()
+    assert area == approx(400**2)
+    assert np.all(tree.nevt[tree.level > 0] > 100) # children of split cells are fitted
+    fitted = tree[tree.nevt > 100]
+    assert np.all(np.isfinite(fitted['lt']))
+    assert fitted['lt'].median() == approx(2000, rel=0.1)
+
+
+def test_amap_from_quadtree_takes_leaf_values():
+    dst  = quadtree_dst(20000)
+    tree = quadtree_map(dst, (-200, 200), (-200, 200), max_depth=5, nmin=100, k=4,
+                        nbins_z=10, range_z=(1, 500))
+    amap = amap_from_quadtree(tree, 32, (-200, 200), (-200, 200))
+
+    leaf = tree[(tree.xmin <= 0) & (tree.xmax > 0) & (tree.ymin <= 0) & (tree.ymax > 0)]
+    assert amap.e0.shape == (32, 32)
+    assert amap.lt.get(16).get(16) == leaf['lt'].values[0]
+
+
+def test_quadtree_map_with_small_k_fits_every_split_leaf():
+    dst    = quadtree_dst(200000)
+    dst.X  = np.random.uniform(-200, 200, len(dst))
+    dst.Y  = np.random.uniform(-200, 200, len(dst))
+    tree   = quadtree_map(dst, (-200, 200), (-200, 200), max_depth=6, nmin=100, k=2,
+                          nbins_z=10, range_z=(1, 500))
+    leaves = tree[tree.level > 0]
+    assert len(leaves) > 100
+    assert np.all(leaves.nevt > 100)
+    assert np.all(np.isfinite(leaves['lt']))
@@ -27,11 +27,14 @@ from  invisible_cities.core.core_functions  import shift_to_bin_centers
 
 from . fit_lt_functions import fit_lifetime_unbined
 from . fit_functions    import fit_slices_1d_gauss
+from . fit_functions    import fit_slices_1d_gauss_histo
+from . lt_stats_functions import bin_index
 from . kr_types         import Number
 from . kr_types         import Range
 from . kr_types         import HistoPar2
 from . kr_types         import ProfilePar
 from . kr_types         import FitPar
+from . kr_types         import RPhiMapDef
 
 import logging
 log = logging.getLogger(__name__)
@@ -130,6 +133,84 @@ def select_xy_sectors_df(dst    : DataFrame,
     return dstMap
 
 
+def rphi_sectors_map(rmax     : float,
+                     nsectors : int,
+                     nwedges  : int)->RPhiMapDef:
+    """
+    Defines a RPHI map with nsectors radial sectors of equal width
+    up to rmax, each one divided in nwedges phi wedges of equal angle
+    (in radians, from -pi to pi).
+    """
+    redges = np.linspace(0, rmax, nsectors + 1)
+    pedges = np.linspace(-np.pi, np.pi, nwedges + 1)
+    wedges = list(zip(pedges[:-1], pedges[1:]))
+    return RPhiMapDef(r   = {i: (redges[i], redges[i + 1]) for i in range(nsectors)},
+                      phi = {i: wedges                         for i in range(nsectors)})
+
+
+def rphi_cell_index(r    : np.array,
+                    phi  : np.array,
+                    rpmd : RPhiMapDef)->Tuple[np.array, np.array]:
+    """
+    Radial sector and phi wedge of each (r, phi) point for the
+    RPHI map defined by rpmd. Points outside the map get -1 in both.
+
+    Parameters
+    ----------
+        r, phi
+            Arrays of radius and phi (radians).
+        rpmd
+            Definition of the RPHI map (contiguous sectors and wedges).
+
+    Returns
+    -------
+        Arrays of sector and wedge indices.
+    """
+    sectors = sorted(rpmd.r)
+    redges  = np.array([rpmd.r[sectors[0]][0]] + [rpmd.r[s][1] for s in sectors])
+    sector  = bin_index(r, redges)
+    wedge   = np.full(len(sector), -1, dtype=int)
+    for s in sectors:
+        in_s        = sector == s
+        pedges      = np.array([rpmd.phi[s][0][0]] + [phi1 for _, phi1 in rpmd.phi[s]])
+        wedge[in_s] = bin_index(phi[in_s], pedges)
+    sector[wedge < 0] = -1
+    return sector, wedge
+
+
+def select_rphi_sectors_df(dst  : DataFrame,
+                           rpmd : RPhiMapDef)-> Dict[int, List[DataFrame]]:
+    """
+    Return a DataFrameMap of selections organized by RPHI sector,
+    as select_xy_sectors_df: for each radial sector (the key in the
+    dict) a list with the DataFrame of each phi wedge. The cell of
+    each event is computed once and the dst is sorted by cell, so
+    each wedge is a slice of the sorted dst.
+
+    Parameters
+    ----------
+        dst:
+        The input data frame (with R and Phi columns).
+        rpmd:
+        Definition of the RPHI map.
+
+    Returns
+    -------
+        A DataFrameMap of selections
+    """
+    sector, wedge = rphi_cell_index(dst.R.values, dst.Phi.values, rpmd)
+    sectors       = sorted(rpmd.phi)
+    offsets       = np.cumsum([0] + [len(rpmd.phi[s]) for s in sectors])
+    cell          = np.where(sector >= 0, offsets[sector] + wedge, -1)
+
+    order         = np.argsort(cell, kind='stable')
+    bounds        = np.searchsorted(cell[order], np.arange(offsets[-1] + 1))
+    sorted_dst    = dst.iloc[order]
+    return {s: [sorted_dst.iloc[bounds[offsets[s] + w]: bounds[offsets[s] + w + 1]]
+                for w in range(len(rpmd.phi[s]))]
+            for s in sectors}
+
+
 def selection_in_band(z       : np.array,
                       e       : np.array,
                       range_z : Range,
@@ -174,3 +255,232 @@ def selection_in_band(z       : np.array,
     pp = ProfilePar(x = zc, xu = zerror, y = e_mean, yu = e_sigma)
 
     return sel_inband, fpl, fph, hp, pp
+
+
+GAUSS_QUANTILES = (0.5 - 0.3413447, 0.5, 0.5 + 0.3413447) # mean -+ 1 sigma of a gaussian
+
+
+def slice_quantiles(index     : np.array,
+                    nslices   : int,
+                    values    : np.array,
+                    quantiles : Tuple[float, ...])->Tuple[np.array, np.array]:
+    """
+    Quantiles of the values in each slice, for all the slices at once
+    sorting the values by (slice, value), with the linear interpolation
+    of np.quantile. Values with index -1 are not used.
+
+    Returns
+    -------
+        The number of values in each slice, shape (nslices,), and the
+        quantiles, shape (nslices, len(quantiles)) (NaN in empty slices).
+    """
+    used   = index >= 0
+    index  = index[used]
+    counts = np.bincount(index, minlength=nslices)
+    starts = np.cumsum(counts) - counts
+    ranked = values[used][np.lexsort((values[used], index))]
+
+    filled = counts > 0
+    result = np.full((nslices, len(quantiles)), np.nan)
+    for k, q in enumerate(quantiles):
+        pos  = q * (counts[filled] - 1)
+        low  = np.floor(pos).astype(int)
+        high = np.minimum(low + 1, counts[filled] - 1)
+        frac = pos - low
+        result[filled, k] = ((1 - frac) * ranked[starts[filled] + low ] +
+                                  frac  * ranked[starts[filled] + high])
+    return counts, result
+
+
+def selection_in_band_quantiles(z           : np.array,
+                                e           : np.array,
+                                range_z     : Range,
+                                range_e     : Range,
+                                nbins_z     : int     = 50,
+                                nbins_e     : int     = 100,
+                                nsigma      : float   = 3.5,
+                                min_entries : int     = 100) ->Tuple[np.array, FitPar, FitPar,
+                                                                      HistoPar2, ProfilePar]:
+    """
+    Selection of the events inside the Kr E vs Z band, as
+    selection_in_band, with the center and width of the energy in each
+    Z slice given by its median and the half distance between its
+    15.9% and 84.1% quantiles (the mean and sigma of a gaussian)
+    instead of gaussian fits. All the slices are computed together
+    (see slice_quantiles), and the quantiles are robust against the
+    tails of the band. nbins_e is only used for the histogram
+    parameters.
+    """
+    z, e   = np.asarray(z), np.asarray(e)
+    zbins  = np.linspace(*range_z, nbins_z + 1)
+    zerror = np.diff(zbins) * 0.5
+    zc     = shift_to_bin_centers(zbins)
+
+    index  = np.where(in_range(e, *range_e), bin_index(z, zbins), -1)
+    counts, quantiles = slice_quantiles(index, nbins_z, e, GAUSS_QUANTILES)
+    e_mean  = quantiles[:, 1]
+    e_sigma = (quantiles[:, 2] - quantiles[:, 0]) / 2
+    ok      = (counts >= min_entries) & (e_sigma > 0)
+
+    y = e_mean +  nsigma * e_sigma
+    fph, _, _, validh  = fit_lifetime_unbined(zc[ok], y[ok], nbins_z, range_z)
+
+    y = e_mean - nsigma * e_sigma
+    fpl, _, _, validl  = fit_lifetime_unbined(zc[ok], y[ok], nbins_z, range_z)
+
+    sel_inband = in_range( e
+                         , fpl.f(z) if validl else 0.
+                         , fph.f(z) if validh else np.inf)
+
+    hp = HistoPar2(var = z,
+                   nbins = nbins_z,
+                   range = range_z,
+                   var2 = e,
+                   nbins2 = nbins_e,
+                   range2 = range_e)
+
+    pp = ProfilePar(x = zc, xu = zerror, y = e_mean, yu = e_sigma)
+
+    return sel_inband, fpl, fph, hp, pp
+
+
+BAND_METHODS = dict(gauss    = selection_in_band,
+                    quantile = selection_in_band_quantiles)
+
+
+def band_histogram(z       : np.array,
+                   e       : np.array,
+                   range_z : Range,
+                   range_e : Range,
+                   nbins_z : int     = 50,
+                   nbins_e : int     = 100) -> np.array:
+    """
+    Histogram of the events in the energy range of the Kr band, in the
+    Z slices and energy bins of selection_in_band, shape (nbins_z,
+    nbins_e). The histograms of several sets of events add up, and the
+    band of their union is obtained from the sum (see
+    selection_in_band_histogram).
+    """
+    z, e  = np.asarray(z, dtype=float), np.asarray(e, dtype=float)
+    zbins = np.linspace(*range_z, nbins_z + 1)
+    ebins = np.linspace(*range_e, nbins_e + 1)
+    sel_e = in_range(e, *range_e)
+    return np.histogram2d(z[sel_e], e[sel_e], (zbins, ebins))[0]
+
+
+def histogram_quantiles(counts    : np.array,
+                        edges     : np.array,
+                        quantiles : Tuple[float, ...])->np.array:
+    """
+    Quantiles of the values in each histogram (rows of counts, limits
+    edges), interpolating linearly inside the bins.
+
+    Returns
+    -------
+        The quantiles, shape (len(counts), len(quantiles)) (NaN for
+        empty histograms).
+    """
+    cumul  = np.cumsum(counts, axis=1)
+    result = np.full((len(counts), len(quantiles)), np.nan)
+    for i in np.flatnonzero(cumul[:, -1] > 0):
+        cdf       = np.concatenate([[0], cumul[i]]) / cumul[i, -1]
+        result[i] = np.interp(quantiles, cdf, edges)
+    return result
+
+
+def selection_in_band_histogram(z           : np.array,
+                                e           : np.array,
+                                counts      : np.array,
+                                range_z     : Range,
+                                range_e     : Range,
+                                nsigma      : float   = 3.5,
+                                method      : str     = 'gauss',
+                                min_entries : int     = 100) ->Tuple[np.array, FitPar, FitPar,
+                                                                      HistoPar2, ProfilePar]:
+    """
+    Selection of the events inside the Kr E vs Z band, with the band
+    fitted on a Z vs E histogram (counts, see band_histogram) instead
+    of on the events themselves. The histogram can hold more events
+    than z and e, for instance those of the whole run when z and e
+    are a part of it.
+
+    With method gauss the slices are fitted as in selection_in_band and
+    the band is the same as with the events of the histogram. With
+    method quantile the quantiles of selection_in_band_quantiles are
+    interpolated inside the energy bins.
+    """
+    if method not in BAND_METHODS:
+        raise ValueError(f"Unknown band method {method}, expected one of {list(BAND_METHODS)}")
+
+    z, e             = np.asarray(z), np.asarray(e)
+    nbins_z, nbins_e = counts.shape
+    zbins  = np.linspace(*range_z, nbins_z + 1)
+    ebins  = np.linspace(*range_e, nbins_e + 1)
+    zerror = np.diff(zbins) * 0.5
+    zc     = shift_to_bin_centers(zbins)
+
+    if method == 'gauss':
+        mean, sigma, _, ok = fit_slices_1d_gauss_histo(counts, ebins, min_entries)
+        e_mean  = mean .value
+        e_sigma = sigma.value
+    else:
+        quantiles = histogram_quantiles(counts, ebins, GAUSS_QUANTILES)
+        e_mean    = quantiles[:, 1]
+        e_sigma   = (quantiles[:, 2] - quantiles[:, 0]) / 2
+        ok        = (counts.sum(axis=1) >= min_entries) & (e_sigma > 0)
+
+    y = e_mean +  nsigma * e_sigma
+    fph, _, _, validh  = fit_lifetime_unbined(zc[ok], y[ok], nbins_z, range_z)
+
+    y = e_mean - nsigma * e_sigma
+    fpl, _, _, validl  = fit_lifetime_unbined(zc[ok], y[ok], nbins_z, range_z)
+
+    sel_inband = in_range( e
+                         , fpl.f(z) if validl else 0.
+                         , fph.f(z) if validh else np.inf)
+
+    hp = HistoPar2(var = z,
+                   nbins = nbins_z,
+                   range = range_z,
+                   var2 = e,
+                   nbins2 = nbins_e,
+                   range2 = range_e)
+
+    pp = ProfilePar(x = zc, xu = zerror, y = e_mean, yu = e_sigma)
+
+    return sel_inband, fpl, fph, hp, pp
+
+
+def compare_band_selections(z       : np.array,
+                            e       : np.array,
+                            range_z : Range,
+                            range_e : Range,
+                            nbins_z : int     = 50,
+                            nbins_e : int     = 100,
+                            nsigma  : float   = 3.5) -> pd.Series:
+    """
+    Validation of the quantile band (selection_in_band_quantiles)
+    against the gaussian-fit band (selection_in_band) with the same
+    events.
+
+    Returns
+    -------
+        A Series with the efficiency of each selection (eff_gauss,
+        eff_quantile), the fraction of events selected by only one of
+        them (disagreement) and the maximum relative difference of the
+        lower and upper band edges in the Z range (edge_diff_low,
+        edge_diff_high; NaN if an edge could not be fitted).
+    """
+    sel_g, low_g, high_g, _, _ = selection_in_band          (z, e, range_z, range_e, nbins_z, nbins_e, nsigma)
+    sel_q, low_q, high_q, _, _ = selection_in_band_quantiles(z, e, range_z, range_e, nbins_z, nbins_e, nsigma)
+    zs = np.linspace(*range_z, 100)
+    def edge_diff(fp_g, fp_q):
+        if fp_g is None or fp_q is None:
+            return np.nan
+        return np.max(np.abs(fp_q.f(zs) / fp_g.f(zs) - 1))
+
+    return pd.Series(dict(eff_gauss      = np.mean(sel_g),
+                          eff_quantile   = np.mean(sel_q),
+                          disagreement   = np.mean(sel_g != sel_q),
+                          edge_diff_low  = edge_diff(low_g , low_q ),
+                          edge_diff_high = edge_diff(high_g, high_q)))
@@ -14,6 +14,14 @@ from invisible_cities.io.dst_io              import load_dst
 from . selection_functions  import event_map_df
 from . selection_functions  import get_time_series_df
 from . selection_functions  import select_xy_sectors_df
+from . selection_functions  import rphi_sectors_map
+from . selection_functions  import rphi_cell_index
+from . selection_functions  import select_rphi_sectors_df
+from . selection_functions  import slice_quantiles
+from . selection_functions  import selection_in_band_quantiles
+from . selection_functions  import band_histogram
+from . selection_functions  import histogram_quantiles
+from . selection_functions  import selection_in_band_histogram
 
 from pytest import mark
 
@@ -86,3 +94,83 @@ def test_select_xy_sectors_df(dstData):
     selMap = select_xy_sectors_df(data, xb, yb)
     sel2 = event_map_df(selMap)
     assert_dataframes_close(sel, sel2)
+
+
+def test_rphi_cell_index():
+    rpmd          = rphi_sectors_map(rmax=100, nsectors=4, nwedges=4)
+    r             = np.array([  10,     30,     60,    90,  120])
+    phi           = np.array([-3.0, -np.pi/4, 0.1, np.pi-1e-3, 0])
+    sector, wedge = rphi_cell_index(r, phi, rpmd)
+    assert np.all(sector == [0, 1, 2, 3, -1])
+    assert np.all(wedge  == [0, 1, 2, 3, -1])
+
+
+def test_select_rphi_sectors_df_same_as_masks():
+    n    = 10000
+    r    = np.random.uniform(0, 120, n)
+    phi  = np.random.uniform(-np.pi, np.pi, n)
+    dst  = pd.DataFrame(dict(R = r, Phi = phi, event = np.arange(n)))
+    rpmd = rphi_sectors_map(rmax=100, nsectors=5, nwedges=6)
+
+    selMap = select_rphi_sectors_df(dst, rpmd)
+    for s, (rmin, rmax) in rpmd.r.items():
+        for w, (phimin, phimax) in enumerate(rpmd.phi[s]):
+            mask = in_range(r, rmin, rmax) & in_range(phi, phimin, phimax)
+            assert np.all(np.sort(selMap[s][w].event.values) == dst.event.values[mask])
+    assert event_map_df(selMap).values.sum() == np.count_nonzero(r < 100)
+
+
+def test_slice_quantiles_same_as_numpy():
+    index     = np.random.randint(-1, 7, 5000)
+    values    = np.random.exponential(1, 5000)
+    quantiles = (0.1, 0.5, 0.9)
+    counts, result = slice_quantiles(index, 8, values, quantiles)
+    for k in range(7):
+        assert counts[k] == np.count_nonzero(index == k)
+        assert np.allclose(result[k], np.quantile(values[index == k], quantiles))
+    assert counts[7] == 0
+    assert np.all(np.isnan(result[7]))
+
+
+def test_selection_in_band_quantiles_keeps_the_core():
+    n    = 200000
+    z    = np.random.uniform(0, 500, n)
+    e    = 10000 * np.exp(-z / 5000) * np.random.normal(1, 0.02, n)
+    tail = np.random.uniform(0, 1, n) < 0.05
+    e[tail] *= np.random.uniform(0.5, 0.9, np.count_nonzero(tail))
+
+    sel, fpl, fph, _, pp = selection_in_band_quantiles(z, e, (0, 500), (4000, 12000), nsigma=3.5)
+    assert np.count_nonzero(sel[~tail]) / np.count_nonzero(~tail) > 0.99
+    assert np.count_nonzero(sel[ tail]) / np.count_nonzero( tail) < 0.05
+    assert np.allclose(pp.yu / pp.y, 0.02, rtol=0.2)
+
+
+def test_histogram_quantiles_close_to_numpy():
+    values    = np.random.normal(0, 1, (3, 10000))
+    edges     = np.linspace(-5, 5, 201)
+    counts    = np.array([np.histogram(v, edges)[0] for v in values] + [np.zeros(200)])
+    quantiles = (0.16, 0.5, 0.84)
+    result    = histogram_quantiles(counts, edges, quantiles)
+    for k in range(3):
+        assert np.allclose(result[k], np.quantile(values[k], quantiles), atol=np.diff(edges)[0])
+    assert np.all(np.isnan(result[3]))
+
+
+def test_selection_in_band_histogram_from_the_parts_of_the_run():
+    n     = 200000
+    z     = np.random.uniform(0, 500, n)
+    e     = 10000 * np.exp(-z / 5000) * np.random.normal(1, 0.02, n)
+    parts = np.array_split(np.arange(n), 4)
+    band  = dict(range_z = (0, 500), range_e = (4000, 12000), nbins_z = 50, nbins_e = 200)
+    total = band_histogram(z, e, **band)
+    assert np.all(sum(band_histogram(z[p], e[p], **band) for p in parts) == total)
+
+    histo = dict(counts = total, range_z = band['range_z'], range_e = band['range_e'],
+                 nsigma = 3.5, method = 'quantile')
+    sel   = selection_in_band_histogram(z, e, **histo)[0]
+    assert np.all(np.concatenate([selection_in_band_histogram(z[p], e[p], **histo)[0]
+                                  for p in parts]) == sel)
+
+    expected, fpl, fph, _, _ = selection_in_band_quantiles(z, e, band['range_z'], band['range_e'],
+                                                           band['nbins_z'], nsigma = 3.5)
+    assert np.mean(sel != expected) < 1e-3
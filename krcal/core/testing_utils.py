@@ -1,12 +1,16 @@
-import numpy as np
+import os
+import numpy  as np
+import pandas as pd
 from typing import Tuple
 from typing import List
+from typing import Optional
 
 from . fit_lt_functions   import fit_lifetime
 from . kr_types           import FitType
 from . kr_types           import Number
 from . kr_types           import FitCollection2
 from . kr_types           import Range
+from . io_functions       import write_kdst
 
 def energy_lt(z : np.array, e0: float, lt: float)->np.array:
     """Energy attenuated by lifetime"""
@@ -100,3 +104,122 @@ def energy_lt_experiments(mexperiments : Number   = 1000,
     return zs, es
 
 
+
+def kr_dst_experiment(nevt          : Number = 1e+5,
+                      e0            : float  = 8.5e+3,
+                      lt            : float  = 4e+4,
+                      lt_drift      : float  = 0.1,
+                      geo_factor    : float  = 0.1,
+                      std           : float  = 0.05,
+                      rmax          : float  = 480,
+                      zmax          : float  = 1300,
+                      drift_v       : float  = 0.9,
+                      t0            : float  = 1.6e+9,
+                      duration      : float  = 86400,
+                      frac_multi_s2 : float  = 0.02,
+                      seed          : int    = None,
+                      first_event   : int    = 0,
+                      time_range    : Optional[Range] = None)->pd.DataFrame:
+    """
+    Synthetic Kr kdst with the columns used by the map production.
+
+    Events are uniform in a cylinder of radius rmax and length zmax,
+    and uniform in time over duration seconds. The energy follows
+    e0 * (1 - geo_factor * (r/rmax)**2) * exp(-z/lt(t)), where the
+    lifetime changes linearly by a fraction lt_drift over the run,
+    smeared with a relative std. A fraction frac_multi_s2 of the events
+    has a second S2 peak (an extra row). Zrms follows the diffusion band.
+
+    A part of the run can be generated on its own: its events are
+    numbered from first_event and their times are uniform in
+    time_range, inside (t0, t0 + duration) (see write_kr_dst_experiment).
+    """
+    rng   = np.random.default_rng(seed)
+    nevt  = int(nevt)
+
+    time_range = (t0, t0 + duration) if time_range is None else time_range
+    time  = np.sort(rng.uniform(*time_range, nevt))
+    r     = rmax * np.sqrt(rng.uniform(0, 1, nevt))
+    phi   = rng.uniform(-np.pi, np.pi, nevt)
+    x     = r * np.cos(phi)
+    y     = r * np.sin(phi)
+    z     = rng.uniform(0, zmax, nevt)
+    dt    = z / drift_v
+    lts   = lt * (1 + lt_drift * (time - t0) / duration)
+    s2e   = e0 * (1 - geo_factor * (r / rmax)**2) * np.exp(-z / lts)
+    s2e   = rng.normal(s2e, std * s2e)
+    zrms2 = 0.95 + 0.033 * (dt - 20) + rng.normal(0, 0.3, nevt)
+    zrms  = np.sqrt(np.clip(zrms2, 1e-2, None))
+
+    dst = pd.DataFrame(dict(event   = np.arange(nevt) + first_event   ,
+                            time    = time                            ,
+                            s1_peak = np.zeros(nevt, dtype=int)       ,
+                            s2_peak = np.zeros(nevt, dtype=int)       ,
+                            nS1     = np.ones (nevt, dtype=int)       ,
+                            nS2     = np.ones (nevt, dtype=int)       ,
+                            S1w     = rng.normal(  200,  25, nevt)    ,
+                            S1h     = rng.normal(    3, 0.5, nevt)    ,
+                            S1e     = rng.normal(   15,   3, nevt)    ,
+                            S1t     = rng.uniform(  0, 1e3, nevt)     ,
+                            S2w     = rng.normal(   10,   2, nevt)    ,
+                            S2h     = s2e / 10                        ,
+                            S2e     = s2e                             ,
+                            S2q     = rng.normal(  500,  50, nevt)    ,
+                            S2t     = rng.uniform(  0, 1e3, nevt)     ,
+                            Nsipm   = rng.poisson(20, nevt)           ,
+                            DT      = dt                              ,
+                            Z       = z                               ,
+                            Zrms    = zrms                            ,
+                            X       = x                               ,
+                            Y       = y                               ,
+                            R       = r                               ,
+                            Phi     = phi                             ,
+                            Xrms    = rng.normal(   10,   1, nevt)    ,
+                            Yrms    = rng.normal(   10,   1, nevt)    ))
+
+    multi = rng.uniform(0, 1, nevt) < frac_multi_s2
+    if np.any(multi):
+        dst.loc[multi, 'nS2'] = 2
+        extra = dst[multi].assign(s2_peak = 1, S2e = lambda d: d.S2e / 10)
+        dst   = pd.concat([dst, extra]).sort_values(['time', 's2_peak'], kind='stable')
+        dst   = dst.reset_index(drop=True)
+    return dst
+
+
+def write_kr_dst_experiment(folder     : str,
+                            nevt       : Number = 1e+5,
+                            chunk_size : Number = 1e+6,
+                            seed       : int    = None,
+                            t0         : float  = 1.6e+9,
+                            duration   : float  = 86400,
+                            **params)->Tuple[List[str], int]:
+    """
+    Writes a synthetic Kr run (see kr_dst_experiment) as kdst files in
+    folder (kdst_experiment_00000.h5, ...), one per chunk of chunk_size
+    events in consecutive time intervals, so that only one chunk is in
+    memory at a time. params are passed to kr_dst_experiment.
+
+    Returns
+    -------
+        The names of the files and the number of rows written.
+    """
+    nevt    = int(nevt)
+    nchunks = max(1, int(np.ceil(nevt / chunk_size)))
+    bounds  = np.linspace(0, nevt, nchunks + 1).astype(int)
+    times   = np.linspace(t0, t0 + duration, nchunks + 1)
+    seeds   = np.random.SeedSequence(seed).spawn(nchunks)
+
+    files, nrows = [], 0
+    for i in range(nchunks):
+        dst = kr_dst_experiment(nevt        = bounds[i + 1] - bounds[i],
+                                t0          = t0,
+                                duration    = duration,
+                                seed        = seeds[i],
+                                first_event = bounds[i],
+                                time_range  = times[i: i + 2],
+                                **params)
+        filename = os.path.join(folder, f'kdst_experiment_{i:05d}.h5')
+        write_kdst(dst, filename)
+        files.append(filename)
+        nrows += len(dst)
+    return files, nrows
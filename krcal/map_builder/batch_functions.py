@@ -0,0 +1,157 @@
+"""Module batch_functions.
+This module produces the maps of many runs in a single process (or a
+pool of worker processes), sharing the configuration and the loaded
+bootstrap maps and reference histograms between runs.
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    The run list is a CSV file with the columns run_number, folder,
+    file_in, file_out_map and file_out_hists, which replace the
+    corresponding parameters of the configuration for each run.
+    The worker processes are forked after the references are loaded,
+    so they share them with the parent process.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import time
+import traceback
+import multiprocessing
+
+import pandas as pd
+
+from copy        import copy
+from typing      import Dict
+from typing      import List
+from typing      import Tuple
+from dataclasses import dataclass
+from dataclasses import asdict
+
+from . map_builder_functions import map_builder
+from . map_builder_functions import load_references
+from . map_builder_functions import ref_hist_container
+from . checking_functions    import AbortingMapCreation
+
+from invisible_cities.reco.corrections import ASectorMap
+
+
+RUN_PARAMETERS = ('run_number', 'folder', 'file_in', 'file_out_map', 'file_out_hists')
+
+_references   : Dict[Tuple[str, str, str], Tuple[ASectorMap, ref_hist_container]] = {}
+_batch_config = None # configuration shared with the forked workers
+
+
+@dataclass
+class run_job:
+    run_number     : int
+    folder         : str
+    file_in        : str
+    file_out_map   : str
+    file_out_hists : str
+
+
+@dataclass
+class run_outcome:
+    run_number : int
+    status     : str   # ok, aborted (a map_builder check failed) or failed
+    message    : str
+    wall_time  : float # s
+
+
+def read_run_list(filename : str)->List[run_job]:
+    """Reads the CSV run list (see module notes)."""
+    runs    = pd.read_csv(filename, dtype=str)
+    missing = set(RUN_PARAMETERS) - set(runs.columns)
+    if missing:
+        raise ValueError(f'Run list {filename} lacks the columns {sorted(missing)}')
+    runs.run_number = runs.run_number.astype(int)
+    return [run_job(**{par: row[par] for par in RUN_PARAMETERS}) for _, row in runs.iterrows()]
+
+
+def run_config(config, job : run_job):
+    """Configuration of a run: config with the parameters of job."""
+    run_conf = copy(config)
+    for par, value in asdict(job).items():
+        setattr(run_conf, par, value)
+    return run_conf
+
+
+def shared_references(config)->Tuple[ASectorMap, ref_hist_container]:
+    """
+    Bootstrap map and reference histograms of config, read once per
+    process for each set of files.
+    """
+    key = (os.path.expandvars(config.file_bootstrap_map),
+           os.path.expandvars(config.ref_Z_histogram['ref_histo_file']),
+           config.ref_Z_histogram['key_Z_histo'])
+    if key not in _references:
+        _references[key] = load_references(config.file_bootstrap_map,
+                                           **config.ref_Z_histogram )
+    return _references[key]
+
+
+def run_single_job(config, job : run_job)->run_outcome:
+    """
+    Runs map_builder for job, catching its errors so the batch goes on.
+    """
+    t0 = time.perf_counter()
+    try:
+        run_conf = run_config(config, job)
+        map_builder(run_conf, shared_references(run_conf))
+        status, message = 'ok', ''
+    except AbortingMapCreation as error:
+        status, message = 'aborted', str(error)
+    except Exception as error:
+        status, message = 'failed', ''.join(traceback.format_exception_only(type(error), error)).strip()
+    return run_outcome(run_number = job.run_number,
+                       status     = status,
+                       message    = message,
+                       wall_time  = time.perf_counter() - t0)
+
+
+def _run_forked_job(job : run_job)->run_outcome:
+    return run_single_job(_batch_config, job)
+
+
+def run_batch(config                      ,
+              jobs      : List[run_job]   ,
+              n_workers : int           = 1)->pd.DataFrame:
+    """
+    Produces the maps of jobs with the configuration config.
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration, shared by all runs except for the
+        parameters in RUN_PARAMETERS.
+    jobs: list of run_job
+        Runs to process.
+    n_workers: int
+        Number of worker processes (1: everything in this process).
+
+    Returns
+    -------
+        Summary table with the run_number, status, message and
+        wall_time of each run.
+    """
+    global _batch_config
+    for job in jobs:
+        try:
+            shared_references(run_config(config, job))
+        except Exception:
+            pass # reported by the job itself
+
+    if n_workers > 1:
+        _batch_config = config
+        context       = multiprocessing.get_context('fork')
+        with context.Pool(n_workers) as pool:
+            outcomes = pool.map(_run_forked_job, jobs, chunksize=1)
+    else:
+        outcomes = [run_single_job(config, job) for job in jobs]
+
+    return pd.DataFrame([asdict(outcome) for outcome in outcomes],
+                        columns=['run_number', 'status', 'message', 'wall_time'])
@@ -0,0 +1,87 @@
+import os
+import pandas as pd
+
+from types  import SimpleNamespace
+from pytest import fixture
+from pytest import raises
+
+from . import batch_functions
+from . batch_functions    import run_job
+from . batch_functions    import read_run_list
+from . batch_functions    import run_config
+from . batch_functions    import run_batch
+from . checking_functions import AbortingMapCreation
+
+
+@fixture
+def config():
+    return SimpleNamespace(run_number         = '{runnumber}',
+                           folder             = '{folderin}',
+                           file_in            = '{filein}',
+                           file_out_map       = '{fileoutmap}',
+                           file_out_hists     = '{fileouthist}',
+                           file_bootstrap_map = 'bootstrap_map.h5',
+                           ref_Z_histogram    = dict(ref_histo_file = 'z_histo.h5',
+                                                     key_Z_histo    = 'histo_Z_dst'))
+
+
+@fixture
+def jobs():
+    return [run_job(run_number, f'/data/{run_number}/', '*.h5',
+                    f'map_{run_number}.h5', f'histos_{run_number}.h5')
+            for run_number in (7000, 7001, 7002)]
+
+
+@fixture
+def fake_map_builder(monkeypatch):
+    loads = []
+    def load_references(file_bootstrap_map, ref_histo_file, key_Z_histo):
+        loads.append(file_bootstrap_map)
+        return 'bootstrap', 'histos'
+
+    def map_builder(config, references):
+        assert references == ('bootstrap', 'histos')
+        if config.run_number == 7001:
+            raise AbortingMapCreation('Z distribution very different to reference one.')
+        if config.run_number == 7002:
+            raise OSError('no input files')
+
+    monkeypatch.setattr(batch_functions, '_references'    , {})
+    monkeypatch.setattr(batch_functions, 'load_references', load_references)
+    monkeypatch.setattr(batch_functions, 'map_builder'    , map_builder)
+    return loads
+
+
+def test_read_run_list(jobs, tmpdir_factory):
+    filename = os.path.join(tmpdir_factory.mktemp('batch'), 'runs.csv')
+    pd.DataFrame([job.__dict__ for job in jobs]).to_csv(filename, index=False)
+    assert read_run_list(filename) == jobs
+
+
+def test_read_run_list_missing_columns(tmpdir_factory):
+    filename = os.path.join(tmpdir_factory.mktemp('batch'), 'runs.csv')
+    pd.DataFrame(dict(run_number = [7000], file_in = ['*.h5'])).to_csv(filename, index=False)
+    with raises(ValueError):
+        read_run_list(filename)
+
+
+def test_run_config_does_not_modify_config(config, jobs):
+    run_conf = run_config(config, jobs[0])
+    assert run_conf.run_number     == 7000
+    assert run_conf.file_out_map   == 'map_7000.h5'
+    assert config  .file_out_map   == '{fileoutmap}'
+    assert run_conf.ref_Z_histogram is config.ref_Z_histogram
+
+
+def test_run_batch_outcomes(config, jobs, fake_map_builder):
+    summary = run_batch(config, jobs)
+    assert summary.run_number.tolist() == [7000, 7001, 7002]
+    assert summary.status    .tolist() == ['ok', 'aborted', 'failed']
+    assert 'no input files' in summary.message[2]
+    assert fake_map_builder == ['bootstrap_map.h5']
+
+
+def test_run_batch_with_workers(config, jobs, fake_map_builder):
+    summary = run_batch(config, jobs, n_workers = 2)
+    assert summary.status.tolist() == ['ok', 'aborted', 'failed']
+    assert fake_map_builder == ['bootstrap_map.h5']
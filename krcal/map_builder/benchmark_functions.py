@@ -0,0 +1,326 @@
+"""Module benchmark_functions.
+This module includes the benchmarks of the hot paths of the map
+production, run on synthetic Kr kdsts, and the tracking of their
+results across commits.
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    The synthetic run is written in chunks as kdst files (see
+    write_kr_dst_experiment), so its size is not limited by the memory,
+    and it is read back with load_dst_files like a real run. map_builder
+    runs with its checks disabled (see benchmark_config), so that the
+    benchmark always times the whole production.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import time
+import subprocess
+
+import numpy  as np
+import pandas as pd
+
+from copy        import deepcopy
+from typing      import Callable
+from typing      import Dict
+from typing      import List
+from typing      import Optional
+from dataclasses import dataclass
+from dataclasses import asdict
+
+from .. core.testing_utils         import write_kr_dst_experiment
+from .. core.kr_types              import FitType
+from .. core.selection_functions   import select_xy_sectors_df
+from .. core.selection_functions   import selection_in_band
+from .. core.selection_functions   import event_map_df
+from .. core.selection_functions   import get_time_series_df
+from .. core.fitmap_functions      import fit_map_xy_df
+from .. core.kr_parevol_functions  import kr_time_evolution
+from .. core.kr_parevol_functions  import get_number_of_time_bins
+from .. core.map_cache_functions   import read_cached_maps
+
+from . map_builder_functions       import map_builder
+from . map_builder_functions       import load_dst_files
+from . map_builder_functions       import recompute_npeaks
+
+
+BENCHMARK_CASES = ('select_xy_sectors_df', 'fit_map_xy_df'   ,
+                   'selection_in_band'   , 'kr_time_evolution',
+                   'recompute_npeaks'    , 'map_builder'      )
+BENCHMARK_ZMAX  = 1300 # mm, length of the synthetic detector
+
+
+@dataclass
+class benchmark_result:
+    name      : str
+    nrows     : int
+    repeats   : int
+    best      : float # s
+    mean      : float # s
+    commit    : str
+    timestamp : float
+
+
+def git_commit(path : str = os.path.dirname(__file__))->str:
+    """Short hash of the commit checked out in path ('unknown' outside git)."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def time_function(function : Callable,
+                  repeats  : int = 3)->List[float]:
+    """Wall times of repeats calls of function."""
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def write_flat_Z_reference(filename : str,
+                           zmax     : float,
+                           nbins    : int = 50)->None:
+    """
+    Writes a reference Z histogram (key histo_Z_dst) of events uniform
+    in (0, zmax), as those of the synthetic runs.
+    """
+    entries = np.full(nbins, 1 / zmax)
+    table   = pd.DataFrame(dict(bin_centres     = (np.arange(nbins) + 0.5) * zmax / nbins,
+                                bin_entries     = entries,
+                                err_bin_entries = entries / 10))
+    table.to_hdf(filename, key="histo_Z_dst", mode="w", format="table")
+
+
+def benchmark_config(config         ,
+                     workdir : str  ,
+                     file_in : str  ,
+                     zmax    : float = BENCHMARK_ZMAX):
+    """
+    Copy of config (a map builder configuration) that runs map_builder
+    on the kdst files file_in of workdir, writing its outputs there,
+    with every check that can abort the map production disabled: the
+    efficiency intervals, the rate deviation, the Z distribution
+    (compared with a flat reference up to zmax, written in workdir)
+    and the failed map and drift velocity fits. The optional stages
+    that need other inputs (early validation, Z comparison, warm
+    start, checkpoints) are also disabled.
+    """
+    z_reference = os.path.join(workdir, 'benchmark_Z_reference.h5')
+    write_flat_Z_reference(z_reference, zmax)
+
+    full_config = deepcopy(config)
+    full_config.folder               = workdir + '/'
+    full_config.file_in              = file_in
+    full_config.file_out_map         = os.path.join(workdir, 'benchmark_map.h5')
+    full_config.file_out_hists       = os.path.join(workdir, 'benchmark_histos.h5')
+    full_config.run_number           = 0
+    full_config.ref_Z_histogram      = dict(ref_histo_file = z_reference,
+                                            key_Z_histo    = 'histo_Z_dst')
+    full_config.nsigmas_Zdst         = np.inf
+    full_config.n_dev_rate           = np.inf
+    full_config.early_check_fraction = None
+    full_config.ref_Z_comparison     = None
+    full_config.warm_start_params    = None
+    full_config.checkpoint_dir       = None
+    for name in ('diff_band', 'nS1', 'nS2'):
+        setattr(full_config, name + '_eff_min', -np.inf)
+        setattr(full_config, name + '_eff_max',  np.inf)
+    full_config.band_sel_params = dict(config.band_sel_params, eff_min = -np.inf, eff_max = np.inf)
+    full_config.map_params      = dict(config.map_params, maxFailed = np.inf, dv_maxFailed = np.inf)
+    return full_config
+
+
+def benchmark_cases(dst_files : List[str] ,
+                    config              ,
+                    workdir   : str       ,
+                    cases     : List[str] = BENCHMARK_CASES,
+                    n_bins    : int       = 50)->Dict[str, Callable]:
+    """
+    Builds the benchmarked calls on the events of dst_files with the
+    parameters of config (a map builder configuration). The inputs of
+    each call are prepared here, so only the benchmarked function is
+    timed. The events are only loaded in memory if a benchmark other
+    than map_builder, which reads the files itself, is requested.
+
+    Parameters
+    ----------
+    dst_files: list of str
+        Synthetic kdst files (see write_kr_dst_experiment), in workdir.
+    config: namespace
+        Map builder configuration, used for the ranges, the bootstrap
+        map and the full map_builder run (see benchmark_config).
+    workdir: str
+        Folder of the kdst files, where the outputs of map_builder are
+        written.
+    cases: list of str
+        Benchmarks to build. All of BENCHMARK_CASES by default.
+    n_bins: int
+        Number of XY bins of the map.
+
+    Returns
+    -------
+        Dict of benchmark name to a function without arguments.
+    """
+    full_config = benchmark_config(config, workdir, 'kdst_experiment_*.h5')
+    functions   = dict(map_builder = lambda: map_builder(full_config))
+    if set(cases) <= set(functions):
+        return {name: functions[name] for name in cases}
+
+    dst           = load_dst_files(dst_files, config.quality_ranges)
+    map_params    = config.map_params
+    band_params   = config.band_sel_params
+    krevol_params = dict(config.krevol_params)
+    r_fid         = krevol_params.pop('r_fid')
+    nStimeprofile = krevol_params.pop('nStimeprofile')
+
+    xbins = np.linspace(*map_params['x_range'], n_bins + 1)
+    ybins = np.linspace(*map_params['y_range'], n_bins + 1)
+    KXY   = select_xy_sectors_df(dst, xbins, ybins)
+    nXY   = event_map_df(KXY)
+
+    bootstrap_map  = read_cached_maps(os.path.expandvars(config.file_bootstrap_map))
+    dstf           = dst[dst.R < r_fid]
+    ntimebins      = get_number_of_time_bins(nStimeprofile = nStimeprofile,
+                                             tstart        = dstf.time.min(),
+                                             tfinal        = dstf.time.max())
+    ts, masks_time = get_time_series_df(time_bins  = ntimebins,
+                                        time_range = (dstf.time.min(), dstf.time.max()),
+                                        dst        = dstf)
+
+    def fit_map():
+        return fit_map_xy_df(selection_map = KXY,
+                             event_map     = nXY,
+                             n_time_bins   = 1,
+                             time_diffs    = dst.time.values,
+                             nbins_z       = map_params['nbins_z'],
+                             nbins_e       = map_params['nbins_e'],
+                             range_z       = map_params['z_range'],
+                             range_e       = map_params['e_range'],
+                             fit           = FitType.unbined,
+                             n_min         = map_params['nmin'])
+
+    def band():
+        return selection_in_band(dst.Z.values, dst.S2e.values,
+                                 range_z = band_params['range_Z'],
+                                 range_e = band_params['range_E'],
+                                 nbins_z = band_params['nbins_z'],
+                                 nbins_e = band_params['nbins_e'],
+                                 nsigma  = band_params['nsigma_sel'])
+
+    def time_evolution():
+        return kr_time_evolution(ts            = ts,
+                                 masks_time    = masks_time,
+                                 dst           = dstf,
+                                 emaps         = bootstrap_map,
+                                 bootstrap_map = bootstrap_map,
+                                 **krevol_params)
+
+    functions.update(select_xy_sectors_df = lambda: select_xy_sectors_df(dst, xbins, ybins),
+                     fit_map_xy_df        = fit_map,
+                     selection_in_band    = band,
+                     kr_time_evolution    = time_evolution,
+                     recompute_npeaks     = lambda: recompute_npeaks(dst))
+    return {name: functions[name] for name in cases}
+
+
+def run_benchmarks(config                            ,
+                   sizes      : List[int]            ,
+                   workdir    : str                  ,
+                   cases      : Optional[List[str]] = None,
+                   repeats    : int                 = 3,
+                   seed       : int                 = 1,
+                   chunk_size : int                 = 1000000)->List[benchmark_result]:
+    """
+    Runs the benchmarks for each size of synthetic run.
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration (see benchmark_cases).
+    sizes: list of int
+        Number of events of the synthetic runs.
+    workdir: str
+        Folder for the temporary files.
+    cases: list of str (optional)
+        Benchmarks to run. All of BENCHMARK_CASES by default.
+    repeats: int
+        Number of timed calls of each benchmark.
+    seed: int
+        Seed of the synthetic runs.
+    chunk_size: int
+        Number of events of each kdst file of the synthetic runs.
+
+    Returns
+    -------
+        List of benchmark_result.
+    """
+    cases   = BENCHMARK_CASES if cases is None else cases
+    commit  = git_commit()
+    results = []
+    for size in sizes:
+        folder = os.path.join(workdir, f'run_{size}')
+        os.makedirs(folder, exist_ok=True)
+        dst_files, nrows = write_kr_dst_experiment(folder, nevt = size, chunk_size = chunk_size,
+                                                   seed = seed, zmax = BENCHMARK_ZMAX)
+        functions = benchmark_cases(dst_files, config, folder, cases)
+        for name in cases:
+            times = time_function(functions[name], repeats)
+            results.append(benchmark_result(name      = name,
+                                            nrows     = nrows,
+                                            repeats   = repeats,
+                                            best      = min(times),
+                                            mean      = np.mean(times),
+                                            commit    = commit,
+                                            timestamp = time.time()))
+            print("    {0:<22} {1:>10} rows: {2:8.3f} s".format(name, nrows, min(times)))
+    return results
+
+
+def append_results(results  : List[benchmark_result],
+                   filename : str)->pd.DataFrame:
+    """
+    Appends the results to the CSV history in filename
+    and returns the whole history.
+    """
+    new     = pd.DataFrame([asdict(result) for result in results])
+    history = pd.read_csv(filename) if os.path.isfile(filename) else None
+    history = pd.concat([history, new], ignore_index=True)
+    history.to_csv(filename, index=False)
+    return history
+
+
+def find_regressions(history   : pd.DataFrame,
+                     commit    : str,
+                     reference : Optional[str] = None,
+                     tolerance : float         = 0.2)->pd.DataFrame:
+    """
+    Compares the best times of commit with those of reference and
+    returns the benchmarks that are slower by more than tolerance
+    (relative). By default, reference is the last commit of the history
+    before commit. For each commit the fastest of its runs is used.
+
+    Returns
+    -------
+        DataFrame with columns name, nrows, reference, current, ratio.
+    """
+    commits = list(dict.fromkeys(history.commit))
+    if reference is None:
+        previous  = commits[:commits.index(commit)]
+        if not previous:
+            return pd.DataFrame(columns=['name', 'nrows', 'reference', 'current', 'ratio'])
+        reference = previous[-1]
+
+    best = history.groupby(['commit', 'name', 'nrows']).best.min()
+    comp = pd.concat([best[reference].rename('reference'),
+                      best[commit   ].rename('current'  )], axis=1, join='inner')
+    comp['ratio'] = comp.current / comp.reference
+    return comp[comp.ratio > 1 + tolerance].reset_index()
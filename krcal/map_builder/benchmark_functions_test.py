@@ -0,0 +1,90 @@
+import os
+import numpy  as np
+import pandas as pd
+
+from types import SimpleNamespace
+
+from .. core.testing_utils  import kr_dst_experiment
+from .. core.testing_utils  import write_kr_dst_experiment
+from .. core.histo_functions import compute_similar_histo
+from .  map_builder_functions import load_dst_files
+from .  map_builder_functions import read_reference_histogram
+from .  map_builder_functions import check_Z_histogram
+from .  map_builder_functions import check_efficiency
+from .  benchmark_functions import BENCHMARK_ZMAX
+from .  benchmark_functions import benchmark_config
+from .  benchmark_functions import benchmark_result
+from .  benchmark_functions import time_function
+from .  benchmark_functions import append_results
+from .  benchmark_functions import find_regressions
+
+
+def test_kr_dst_experiment_consistent_peaks():
+    dst    = kr_dst_experiment(nevt = 10000, frac_multi_s2 = 0.1, seed = 1)
+    events = dst.groupby('event')
+
+    assert dst.event.nunique() == 10000
+    assert np.all(events.s2_peak.nunique() == events.nS2.first())
+    assert np.all(np.diff(dst.time) >= 0)
+    assert np.allclose(dst.R, np.hypot(dst.X, dst.Y))
+
+
+def test_kr_dst_experiment_reproducible():
+    dst1 = kr_dst_experiment(nevt = 100, seed = 2)
+    dst2 = kr_dst_experiment(nevt = 100, seed = 2)
+    pd.testing.assert_frame_equal(dst1, dst2)
+
+
+def test_write_kr_dst_experiment_is_one_run(tmpdir_factory):
+    folder      = str(tmpdir_factory.mktemp('kr_dst_experiment'))
+    files, rows = write_kr_dst_experiment(folder, nevt = 2500, chunk_size = 1000,
+                                          seed = 3, frac_multi_s2 = 0.1)
+    dst         = load_dst_files(files, dict(r_max = 480))
+
+    assert len(files) == 3
+    assert len(dst)   == rows
+    assert dst.event.nunique() == 2500
+    assert dst.event.max()     == 2499
+    assert np.all(np.diff(dst.time) >= 0)
+
+
+def test_benchmark_config_cannot_abort(tmpdir_factory):
+    workdir = str(tmpdir_factory.mktemp('benchmark'))
+    config  = SimpleNamespace(band_sel_params = dict(eff_min = 0.5, eff_max = 0.9),
+                              map_params      = dict(maxFailed = 10, dv_maxFailed = 0.1),
+                              nS1_eff_min     = 0.9, nS1_eff_max = 1)
+    full    = benchmark_config(config, workdir, 'kdst_experiment_*.h5')
+
+    assert config.band_sel_params['eff_min'] == 0.5
+    for eff_min, eff_max in ((full.nS1_eff_min, full.nS1_eff_max),
+                             (full.diff_band_eff_min, full.diff_band_eff_max),
+                             (full.band_sel_params['eff_min'], full.band_sel_params['eff_max'])):
+        check_efficiency(dict(a = 0, b = 10), 'a', 'b', (eff_min, eff_max))
+    assert full.map_params['maxFailed'] == full.map_params['dv_maxFailed'] == np.inf
+
+    reference = read_reference_histogram(full.ref_Z_histogram['ref_histo_file'],
+                                         full.ref_Z_histogram['key_Z_histo'   ])
+    z         = kr_dst_experiment(nevt = 1000, zmax = BENCHMARK_ZMAX, seed = 4).Z
+    check_Z_histogram(*compute_similar_histo(z, reference), reference, full.nsigmas_Zdst)
+
+
+def test_time_function_number_of_repeats():
+    times = time_function(lambda: sum(range(1000)), repeats = 4)
+    assert len(times) == 4
+    assert all(t > 0 for t in times)
+
+
+def test_find_regressions(output_tmpdir):
+    def result(name, commit, best):
+        return benchmark_result(name, 100, 1, best, best, commit, 0.)
+
+    filename = os.path.join(output_tmpdir, 'benchmarks.csv')
+    if os.path.isfile(filename):
+        os.remove(filename)
+    append_results([result('fit', 'a', 1.0), result('cut', 'a', 1.0)], filename)
+    history = append_results([result('fit', 'b', 1.1), result('cut', 'b', 2.0)], filename)
+
+    regressions = find_regressions(history, 'b', tolerance = 0.2)
+    assert list(regressions.name) == ['cut']
+    assert regressions.ratio[0]   == 2.0
+    assert len(find_regressions(history, 'a')) == 0
@@ -0,0 +1,217 @@
+"""Module checkpoint_functions.
+This module persists the products of the map production stages, so a
+map_builder run that crashes or is preempted can be resumed, skipping
+the stages that were already done.
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    The checkpoint of each stage lives in a folder of the scratch
+    directory named after a hash of the configuration parameters and
+    input files the stage consumes (CHECKPOINT_PARAMETERS; path, size
+    and modification time of the files) and of the key of the previous
+    stage. Any change in them gives a different folder for that stage
+    and the following ones, so a checkpoint found in its folder is
+    valid, and changing e.g. the krevol parameters keeps the load, cuts
+    and map checkpoints. The parameters not listed for any stage are
+    part of the load key. The output file names and the options that
+    do not change the results are not part of any key.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import pickle
+import shutil
+import hashlib
+
+from types  import CodeType
+from types  import ModuleType
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+CHECKPOINT_STAGES     = ('load', 'cuts', 'map', 'krevol')
+NOT_HASHED_PARAMETERS = ('file_out_map', 'file_out_hists', 'checkpoint_dir', 'profile_stages',
+                         'early_check_fraction')
+CHECKPOINT_PARAMETERS = dict(cuts   = ('file_bootstrap_map', 'ref_Z_histogram', 'ref_Z_comparison',
+                                       'nS1_eff_min', 'nS1_eff_max', 'nS2_eff_min', 'nS2_eff_max',
+                                       'ns1_histo_params', 'ns2_histo_params',
+                                       'nsigmas_Zdst', 'n_dev_rate', 'rate_histo_params',
+                                       'select_diffusion_band', 'diff_band_lower', 'diff_band_upper',
+                                       'diff_band_eff_min', 'diff_band_eff_max', 'diff_histo_params',
+                                       'band_sel_params'),
+                             map    = ('run_number', 'map_params', 'thr_evts_for_sel_map_bins',
+                                       'default_n_bins', 'map_time_bins', 'map_pyramid_bins',
+                                       'quadtree_params', 'rphi_params', 'bootstrap_params',
+                                       'robust_fit_params', 'ml_fit_params', 'joint_fit_params',
+                                       'warm_start_params'),
+                             krevol = ('krevol_params', 'krevol_windows'))
+
+
+def stable_repr(value : Any,
+                _seen : frozenset = frozenset())->str:
+    """
+    Representation of a configuration value that does not change between
+    processes. Functions are represented by their bytecode, constants and
+    names (nested code objects included), and by the values of the
+    globals they reference and of their closure cells, instead of their
+    memory address. Modules are represented by their name.
+    """
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{k!r}: {stable_repr(v, _seen)}' for k, v in sorted(value.items())) + '}'
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + '(' + ', '.join(stable_repr(v, _seen) for v in value) + ')'
+    if isinstance(value, ModuleType):
+        return f'module {value.__name__}'
+    if isinstance(value, CodeType):
+        return (value.co_code.hex() + stable_repr(value.co_consts, _seen)
+                                    + stable_repr(value.co_names , _seen))
+    if callable(value) and hasattr(value, '__code__'):
+        if id(value) in _seen:
+            return f'function {value.__qualname__}'
+        _seen    = _seen | {id(value)}
+        code     = value.__code__
+        names    = sorted(set(code.co_names) & set(getattr(value, '__globals__', {})))
+        globs    = {name: value.__globals__[name] for name in names}
+        closure  = [cell.cell_contents for cell in value.__closure__ or ()]
+        return (stable_repr(code, _seen) + stable_repr(globs  , _seen)
+                                         + stable_repr(closure, _seen))
+    return repr(value)
+
+
+def file_stamp(filename : str)->str:
+    """Path, size and modification time of a file."""
+    filename = os.path.abspath(os.path.expandvars(filename))
+    stat     = os.stat(filename)
+    return f'{filename}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def stage_parameters(config)->Dict[str, List[str]]:
+    """
+    Names of the configuration parameters consumed by each stage (see
+    CHECKPOINT_PARAMETERS). The load stage gets the parameters not
+    listed for any stage and, if the selections run in the pipeline
+    (pipeline_params), the parameters of the cuts stage.
+    """
+    names      = sorted(set(vars(config)) - set(NOT_HASHED_PARAMETERS))
+    parameters = {stage: [name for name in names if name in CHECKPOINT_PARAMETERS.get(stage, ())]
+                  for stage in CHECKPOINT_STAGES}
+    listed     = set(sum(parameters.values(), []))
+    parameters['load'] = [name for name in names if name not in listed]
+    if getattr(config, 'pipeline_params', None):
+        parameters['load'] += parameters['cuts']
+    return parameters
+
+
+def checkpoint_key(config,
+                   parameters  : List[str],
+                   input_files : List[str],
+                   previous    : str = '')->str:
+    """
+    Hash of the parameters of the map builder configuration, of the
+    stamps of input_files (see file_stamp) and of the key of the
+    previous stage.
+    """
+    sha = hashlib.sha1(previous.encode())
+    for name in sorted(parameters):
+        sha.update(f'{name}={stable_repr(getattr(config, name))}\n'.encode())
+    for filename in input_files:
+        sha.update(file_stamp(filename).encode())
+    return sha.hexdigest()
+
+
+def checkpoint_keys(config,
+                    input_files : Dict[str, List[str]])->Dict[str, str]:
+    """
+    Key of each stage, from the parameters it consumes (stage_parameters)
+    and its input_files, chained to the key of the previous stage. If
+    the selections run in the pipeline, the load stage consumes the
+    input files of the cuts stage too.
+    """
+    parameters = stage_parameters(config)
+    files      = dict(input_files)
+    if getattr(config, 'pipeline_params', None):
+        files['load'] = files.get('load', []) + files.get('cuts', [])
+    keys       = {}
+    previous   = ''
+    for stage in CHECKPOINT_STAGES:
+        previous = keys[stage] = checkpoint_key(config, parameters[stage],
+                                                files.get(stage, []), previous)
+    return keys
+
+
+def checkpoint_folder(checkpoint_dir : Optional[str],
+                      key            : str)->Optional[str]:
+    """
+    Folder of the checkpoints of a run (created if needed).
+    None if checkpoint_dir is None (checkpointing disabled).
+    """
+    if checkpoint_dir is None:
+        return None
+    folder = os.path.join(os.path.expandvars(checkpoint_dir), key[:16])
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def checkpoint_filename(folder : str,
+                        stage  : str,
+                        suffix : str = '.pkl')->str:
+    if stage not in CHECKPOINT_STAGES:
+        raise ValueError(f'Unknown checkpoint stage {stage}, expected one of {CHECKPOINT_STAGES}')
+    return os.path.join(folder, stage + suffix)
+
+
+def save_checkpoint(folder   : Optional[str],
+                    stage    : str,
+                    products : Any)->None:
+    """
+    Persists the products of stage. The file is written atomically, so
+    a run killed while writing does not leave a truncated checkpoint.
+    Nothing is done if folder is None.
+    """
+    if folder is None: return
+    filename = checkpoint_filename(folder, stage)
+    tmp_file = filename + f'.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(products, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, filename)
+
+
+def load_checkpoint(folder : Optional[str],
+                    stage  : str)->Any:
+    """
+    Products of stage saved by save_checkpoint,
+    or None if there is no checkpoint (or folder is None).
+    """
+    if folder is None: return None
+    filename = checkpoint_filename(folder, stage)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        products = pickle.load(f)
+    print("    Stage {0} restored from checkpoint {1}".format(stage, filename))
+    return products
+
+
+def save_checkpoint_file(folder   : Optional[str],
+                         stage    : str,
+                         filename : str)->None:
+    """Keeps a copy of an output file written by stage (e.g. histograms)."""
+    if folder is None: return
+    copy     = checkpoint_filename(folder, stage, '.' + os.path.basename(filename))
+    tmp_file = copy + f'.{os.getpid()}.tmp'
+    shutil.copyfile(filename, tmp_file)
+    os.replace(tmp_file, copy)
+
+
+def restore_checkpoint_file(folder   : str,
+                            stage    : str,
+                            filename : str)->None:
+    """Restores the output file of stage saved by save_checkpoint_file."""
+    copy = checkpoint_filename(folder, stage, '.' + os.path.basename(filename))
+    shutil.copyfile(copy, filename)
@@ -0,0 +1,127 @@
+import os
+import numpy  as np
+import pandas as pd
+
+from types import SimpleNamespace
+
+from pytest import raises
+
+from . import checkpoint_functions_test
+from . checkpoint_functions import stable_repr
+from . checkpoint_functions import checkpoint_keys
+from . checkpoint_functions import checkpoint_folder
+from . checkpoint_functions import save_checkpoint
+from . checkpoint_functions import load_checkpoint
+from . checkpoint_functions import save_checkpoint_file
+from . checkpoint_functions import restore_checkpoint_file
+
+
+def make_config(**kwargs):
+    params = dict(quality_ranges  = dict(r_max = 500),
+                  map_params      = dict(nbins_z = 15, z_range = (10, 550)),
+                  diff_band_lower = lambda dt: -0.7 + 0.030 * (dt - 20),
+                  krevol_params   = dict(nStimeprofile = 1800),
+                  file_out_map    = 'map.h5',
+                  checkpoint_dir  = None)
+    params.update(kwargs)
+    return SimpleNamespace(**params)
+
+
+BAND_SLOPE = 0.030
+
+
+def test_stable_repr_changes_with_called_function():
+    assert stable_repr(lambda dt: np.exp(dt)) != stable_repr(lambda dt: np.log(dt))
+    assert stable_repr(lambda dt: np.exp(dt)) == stable_repr(lambda dt: np.exp(dt))
+
+
+def test_stable_repr_changes_with_globals_and_closures(monkeypatch):
+    def band(offset):
+        return lambda dt: offset + BAND_SLOPE * (dt - 20)
+
+    repr1 = stable_repr(band(-0.7))
+    assert repr1 != stable_repr(band(-0.6))
+    monkeypatch.setattr(checkpoint_functions_test, 'BAND_SLOPE', 0.031)
+    assert repr1 != stable_repr(band(-0.7))
+
+
+def changed_stages(keys1, keys2):
+    return [stage for stage in keys1 if keys1[stage] != keys2[stage]]
+
+
+def test_checkpoint_keys_stable_for_equal_configs():
+    assert checkpoint_keys(make_config(), {}) == checkpoint_keys(make_config(), {})
+
+
+def test_checkpoint_keys_ignore_output_files():
+    keys1 = checkpoint_keys(make_config(file_out_map = 'a.h5'), {})
+    keys2 = checkpoint_keys(make_config(file_out_map = 'b.h5'), {})
+    assert keys1 == keys2
+
+
+def test_checkpoint_keys_change_from_the_stage_consuming_the_parameter():
+    keys    = checkpoint_keys(make_config(), {})
+    quality = checkpoint_keys(make_config(quality_ranges = dict(r_max = 450)), {})
+    band    = checkpoint_keys(make_config(diff_band_lower = lambda dt: -0.6 + 0.030 * (dt - 20)), {})
+    fit     = checkpoint_keys(make_config(map_params = dict(nbins_z = 16, z_range = (10, 550))), {})
+    krevol  = checkpoint_keys(make_config(krevol_params = dict(nStimeprofile = 3600)), {})
+    assert changed_stages(keys, quality) == ['load', 'cuts', 'map', 'krevol']
+    assert changed_stages(keys, band   ) == [        'cuts', 'map', 'krevol']
+    assert changed_stages(keys, fit    ) == [                'map', 'krevol']
+    assert changed_stages(keys, krevol ) == [                       'krevol']
+
+
+def test_checkpoint_keys_with_pipeline_load_consumes_cuts_parameters():
+    config = make_config(pipeline_params = dict(n_readers = 2))
+    keys   = checkpoint_keys(config, {})
+    band   = checkpoint_keys(make_config(pipeline_params = dict(n_readers = 2),
+                                         diff_band_lower = lambda dt: -0.6 + 0.030 * (dt - 20)), {})
+    assert changed_stages(keys, band) == ['load', 'cuts', 'map', 'krevol']
+
+
+def test_checkpoint_keys_change_with_inputs(tmpdir_factory):
+    filename = os.path.join(tmpdir_factory.mktemp('checkpoints'), 'bootstrap.h5')
+    with open(filename, 'w') as f: f.write('a')
+    keys1 = checkpoint_keys(make_config(), dict(cuts = [filename]))
+    with open(filename, 'w') as f: f.write('ab')
+    keys2 = checkpoint_keys(make_config(), dict(cuts = [filename]))
+    assert changed_stages(keys1, keys2) == ['cuts', 'map', 'krevol']
+
+
+def test_save_and_load_checkpoint(tmpdir_factory):
+    folder   = checkpoint_folder(str(tmpdir_factory.mktemp('checkpoints')), 'abcd' * 10)
+    dst      = pd.DataFrame(dict(event = np.arange(10), S2e = np.random.uniform(size=10)))
+    mask     = np.random.uniform(size=10) > 0.5
+    assert load_checkpoint(folder, 'cuts') is None
+
+    save_checkpoint(folder, 'load', dst)
+    save_checkpoint(folder, 'cuts', (mask, None))
+    pd.testing.assert_frame_equal(load_checkpoint(folder, 'load'), dst)
+    assert np.all(load_checkpoint(folder, 'cuts')[0] == mask)
+    assert not [f for f in os.listdir(folder) if f.endswith('.tmp')]
+
+
+def test_checkpoints_disabled_without_folder():
+    folder = checkpoint_folder(None, 'abcd' * 10)
+    save_checkpoint(folder, 'load', 1)
+    assert folder is None
+    assert load_checkpoint(folder, 'load') is None
+
+
+def test_save_checkpoint_unknown_stage(tmpdir_factory):
+    folder = checkpoint_folder(str(tmpdir_factory.mktemp('checkpoints')), 'abcd' * 10)
+    with raises(ValueError):
+        save_checkpoint(folder, 'fit', 1)
+
+
+def test_restore_checkpoint_file(tmpdir_factory):
+    scratch  = str(tmpdir_factory.mktemp('checkpoints'))
+    folder   = checkpoint_folder(scratch, 'abcd' * 10)
+    filename = os.path.join(scratch, 'histos.h5')
+    with open(filename, 'w') as f: f.write('histograms')
+    save_checkpoint_file(folder, 'cuts', filename)
+
+    os.remove(filename)
+    restore_checkpoint_file(folder, 'cuts', filename)
+    with open(filename) as f:
+        assert f.read() == 'histograms'
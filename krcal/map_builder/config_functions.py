@@ -0,0 +1,169 @@
+"""Module config_functions.
+This module validates map builder configurations without running the
+map production (e.g. run_map_production.py --dry-run).
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    Only the standard library is imported here, so a configuration can
+    be validated without the start-up time of numpy, pandas or IC.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import glob
+
+from typing import List
+
+
+REQUIRED_PARAMETERS = ('folder', 'file_in', 'file_bootstrap_map', 'file_out_map',
+                       'file_out_hists', 'ref_Z_histogram', 'run_number',
+                       'select_diffusion_band', 'quality_ranges',
+                       'nS1_eff_min', 'nS1_eff_max', 'nS2_eff_min', 'nS2_eff_max',
+                       'nsigmas_Zdst', 'n_dev_rate', 'band_sel_params',
+                       'thr_evts_for_sel_map_bins', 'default_n_bins',
+                       'ns1_histo_params', 'ns2_histo_params', 'rate_histo_params',
+                       'map_params', 'krevol_params')
+
+DIFFUSION_PARAMETERS = ('diff_band_lower', 'diff_band_upper', 'diff_band_eff_min',
+                        'diff_band_eff_max', 'diff_histo_params')
+
+DICT_KEYS = dict(ref_Z_histogram = ('ref_histo_file', 'key_Z_histo'),
+                 band_sel_params = ('range_Z', 'range_E', 'nbins_z', 'nbins_e',
+                                    'nsigma_sel', 'eff_min', 'eff_max'),
+                 map_params      = ('nbins_z', 'nbins_e', 'z_range', 'e_range', 'chi2_range',
+                                    'lt_range', 'nmin', 'maxFailed', 'dv_maxFailed', 'r_max',
+                                    'x_range', 'y_range'),
+                 krevol_params   = ('r_fid', 'nStimeprofile', 'zslices_lt', 'zrange_lt',
+                                    'nbins_dv', 'zrange_dv', 'detector'))
+
+RANGES = dict(band_sel_params = ('range_Z', 'range_E'),
+              map_params      = ('z_range', 'e_range', 'chi2_range', 'lt_range',
+                                 'x_range', 'y_range'),
+              krevol_params   = ('zrange_lt', 'zrange_dv'))
+
+BAND_METHODS = ('gauss', 'quantile')
+
+FIT_TYPE_PARAMETERS = ('robust_fit_params', 'ml_fit_params', 'joint_fit_params')
+
+EFFICIENCY_INTERVALS = (('nS1_eff_min', 'nS1_eff_max'),
+                        ('nS2_eff_min', 'nS2_eff_max'))
+
+
+def is_range(value)->bool:
+    """True for a (min, max) pair with min < max."""
+    try:
+        low, high = value
+        return low < high
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_parameters(config)->List[str]:
+    """
+    Errors in the parameters of config: missing parameters and keys,
+    empty ranges and inconsistent options.
+    """
+    params  = vars(config)
+    errors  = [f'Missing parameter {name}' for name in REQUIRED_PARAMETERS if name not in params]
+    if params.get('select_diffusion_band'):
+        errors += [f'Missing parameter {name} (select_diffusion_band is set)'
+                   for name in DIFFUSION_PARAMETERS if name not in params]
+
+    for name, keys in DICT_KEYS.items():
+        value = params.get(name)
+        if value is None: continue
+        if not isinstance(value, dict):
+            errors.append(f'{name} must be a dict')
+            continue
+        errors += [f'Missing key {key} in {name}' for key in keys if key not in value]
+        errors += [f'{name}[{key!r}] must be a (min, max) range, got {value[key]}'
+                   for key in RANGES.get(name, ()) if key in value and not is_range(value[key])]
+
+    intervals = list(EFFICIENCY_INTERVALS)
+    if isinstance(params.get('band_sel_params'), dict):
+        band = params['band_sel_params']
+        if 'eff_min' in band and 'eff_max' in band and band['eff_min'] > band['eff_max']:
+            errors.append('band_sel_params eff_min > eff_max')
+        if band.get('method', 'gauss') not in BAND_METHODS:
+            errors.append(f"band_sel_params method must be one of {BAND_METHODS}, got {band['method']!r}")
+    if params.get('select_diffusion_band'):
+        intervals.append(('diff_band_eff_min', 'diff_band_eff_max'))
+    for low, high in intervals:
+        if low in params and high in params and params[low] > params[high]:
+            errors.append(f'{low} > {high}')
+
+    pyramid = params.get('map_pyramid_bins')
+    if pyramid and any(max(pyramid) % nbins for nbins in pyramid):
+        errors.append(f'map_pyramid_bins {pyramid} must divide the finest binning')
+    if params.get('quadtree_params') and params.get('rphi_params'):
+        errors.append('quadtree_params and rphi_params are exclusive')
+    for name in ('bootstrap_params',) + FIT_TYPE_PARAMETERS:
+        if params.get(name) and (params.get('quadtree_params') or params.get('rphi_params')):
+            errors.append(f'{name} is only available for XY maps')
+    warm_start = params.get('warm_start_params')
+    if warm_start and not (isinstance(warm_start, dict) and 'prior_map' in warm_start):
+        errors.append('warm_start_params must be a dict with a prior_map')
+    if warm_start and (params.get('quadtree_params') or params.get('rphi_params')):
+        errors.append('warm_start_params is only available for XY maps')
+    if warm_start and params.get('joint_fit_params') is not None:
+        errors.append('warm_start_params is not available for the joint fit')
+    comparison = params.get('ref_Z_comparison')
+    if comparison and not (isinstance(comparison, dict) and
+                           all(isinstance(spec, (tuple, list)) and len(spec) == 2
+                               for spec in comparison.values())):
+        errors.append('ref_Z_comparison must be a dict of name: (ref_histo_file, key_Z_histo)')
+    windows = params.get('krevol_windows')
+    if windows and not (isinstance(windows, dict) and windows.get('window', 0) > 0 and
+                        windows.get('stride', 1) > 0):
+        errors.append('krevol_windows must be a dict with a positive window (and stride)')
+    fit_options = [name for name in FIT_TYPE_PARAMETERS if params.get(name) is not None]
+    if len(fit_options) > 1:
+        errors.append(f'Lifetime fit options {fit_options} are exclusive')
+    fraction = params.get('early_check_fraction')
+    if fraction is not None and not 0 < fraction <= 1:
+        errors.append(f'early_check_fraction must be in (0, 1], got {fraction}')
+    return errors
+
+
+def validate_files(config)->List[str]:
+    """Errors in the input and output files of config."""
+    errors = []
+    folder = os.path.expandvars(config.folder)
+    if not glob.glob(folder + config.file_in):
+        errors.append(f'No input files match {folder + config.file_in}')
+
+    inputs = [config.file_bootstrap_map, config.ref_Z_histogram['ref_histo_file']]
+    if getattr(config, 'warm_start_params', None):
+        inputs.append(config.warm_start_params['prior_map'])
+    if getattr(config, 'ref_Z_comparison', None):
+        inputs += [filename for filename, _ in config.ref_Z_comparison.values()]
+    errors += [f'Input file {os.path.expandvars(f)} not found'
+               for f in inputs if not os.path.isfile(os.path.expandvars(f))]
+
+    for output in (config.file_out_map, config.file_out_hists):
+        out_dir = os.path.dirname(os.path.abspath(os.path.expandvars(output)))
+        if not os.path.isdir(out_dir):
+            errors.append(f'Output folder {out_dir} not found')
+    return errors
+
+
+def validate_config(config)->List[str]:
+    """
+    Validates a map builder configuration.
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration.
+
+    Returns
+    -------
+        List of errors (empty for a valid configuration). The files
+        are only checked if the parameters are valid.
+    """
+    errors = validate_parameters(config)
+    return errors if errors else validate_files(config)
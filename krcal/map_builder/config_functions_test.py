@@ -0,0 +1,147 @@
+import os
+import sys
+import subprocess
+
+from types  import SimpleNamespace
+from pytest import fixture
+
+from . config_functions import validate_parameters
+from . config_functions import validate_files
+from . config_functions import validate_config
+
+
+HEAVY_MODULES     = ('numpy', 'pandas', 'scipy', 'tables', 'matplotlib', 'invisible_cities')
+IMPORT_BUDGET_US  = 100000 # cumulative import time of config_functions in microseconds
+
+PRODUCTION_MODULES       = ('pandas', 'scipy', 'tables', 'matplotlib')
+DRY_RUN_IMPORT_BUDGET_US = 1000000 # import time of run_map_production.py --dry-run (IC configure included) in microseconds
+
+
+@fixture
+def config(tmpdir_factory):
+    folder = str(tmpdir_factory.mktemp('config'))
+    for filename in ('kdst_0.h5', 'bootstrap_map.h5', 'z_histo.h5'):
+        open(os.path.join(folder, filename), 'w').close()
+
+    return SimpleNamespace(
+        folder                    = folder + '/',
+        file_in                   = 'kdst_*.h5',
+        file_bootstrap_map        = os.path.join(folder, 'bootstrap_map.h5'),
+        file_out_map              = os.path.join(folder, 'map.h5'),
+        file_out_hists            = os.path.join(folder, 'histos.h5'),
+        ref_Z_histogram           = dict(ref_histo_file = os.path.join(folder, 'z_histo.h5'),
+                                         key_Z_histo    = 'histo_Z_dst'),
+        run_number                = 0,
+        select_diffusion_band     = False,
+        quality_ranges            = dict(r_max = 480),
+        nS1_eff_min               = 0.5,
+        nS1_eff_max               = 1.0,
+        nS2_eff_min               = 0.5,
+        nS2_eff_max               = 1.0,
+        nsigmas_Zdst              = 10,
+        n_dev_rate                = 5,
+        band_sel_params           = dict(range_Z = (50, 1300), range_E = (7.5e3, 9.5e3),
+                                         nbins_z = 80, nbins_e = 80, nsigma_sel = 3.5,
+                                         eff_min = 0.5, eff_max = 1.0),
+        thr_evts_for_sel_map_bins = 1e6,
+        default_n_bins            = None,
+        ns1_histo_params          = dict(nbins_hist = 10, range_hist = (0, 10), norm = True),
+        ns2_histo_params          = dict(nbins_hist = 10, range_hist = (0, 10), norm = True),
+        rate_histo_params         = dict(bin_size = 180, normed = False),
+        map_params                = dict(nbins_z = 15, nbins_e = 25, z_range = (20, 1350),
+                                         e_range = (2000, 10000), chi2_range = (0, 100),
+                                         lt_range = (5000, 55000), nmin = 50, maxFailed = 2000,
+                                         dv_maxFailed = 2000, r_max = 480,
+                                         x_range = (-500, 500), y_range = (-500, 500)),
+        krevol_params             = dict(r_fid = 200, nStimeprofile = 7200, zslices_lt = 50,
+                                         zrange_lt = (50, 1300), nbins_dv = 50,
+                                         zrange_dv = (1300, 1450), detector = "next100"))
+
+
+def test_validate_config_valid(config):
+    assert validate_config(config) == []
+
+
+def test_validate_parameters_missing(config):
+    del config.map_params['nmin']
+    del config.n_dev_rate
+    config.select_diffusion_band = True
+    errors = validate_parameters(config)
+    assert 'Missing parameter n_dev_rate'  in errors
+    assert 'Missing key nmin in map_params' in errors
+    assert any('diff_band_lower' in error for error in errors)
+
+
+def test_validate_parameters_inconsistent(config):
+    config.nS1_eff_min            = 0.9
+    config.nS1_eff_max            = 0.8
+    config.map_params['z_range']  = (1350, 20)
+    config.map_pyramid_bins       = (200, 100, 30)
+    config.quadtree_params        = dict(max_depth = 7, k = 4)
+    config.rphi_params            = dict(nsectors = 10, nwedges = 12)
+    assert len(validate_parameters(config)) == 4
+
+
+def test_validate_parameters_warm_start_only_for_xy_maps(config):
+    config.warm_start_params = dict(prior_map = 'prior.h5')
+    assert validate_parameters(config) == []
+    config.quadtree_params   = dict(max_depth = 7, k = 4)
+    assert validate_parameters(config) == ['warm_start_params is only available for XY maps']
+
+
+def test_validate_files(config):
+    config.file_in        = 'missing_*.h5'
+    config.file_out_hists = '/missing_folder/histos.h5'
+    assert len(validate_files(config)) == 2
+
+
+def import_times(stderr : str):
+    """Cumulative import time (us) of each module in a -X importtime output."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.rstrip()] = int(cumulative)
+    return times
+
+
+def test_config_functions_import_budget():
+    env    = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import krcal.map_builder.config_functions'],
+                            env=env, capture_output=True, text=True, check=True)
+    times  = {name.strip(): time for name, time in import_times(result.stderr).items()}
+
+    assert not [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+    assert times['krcal.map_builder.config_functions'] < IMPORT_BUDGET_US
+
+
+def test_dry_run_import_budget(tmpdir_factory):
+    icaro  = os.environ['ICARO']
+    folder = str(tmpdir_factory.mktemp('dry_run'))
+    open(os.path.join(folder, 'kdst_0.h5'), 'w').close()
+    with open(os.path.join(icaro, 'conf', 'next-100', 'kr_only.conf')) as f:
+        conf = f.read()
+    for placeholder, value in (("'{folderin}'"   , repr(folder + '/')                        ),
+                               ("'{filein}'"     , repr('kdst_*.h5')                         ),
+                               ("'{fileoutmap}'" , repr(os.path.join(folder, 'map.h5'))      ),
+                               ("'{fileouthist}'", repr(os.path.join(folder, 'histos.h5'))   ),
+                               ("'{runnumber}'"  , '0'                                       )):
+        conf = conf.replace(placeholder, value)
+    conf_file = os.path.join(folder, 'kr_only.conf')
+    with open(conf_file, 'w') as f:
+        f.write(conf)
+
+    env    = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    script = os.path.join(icaro, 'bin', 'run_map_production.py')
+    result = subprocess.run([sys.executable, '-X', 'importtime', script, conf_file, '--dry-run'],
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout
+    assert 'Configuration valid' in result.stdout
+
+    times     = import_times(result.stderr)
+    top_level = {name: time for name, time in times.items() if not name.startswith(' ')}
+    modules   = {name.strip() for name in times}
+    assert not [name for name in modules if name.split('.')[0] in PRODUCTION_MODULES]
+    assert not  modules & {'krcal.map_builder.map_builder_functions', 'krcal.core.fitmap_functions'}
+    assert sum(top_level.values()) < DRY_RUN_IMPORT_BUDGET_US
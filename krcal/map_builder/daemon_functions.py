@@ -0,0 +1,231 @@
+"""Module daemon_functions.
+This module produces maps in near real time: a long-running process
+watches the input folder of a run, adds every newly closed kdst file to
+the accumulated statistics of the run and writes the map, the time
+evolution and the control histograms again when enough new events have
+been selected.
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    Each file is processed as a shard (see shard_functions), so adding
+    a file only costs its own selection, and the map is computed from
+    the merged partial results. The Kr band of a file is fitted on the
+    Z vs E histogram of all the files accumulated so far and the file
+    itself, so it does not depend on the statistics of a single file. A
+    file is considered closed when it has not been modified for
+    settle_time seconds.
+
+    The work state (processed files, failed attempts of each file,
+    events at the last map) is kept in a JSON state file, and the
+    accumulated partial result next to it, so the daemon can restart
+    without reprocessing any file. Both are written once per poll. A
+    file that cannot be processed is reported and tried again in the
+    following polls, up to max_attempts times (the error may be
+    transient, e.g. a file still being copied or a full disk).
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import os
+import glob
+import json
+import time
+
+from typing      import List
+from typing      import Dict
+from typing      import Optional
+from typing      import Tuple
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import asdict
+
+from . shard_functions       import map_partial
+from . shard_functions       import process_shard
+from . shard_functions       import shard_band_histogram
+from . shard_functions       import merge_map_partials
+from . shard_functions       import write_map_partial
+from . shard_functions       import read_map_partial
+from . shard_functions       import reduce_map_partials
+from . batch_functions       import shared_references
+from . checking_functions    import AbortingMapCreation
+
+
+@dataclass
+class daemon_state:
+    processed          : List[str]      = field(default_factory=list) # input files already accumulated
+    failed             : Dict[str, int] = field(default_factory=dict) # failed attempts of the input files not processed yet
+    events_at_last_map : int            = 0                           # selected events in the last map
+    last_map_time      : float          = 0.                          # time of the last map (s since epoch)
+
+
+def partial_filename(state_file : str)->str:
+    return os.path.splitext(state_file)[0] + '_partial.npz'
+
+
+def load_daemon_state(state_file : str)->Tuple[daemon_state, Optional[map_partial]]:
+    """State and accumulated partial result (None before the first file)."""
+    if not os.path.exists(state_file):
+        return daemon_state(), None
+    with open(state_file) as f:
+        state = daemon_state(**json.load(f))
+    partial = read_map_partial(partial_filename(state_file)) if state.processed else None
+    return state, partial
+
+
+def save_daemon_state(state      : daemon_state,
+                      partial    : map_partial ,
+                      state_file : str         )->None:
+    """
+    Writes the partial result and then the state. Both are replaced
+    atomically, so a daemon killed while writing restarts from the
+    previous state (and reprocesses the files added since then).
+    """
+    if partial is not None:
+        tmp_file = partial_filename(state_file) + f'.{os.getpid()}.tmp.npz'
+        write_map_partial(partial, tmp_file)
+        os.replace(tmp_file, partial_filename(state_file))
+
+    tmp_file = state_file + f'.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(asdict(state), f, indent=1)
+    os.replace(tmp_file, state_file)
+
+
+def closed_files(input_path  : str,
+                 input_dsts  : str,
+                 processed   : List[str],
+                 settle_time : float,
+                 now         : Optional[float] = None)->List[str]:
+    """
+    Sorted list of the files matching input_path + input_dsts that are
+    not processed yet and have not been modified for settle_time seconds.
+    """
+    now   = time.time() if now is None else now
+    done  = set(processed)
+    files = sorted(glob.glob(os.path.expandvars(input_path) + input_dsts))
+    return [f for f in files if f not in done and now - os.path.getmtime(f) >= settle_time]
+
+
+def map_due(state          : daemon_state,
+            partial        : map_partial ,
+            min_new_events : int         ,
+            min_interval   : float       ,
+            now            : Optional[float] = None)->bool:
+    """
+    True if the map has to be written again: at least min_new_events
+    selected events since the last map and min_interval seconds
+    since the last map.
+    """
+    now = time.time() if now is None else now
+    if partial is None:
+        return False
+    new_events = partial.tallies['band'] - state.events_at_last_map
+    return new_events >= min_new_events and now - state.last_map_time >= min_interval
+
+
+def daemon_step(config                                ,
+                state          : daemon_state         ,
+                partial        : Optional[map_partial],
+                state_file     : str                  ,
+                settle_time    : float                ,
+                min_new_events : int                  ,
+                min_interval   : float                ,
+                max_attempts   : int = 3              )->Tuple[daemon_state, Optional[map_partial]]:
+    """
+    Accumulates the newly closed files and writes the map if it is due.
+    The band of each file is fitted on the files accumulated so far
+    and the file itself. A file that fails is reported, its attempt is counted in
+    state.failed and it is tried again in the next step, until it has
+    failed max_attempts times. A failed map check is reported and the
+    map is tried again when more events arrive; any other error of the
+    map computation is reported and the map is tried again after
+    min_interval. The state and the partial result are saved at the end
+    of the step if anything changed.
+
+    Returns
+    -------
+        The updated state and partial result.
+    """
+    bootstrapmap, ref_histos = shared_references(config)
+    given_up = [filename for filename, attempts in state.failed.items() if attempts >= max_attempts]
+    changed  = False
+    for filename in closed_files(config.folder, config.file_in,
+                                 state.processed + given_up, settle_time):
+        print("Adding {0}".format(filename))
+        changed = True
+        try:
+            band_histo   = shard_band_histogram(config, [filename], bootstrapmap)
+            if partial is not None:
+                band_histo = band_histo + partial.histos.get('band_ZE', 0)
+            file_partial = process_shard(config, [filename], bootstrapmap, ref_histos, band_histo)
+        except Exception as error:
+            attempts = state.failed[filename] = state.failed.get(filename, 0) + 1
+            retry    = "it will be tried again" if attempts < max_attempts else "giving up"
+            print("WARNING: {0} could not be processed (attempt {1} of {2}, {3}): {4!r}".format(
+                  filename, attempts, max_attempts, retry, error))
+            continue
+        partial      = file_partial if partial is None else merge_map_partials(partial, file_partial)
+        state.processed.append(filename)
+        state.failed.pop(filename, None)
+
+    if map_due(state, partial, min_new_events, min_interval):
+        changed = True
+        try:
+            reduce_map_partials(config, [partial], ref_histos)
+            state.events_at_last_map = partial.tallies['band']
+        except AbortingMapCreation as error:
+            print("Map not updated: {0}".format(error))
+            state.events_at_last_map = partial.tallies['band']
+        except Exception as error:
+            print("ERROR: map not updated, it could not be computed: {0!r}".format(error))
+        state.last_map_time = time.time()
+
+    if changed:
+        save_daemon_state(state, partial, state_file)
+    return state, partial
+
+
+def run_daemon(config                           ,
+               state_file     : str             ,
+               poll_interval  : float = 60      ,
+               settle_time    : float = 120     ,
+               min_new_events : int   = 100000  ,
+               min_interval   : float = 600     ,
+               max_attempts   : int   = 3       ,
+               max_iterations : Optional[int] = None)->None:
+    """
+    Watches the input files of config (folder + file_in) and keeps the
+    map of the run (config.file_out_map, config.file_out_hists) up to date.
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration.
+    state_file: str
+        JSON file with the work state (see module notes).
+    poll_interval: float
+        Seconds between two looks at the input folder.
+    settle_time: float
+        Seconds without modification for a file to be considered closed.
+    min_new_events: int
+        New selected events needed to write the map again.
+    min_interval: float
+        Minimum seconds between two maps.
+    max_attempts: int
+        Number of times a file that cannot be processed is tried.
+    max_iterations: int (optional)
+        Number of polls before returning (forever by default).
+    """
+    state, partial = load_daemon_state(state_file)
+    print("Map daemon starting with {0} processed files ({1} failed)".format(len(state.processed),
+                                                                            len(state.failed)))
+    iteration = 0
+    while max_iterations is None or iteration < max_iterations:
+        state, partial = daemon_step(config, state, partial, state_file,
+                                     settle_time, min_new_events, min_interval, max_attempts)
+        iteration += 1
+        if max_iterations is None or iteration < max_iterations:
+            time.sleep(poll_interval)
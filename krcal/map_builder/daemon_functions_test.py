@@ -0,0 +1,133 @@
+import os
+import time
+
+import numpy as np
+
+from types         import SimpleNamespace
+from numpy.testing import assert_array_equal
+
+from . shard_functions_test import random_partial
+from . import daemon_functions
+from . daemon_functions     import daemon_state
+from . daemon_functions     import closed_files
+from . daemon_functions     import map_due
+from . daemon_functions     import save_daemon_state
+from . daemon_functions     import load_daemon_state
+from . daemon_functions     import daemon_step
+
+
+def test_closed_files_skips_processed_and_open_files(tmpdir_factory):
+    folder = str(tmpdir_factory.mktemp('daemon')) + '/'
+    now    = time.time()
+    for i, age in enumerate((1000, 1000, 1000, 10)):
+        filename = os.path.join(folder, f'kdst_{i}.h5')
+        open(filename, 'w').close()
+        os.utime(filename, (now - age, now - age))
+
+    files = closed_files(folder, 'kdst_*.h5', [folder + 'kdst_1.h5'], settle_time = 60, now = now)
+    assert files == [folder + 'kdst_0.h5', folder + 'kdst_2.h5']
+
+
+def test_map_due():
+    partial = random_partial(t_first = 0, nt = 3, seed = 1)
+    nband   = partial.tallies['band']
+    state   = daemon_state(events_at_last_map = nband - 10, last_map_time = 1000)
+    assert     map_due(state, partial, min_new_events = 10, min_interval = 100, now = 1100)
+    assert not map_due(state, partial, min_new_events = 11, min_interval = 100, now = 1100)
+    assert not map_due(state, partial, min_new_events = 10, min_interval = 100, now = 1099)
+    assert not map_due(daemon_state(), None, min_new_events = 0, min_interval = 0)
+
+
+def test_daemon_state_round_trip(tmpdir_factory):
+    state_file = os.path.join(tmpdir_factory.mktemp('daemon'), 'state.json')
+    assert load_daemon_state(state_file) == (daemon_state(), None)
+
+    partial = random_partial(t_first = 0, nt = 3, seed = 1)
+    state   = daemon_state(processed = ['kdst_0.h5'], events_at_last_map = 10, last_map_time = 5.)
+    save_daemon_state(state, partial, state_file)
+
+    read_state, read_partial = load_daemon_state(state_file)
+    assert read_state == state
+    assert_array_equal(read_partial.stats, partial.stats)
+    assert not [f for f in os.listdir(os.path.dirname(state_file)) if '.tmp' in f]
+
+
+def test_daemon_step_retries_failed_files(tmpdir_factory, monkeypatch):
+    folder = str(tmpdir_factory.mktemp('daemon')) + '/'
+    for i in range(3):
+        open(os.path.join(folder, f'kdst_{i}.h5'), 'w').close()
+
+    calls = []
+    def process_shard(config, files, bootstrapmap, ref_histos, band_histo):
+        calls.append(files[0])
+        if files[0].endswith('kdst_1.h5'):
+            raise OSError('truncated file')
+        return random_partial(t_first = 0, nt = 3, seed = len(calls))
+
+    saves = []
+    save  = daemon_functions.save_daemon_state
+    def save_daemon_state(state, partial, state_file):
+        saves.append(state_file)
+        save(state, partial, state_file)
+
+    monkeypatch.setattr(daemon_functions, 'shared_references', lambda config: (None, None))
+    monkeypatch.setattr(daemon_functions, 'process_shard'    , process_shard)
+    monkeypatch.setattr(daemon_functions, 'save_daemon_state', save_daemon_state)
+    monkeypatch.setattr(daemon_functions, 'shard_band_histogram', lambda *args: np.zeros((2, 2)))
+    config     = SimpleNamespace(folder = folder, file_in = 'kdst_*.h5')
+    state_file = folder + 'state.json'
+    step       = dict(settle_time = 0, min_new_events = 10**9, min_interval = 0, max_attempts = 2)
+
+    state, partial = daemon_step(config, daemon_state(), None, state_file, **step)
+    assert state.processed == [folder + 'kdst_0.h5', folder + 'kdst_2.h5']
+    assert state.failed    == {folder + 'kdst_1.h5': 1}
+    assert partial.tallies['band'] == (random_partial(0, 3, 1).tallies['band'] +
+                                       random_partial(0, 3, 3).tallies['band'])
+    assert len(saves) == 1
+
+    state, partial = daemon_step(config, *load_daemon_state(state_file), state_file, **step)
+    assert calls[3:] == [folder + 'kdst_1.h5']
+    assert state.failed == {folder + 'kdst_1.h5': 2}
+
+    state, partial = daemon_step(config, *load_daemon_state(state_file), state_file, **step)
+    assert len(calls) == 4
+    assert len(saves) == 2
+
+
+def test_daemon_step_reports_map_errors(tmpdir_factory, monkeypatch, capsys):
+    folder  = str(tmpdir_factory.mktemp('daemon')) + '/'
+    partial = random_partial(t_first = 0, nt = 3, seed = 1)
+    def reduce_map_partials(config, partials, ref_histos):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(daemon_functions, 'shared_references'  , lambda config: (None, None))
+    monkeypatch.setattr(daemon_functions, 'reduce_map_partials', reduce_map_partials)
+    config     = SimpleNamespace(folder = folder, file_in = 'kdst_*.h5')
+    state_file = folder + 'state.json'
+
+    state, _ = daemon_step(config, daemon_state(), partial, state_file,
+                           settle_time = 0, min_new_events = 0, min_interval = 0)
+    assert 'disk full' in capsys.readouterr().out
+    assert state.events_at_last_map == 0
+    assert state.last_map_time > 0
+    assert load_daemon_state(state_file)[0] == state
+
+
+def test_daemon_step_fits_the_band_on_the_accumulated_files(tmpdir_factory, monkeypatch):
+    folder = str(tmpdir_factory.mktemp('daemon')) + '/'
+    open(os.path.join(folder, 'kdst_1.h5'), 'w').close()
+    partial = random_partial(t_first = 0, nt = 3, seed = 1)
+    partial.histos['band_ZE'] = np.full((2, 2), 3.)
+
+    bands = []
+    def process_shard(config, files, bootstrapmap, ref_histos, band_histo):
+        bands.append(band_histo)
+        return random_partial(t_first = 0, nt = 3, seed = 2)
+
+    monkeypatch.setattr(daemon_functions, 'shared_references'   , lambda config: (None, None))
+    monkeypatch.setattr(daemon_functions, 'process_shard'       , process_shard)
+    monkeypatch.setattr(daemon_functions, 'shard_band_histogram', lambda *args: np.ones((2, 2)))
+    config = SimpleNamespace(folder = folder, file_in = 'kdst_*.h5')
+    daemon_step(config, daemon_state(), partial, folder + 'state.json',
+                settle_time = 0, min_new_events = 10**9, min_interval = 0)
+    assert_array_equal(bands[0], np.full((2, 2), 4.))
@@ -1,5 +1,9 @@
 from typing      import Tuple
 from typing      import Callable
+from typing      import List
+from typing      import Dict
+from typing      import Sequence
+from typing      import Optional
 from dataclasses import dataclass
 from copy        import deepcopy
 
@@ -11,12 +15,29 @@ import os
 from .. core.kr_types                      import type_of_signal
 from .. core.kr_types                      import FitType
 from .. core.kr_types                      import masks_container
-from .. core.selection_functions           import selection_in_band
+from .. core.kr_types                      import ASectorMapTS
+from .. core.selection_functions           import BAND_METHODS
+from .. core.selection_functions           import compare_band_selections
 from .. core.selection_functions           import select_xy_sectors_df
 from .. core.selection_functions           import event_map_df
 from .. core.selection_functions           import get_time_series_df
 from .. core.fitmap_functions              import fit_map_xy_df
+from .. core.fitmap_functions              import fit_map_xyt_df
+from .. core.fitmap_functions              import fit_map_xy_batched_df
+from .. core.fitmap_functions              import fit_map_xy_joint_df
+from .. core.fitmap_functions              import BATCHED_FITS
+from .. core.fitmap_functions              import WARM_FITS
+from .. core.lt_stats_functions            import xy_lifetime_stats
+from .. core.lt_stats_functions            import coarsen_stats
+from .. core.lt_stats_functions            import fit_lifetime_from_stats
+from .. core.lt_stats_functions            import xy_bootstrap_spread
 from .. core.map_functions                 import amap_from_tsmap
+from .. core.map_functions                 import amap_from_fit_arrays
+from .. core.quadtree_functions            import quadtree_map
+from .. core.quadtree_functions            import amap_from_quadtree
+from .. core.map_functions                 import amap_from_rphi_map
+from .. core.fitmap_functions              import fit_map_rphi_df
+from .. core.selection_functions           import rphi_sectors_map
 from .. core.map_functions                 import tsmap_from_fmap
 from .. core.map_functions                 import add_mapinfo
 from .. core.map_functions                 import amap_replace_nan_by_mean
@@ -25,22 +46,42 @@ from .. core.correction_functions          import e0_xy_correction
 from .. core.kr_parevol_functions          import kr_time_evolution
 from .. core.kr_parevol_functions          import cut_time_evolution
 from .. core.kr_parevol_functions          import get_number_of_time_bins
+from .. core.kr_parevol_functions          import krevol_base_stats
+from .. core.kr_parevol_functions          import windowed_time_evolution
 from .. core.io_functions                  import write_complete_maps
 from .. core.io_functions                  import compute_and_save_hist_as_pd
-from .. core.io_functions                  import compute_and_save_hist2d_as_pd
+from .. core.io_functions                  import save_hist_as_pd
+from .. core.io_functions                  import save_hist2d_as_pd
 from .. core.histo_functions               import compute_similar_histo
-from .. core.histo_functions               import normalize_histo_and_poisson_error
 from .. core.histo_functions               import ref_hist
-
+from .. core.map_cache_functions           import read_cached_maps
+from .. core.histo_functions               import ref_hist_from_table
+from .. core.histo_functions               import uniform_bin_index
+from .. core.histo_functions               import compatibility_sigmas
+from .. core.histo_functions               import histo_bin_edges
+from .. core.histo_functions               import histo_accumulator
+from .. core.histo_functions               import histogram_from_accumulator
+from .. core.profiling_functions           import stage_profiler
+from .. core.profiling_functions           import profile_stage
+from .. core.profiling_functions           import profile_report_filename
+from .. core.profiling_functions           import write_profile_report
+
+from . checking_functions                  import AbortingMapCreation
 from . checking_functions                  import check_if_values_in_interval
 from . checking_functions                  import check_failed_fits
 from . checking_functions                  import get_core
+from . checkpoint_functions                import checkpoint_keys
+from . checkpoint_functions                import checkpoint_folder
+from . checkpoint_functions                import save_checkpoint
+from . checkpoint_functions                import load_checkpoint
+from . checkpoint_functions                import save_checkpoint_file
+from . checkpoint_functions                import restore_checkpoint_file
+from . checkpoint_functions                import file_stamp
 
 
 from invisible_cities.core.core_functions  import in_range
 from invisible_cities.io  .dst_io          import load_dsts
 from invisible_cities.reco.corrections     import ASectorMap
-from invisible_cities.reco.corrections     import read_maps
 from invisible_cities.types.symbols        import NormStrategy
 
 
@@ -48,6 +89,8 @@ from invisible_cities.types.symbols        import NormStrategy
 class ref_hist_container:
     Z_dist_hist : ref_hist
 
+_ref_histograms : Dict[Tuple[str, str, str], ref_hist] = {} # reference histograms read in this process
+
 def quality_cut(dst : pd.DataFrame, r_max : float) -> pd.DataFrame:
     """
     Does basic quality cut : R inside the r_max
@@ -100,24 +143,78 @@ def load_data(input_path         : str ,
         To be completed
     """
 
-    input_path         = os.path.expandvars(input_path)
-    dst_files          = glob.glob(input_path + input_dsts)
-    dst_full           = load_dsts(dst_files, "DST", "Events")
-    dst_full           = dst_full.sort_values(by=['time'])
-    mask_quality       = quality_cut(dst_full, **quality_ranges)
-    dst_filtered       = dst_full[mask_quality]
+    dst_files                 = get_dst_files(input_path, input_dsts)
+    dst_filtered              = load_dst_files(dst_files, quality_ranges)
+    bootstrap_map, ref_histos = load_references(file_bootstrap_map,
+                                                ref_histo_file    ,
+                                                key_Z_histo       )
+
+    return dst_filtered, bootstrap_map, ref_histos
+
+def get_dst_files(input_path : str,
+                  input_dsts : str) -> List[str]:
+    """
+    Returns the sorted list of kdst files matching input_path + input_dsts.
+    """
+    input_path = os.path.expandvars(input_path)
+    return sorted(glob.glob(input_path + input_dsts))
+
+def load_dst_files(dst_files      : List[str],
+                   quality_ranges : dict     ) -> pd.DataFrame:
+    """
+    Reads kdst files, sorts them in time and applies basic R cut.
+    """
+    return sort_and_quality_cut(load_dsts(dst_files, "DST", "Events"), quality_ranges)
+
+def sort_and_quality_cut(dst_full       : pd.DataFrame,
+                         quality_ranges : dict        ) -> pd.DataFrame:
+    """
+    Sorts a kdst in time and applies basic R cut (the part of
+    load_dst_files after the read).
+    """
+    dst_full     = dst_full.sort_values(by=['time'])
+    mask_quality = quality_cut(dst_full, **quality_ranges)
+    return dst_full[mask_quality]
 
+def read_reference_histogram(ref_histo_file : str,
+                             key_histo      : str) -> ref_hist:
+    """
+    Reads a reference histogram (see ref_hist_from_table). Each
+    histogram is read once per process and shared by all the runs,
+    until the file is modified (see file_stamp).
+    """
+    ref_histo_file = os.path.expandvars(ref_histo_file)
+    key            = (ref_histo_file, key_histo, file_stamp(ref_histo_file))
+    if key not in _ref_histograms:
+        _ref_histograms[key] = ref_hist_from_table(pd.read_hdf(key[0], key=key_histo))
+    return _ref_histograms[key]
+
+def load_references(file_bootstrap_map : str,
+                    ref_histo_file     : str,
+                    key_Z_histo        : str) -> Tuple[ASectorMap,
+                                                       ref_hist_container]:
+    """
+    Reads the bootstrap map (through the map cache, see
+    read_cached_maps) and the reference histograms.
+    """
     file_bootstrap_map = os.path.expandvars(file_bootstrap_map)
-    bootstrap_map      = read_maps(file_bootstrap_map)
+    bootstrap_map      = read_cached_maps(file_bootstrap_map)
 
-    ref_histo_file     = os.path.expandvars(ref_histo_file)
-    z_pd               = pd.read_hdf(ref_histo_file, key=key_Z_histo)
-    z_histo            = ref_hist(bin_centres     = z_pd.bin_centres,
-                                  bin_entries     = z_pd.bin_entries,
-                                  err_bin_entries = z_pd.err_bin_entries)
+    z_histo            = read_reference_histogram(ref_histo_file, key_Z_histo)
     ref_histos         =  ref_hist_container(Z_dist_hist = z_histo)
 
-    return dst_filtered, bootstrap_map, ref_histos
+    return bootstrap_map, ref_histos
+
+def sample_dst_files(dst_files : List[str],
+                     fraction  : float    ) -> List[str]:
+    """
+    Picks a fraction of the kdst files (at least one), evenly spread
+    along the (sorted) list so that the sample covers the whole run.
+    """
+    nfiles  = len(dst_files)
+    nsample = min(nfiles, max(1, int(np.ceil(fraction * nfiles))))
+    index   = np.unique(np.linspace(0, nfiles - 1, nsample).round().astype(int))
+    return [dst_files[i] for i in index]
 
 def selection_nS_mask_and_checking(dst        : pd.DataFrame       ,
                                    column     : type_of_signal     ,
@@ -184,20 +281,31 @@ def selection_nS_mask_and_checking(dst        : pd.DataFrame       ,
                                 raising_message = message      )
     return mask
 
-def check_Z_dst(Z_vect   : np.array     ,
-                ref_hist : pd.DataFrame ,
-                n_sigmas : int      = 10)->None:
+def check_Z_dst(Z_vect     : np.array                      ,
+                ref_hist   : ref_hist                      ,
+                n_sigmas   : int                     = 10  ,
+                references : Dict[str, ref_hist]     = None,
+                output_f   : pd.HDFStore             = None)->None:
     """
     From a given Z distribution, this function checks, raising
-    an exception, if Z histogram is correct.
+    an exception, if Z histogram is correct. If references are
+    given, the same histogram is compared with each of them (see
+    compare_Z_references) and the deviations are saved in output_f
+    before the check.
     Parameters:
     ----------
     Z_vect : np.array
         Array of Z values for each kr event.
-    ref_hist: pd.DataFrame
-        Table that contains reference histogram info.
+    ref_hist: ref_hist
+        Reference histogram (bin centres, entries and their errors,
+        and bin_edges), e.g. from read_reference_histogram.
     n_sigmas: int
         Number of sigmas to consider if distributions are similar enough.
+    references: dict of ref_hist (optional)
+        Z references to compare with, by name (see read_Z_references).
+    output_f: pd.HDFStore (optional)
+        File where the deviations from the references are saved, in
+        the Z_reference_deviations table.
     Returns
     -------
         Continue if both Z distributions are compatible
@@ -205,11 +313,26 @@ def check_Z_dst(Z_vect   : np.array     ,
     """
     N_Z, z_Z   = compute_similar_histo(param     = Z_vect,
                                        reference = ref_hist)
-    N_Z, err_N = normalize_histo_and_poisson_error(N = N_Z,
-                                                   b = z_Z)
+    if references:
+        deviations = compare_Z_references(N_Z, z_Z, references)
+        print("    Maximum deviation (sigmas) of the Z distribution from each reference:")
+        print(deviations.round(2).to_string())
+        if output_f is not None:
+            table = pd.DataFrame({'reference' : deviations.index ,
+                                  'max_sigmas': deviations.values})
+            output_f.put("Z_reference_deviations", table, format='table', data_columns=True)
+    check_Z_histogram(N_Z, z_Z, ref_hist, n_sigmas)
+    return;
 
-    diff       = N_Z - ref_hist.bin_entries
-    diff_sig   = diff / np.sqrt(err_N**2+ref_hist.err_bin_entries**2)
+def check_Z_histogram(N_Z      : np.array     ,
+                      z_Z      : np.array     ,
+                      ref_hist : ref_hist     ,
+                      n_sigmas : int      = 10)->None:
+    """
+    Same as check_Z_dst, for an already computed Z histogram
+    (entries N_Z and limits z_Z, with the binning of ref_hist).
+    """
+    diff_sig   = compatibility_sigmas(N_Z, z_Z, [ref_hist])[0]
 
     message    = "Z distribution very different to reference one. "
     message   += "At least 1 point out of {0} sigmas region. ".format(n_sigmas)
@@ -219,6 +342,76 @@ def check_Z_dst(Z_vect   : np.array     ,
                                 raising_message = message  )
     return;
 
+def compare_Z_references(N_Z        : np.array           ,
+                         z_Z        : np.array           ,
+                         references : Dict[str, ref_hist]) -> pd.Series:
+    """
+    Maximum deviation, in sigmas, of an already computed Z histogram
+    (entries N_Z and limits z_Z) from each of the references, which
+    must share its binning.
+    """
+    for name, reference in references.items():
+        edges = histo_bin_edges(reference)
+        if len(edges) != len(z_Z) or not np.allclose(edges, z_Z):
+            raise ValueError(f"Z reference {name} does not have the binning of the run reference")
+    sigmas = compatibility_sigmas(N_Z, z_Z, list(references.values()))
+    return pd.Series(np.max(np.abs(sigmas), axis=1), index=list(references))
+
+def read_Z_references(config, ref_histos : ref_hist_container) -> Optional[Dict[str, ref_hist]]:
+    """
+    Z references compared with the Z distribution of the run: the
+    reference of the run (named reference) and each reference in
+    config.ref_Z_comparison (name: (ref_histo_file, key_Z_histo)).
+    None if there is nothing to compare with.
+    """
+    comparison = getattr(config, "ref_Z_comparison", None)
+    if not comparison:
+        return None
+    references = dict(reference = ref_histos.Z_dist_hist)
+    references.update({name: read_reference_histogram(*spec)
+                       for name, spec in comparison.items()})
+    return references
+
+def rate_histogram(times    : np.array,
+                   bin_size : int = 180)->Tuple[np.array, np.array]:
+    """
+    Computes the histogram of the event times with bins of
+    (approximately) bin_size seconds.
+    Parameters
+    ----------
+    times: np.array
+        Time of the events.
+    bin_size: int
+        Size (in seconds) for histogram bins.
+    Returns
+    ----------
+        Two arrays with the entries and the limits of each bin.
+    """
+    min_time  = np.min(times)
+    max_time  = np.max(times)
+    ntimebins = get_number_of_time_bins(bin_size,
+                                        min_time,
+                                        max_time)
+    return np.histogram(times, bins=ntimebins, range=(min_time, max_time))
+
+def check_rate_flatness(n     : np.array,
+                        n_dev : float = 5)->None:
+    """
+    Raises exception if the relative standard deviation of
+    the rate histogram n is above n_dev (in %).
+    """
+    mean     = np.mean(n)
+    dev      = np.std(n, ddof = 1)
+    rel_dev  = dev / mean * 100
+
+    message  = "Relative deviation ({0}) greater ".format(rel_dev)
+    message += "than the allowed one ({0}).".format(n_dev)
+    check_if_values_in_interval(values          = np.array(rel_dev),
+                                low_lim         = 0                ,
+                                up_lim          = n_dev            ,
+                                raising_message = message          )
+    return;
+
 def check_rate_and_hist(times      : np.array           ,
                         output_f   : pd.HDFStore        ,
                         name_table : str                ,
@@ -249,33 +442,45 @@ def check_rate_and_hist(times      : np.array           ,
         Nothing.
 
     """
-    min_time   = times.min()
-    max_time   = times.max()
-
-    ntimebins  = get_number_of_time_bins(bin_size,
-                                         min_time,
-                                         max_time)
-
-    compute_and_save_hist_as_pd(values    = times      ,
-                                out_file  = output_f   ,
-                                hist_name = name_table ,
-                                n_bins    = ntimebins  ,
-                                range_hist= (min_time  ,
-                                             max_time) ,
-                                norm      = normed     )
-
-    n, _     = np.histogram(times, bins=ntimebins,
-                            range = (min_time, max_time))
-    mean     = np.mean(n)
-    dev      = np.std(n, ddof = 1)
-    rel_dev  = dev / mean * 100
+    n, b = rate_histogram(times, bin_size)
+    save_hist_as_pd(n, b, output_f, name_table, normed)
+    check_rate_flatness(n, n_dev)
+    return;
 
-    message  = "Relative deviation ({0}) greater ".format(rel_dev)
-    message += "than the allowed one ({0}).".format(n_dev)
-    check_if_values_in_interval(values          = np.array(rel_dev),
-                                low_lim         = 0                ,
-                                up_lim          = n_dev            ,
-                                raising_message = message          )
+def check_accumulated_rate_and_hist(rate_acc   : histo_accumulator,
+                                    output_f   : pd.HDFStore      ,
+                                    name_table : str              ,
+                                    n_dev      : float     = 5    ,
+                                    bin_size   : int       = 180  ,
+                                    normed     : bool      = False)->None:
+    """
+    Same as check_rate_and_hist, but for event times that have been
+    accumulated chunk by chunk in a streaming histogram (for instance,
+    while the kdst files are being read). The time bins match those of
+    check_rate_and_hist up to the width of the accumulator fine bins.
+    Parameters
+    ----------
+    rate_acc: histo_accumulator
+        Streaming histogram of the event times.
+    output_f: pd.HDFStore
+        File where histogram will be saved.
+    name_table: string
+        Name for the histogram table inside file.
+    n_dev: float
+        Relative standard deviation to judge if
+        distribution is correct.
+    bin_size: int
+        Size (in seconds) for histogram bins.
+    normed: bool (optional)
+        If True, histogram will be normalized.
+    """
+    ntimebins = get_number_of_time_bins(bin_size,
+                                        rate_acc.vmin,
+                                        rate_acc.vmax)
+    n, b      = histogram_from_accumulator(rate_acc, ntimebins,
+                                           (rate_acc.vmin, rate_acc.vmax))
+    save_hist_as_pd(n, b, output_f, name_table, normed)
+    check_rate_flatness(n, n_dev)
     return;
 
 def band_selector_and_check(dst        : pd.DataFrame             ,
@@ -287,7 +492,9 @@ def band_selector_and_check(dst        : pd.DataFrame             ,
                             nsigma_sel : float                    ,
                             eff_min    : float                    ,
                             eff_max    : float                    ,
-                            input_mask : np.array     = None
+                            input_mask : np.array     = None      ,
+                            method     : str          = 'gauss'   ,
+                            validate   : bool         = False
                            )->np.array:
     """
     This function returns a selection of the events that
@@ -320,6 +527,12 @@ def band_selector_and_check(dst        : pd.DataFrame             ,
     eff_max: float
         Upper limit of the range where selection efficiency
         is considered correct.
+    method: str
+        Band estimation (see BAND_METHODS): gaussian fits of the Z
+        slices (gauss) or their quantiles (quantile).
+    validate: bool
+        If True, the band is also computed with the other method
+        and the comparison is printed (see compare_band_selections).
     Returns
     ----------
         A  mask corresponding to the selection made.
@@ -328,18 +541,9 @@ def band_selector_and_check(dst        : pd.DataFrame             ,
         input_mask = [True] * len(dst)
     else: pass;
 
-    emaps = e0_xy_correction(boot_map, NormStrategy.max)
-    E0    = dst[input_mask].S2e.values * emaps(dst[input_mask].X.values,
-                                               dst[input_mask].Y.values)
-
-    sel_krband = np.zeros_like(input_mask)
-    sel_krband[input_mask], _, _, _, _ = selection_in_band(dst[input_mask].Z,
-                                                           E0,
-                                                           range_z = range_Z,
-                                                           range_e = range_E,
-                                                           nbins_z = nbins_z,
-                                                           nbins_e = nbins_e,
-                                                           nsigma  = nsigma_sel)
+    sel_krband = band_selection(dst, boot_map, range_Z, range_E,
+                                nbins_z, nbins_e, nsigma_sel, input_mask,
+                                method, validate)
 
     effsel   = dst[sel_krband].event.nunique()/dst[input_mask].event.nunique()
     message  = "Band selection efficiency {0} ".format(np.round(effsel, 3))
@@ -351,6 +555,41 @@ def band_selector_and_check(dst        : pd.DataFrame             ,
 
     return sel_krband
 
+def band_selection(dst        : pd.DataFrame             ,
+                   boot_map   : ASectorMap               ,
+                   range_Z    : Tuple[np.array, np.array],
+                   range_E    : Tuple[np.array, np.array],
+                   nbins_z    : int                      ,
+                   nbins_e    : int                      ,
+                   nsigma_sel : float                    ,
+                   input_mask : np.array                 ,
+                   method     : str  = 'gauss'           ,
+                   validate   : bool = False
+                  )->np.array:
+    """
+    Selection of the events inside the Kr E vs Z band, without
+    checking its efficiency (see band_selector_and_check).
+    """
+    emaps = e0_xy_correction(boot_map, NormStrategy.max)
+    E0    = dst[input_mask].S2e.values * emaps(dst[input_mask].X.values,
+                                               dst[input_mask].Y.values)
+
+    sel_krband = np.zeros_like(input_mask)
+    sel_krband[input_mask], _, _, _, _ = BAND_METHODS[method](dst[input_mask].Z,
+                                                              E0,
+                                                              range_z = range_Z,
+                                                              range_e = range_E,
+                                                              nbins_z = nbins_z,
+                                                              nbins_e = nbins_e,
+                                                              nsigma  = nsigma_sel)
+    if validate:
+        comparison = compare_band_selections(dst[input_mask].Z.values, E0,
+                                             range_Z, range_E, nbins_z, nbins_e, nsigma_sel)
+        print("    Band validation (gauss vs quantile):")
+        for name, value in comparison.items():
+            print("        {0:15s}: {1:.4f}".format(name, value))
+    return sel_krband
+
 def get_binning_auto(nevt_sel: int,
                      thr_events_for_map_bins: int = 1e6,
                      n_bins:                  int = None)->int:
@@ -388,6 +627,7 @@ def calculate_map(dst     : pd.DataFrame,
                   nmin    : int,
                   x_range : Tuple[float, float],
                   y_range : Tuple[float, float],
+                  fit_params : dict = None,
                   ):
     """
     Calculates and outputs correction map
@@ -401,6 +641,11 @@ def calculate_map(dst     : pd.DataFrame,
     nbins_z : int
         Number of bins for z
         The number of events to use can be chosen a priori.
+    fit_params : dict
+        Optional parameters of the fit type (see fit_lifetime_robust
+        for FitType.robust, fit_lifetime_ml for FitType.ml and
+        fit_map_xy_joint_df for FitType.joint). The joint fit attaches
+        the lifetime of each zone to the map (lt_zones).
     Returns
     ---------
     n_bins: int
@@ -408,26 +653,47 @@ def calculate_map(dst     : pd.DataFrame,
     """
     xbins = np.linspace(*x_range, XYbins[0]+1)
     ybins = np.linspace(*y_range, XYbins[1]+1)
-    KXY   = select_xy_sectors_df(dst, xbins, ybins)
-    nXY   = event_map_df(KXY)
-    fmxy  = fit_map_xy_df(selection_map = KXY,
-                          event_map     = nXY,
-                          n_time_bins   = 1,
-                          time_diffs    = dst.time.values,
-                          nbins_z       = nbins_z,
-                          nbins_e       = nbins_e,
-                          range_z       = z_range,
-                          range_e       = e_range,
-                          energy        = 'S2e',
-                          z             = 'Z',
-                          fit           = fit_type,
-                          n_min         = nmin)
+    lt_zones  = None
+    if fit_type == FitType.joint:
+        fmxy, lt_zones = fit_map_xy_joint_df(dst     = dst,
+                                             bins_x  = xbins,
+                                             bins_y  = ybins,
+                                             nbins_z = nbins_z,
+                                             range_z = z_range,
+                                             n_min   = nmin,
+                                             **(fit_params or {}))
+    elif fit_type in BATCHED_FITS or (fit_params or {}).get('prior_e0') is not None:
+        fmxy  = fit_map_xy_batched_df(dst     = dst,
+                                      bins_x  = xbins,
+                                      bins_y  = ybins,
+                                      nbins_z = nbins_z,
+                                      range_z = z_range,
+                                      fit     = fit_type,
+                                      n_min   = nmin,
+                                      **(fit_params or {}))
+    else:
+        KXY   = select_xy_sectors_df(dst, xbins, ybins)
+        nXY   = event_map_df(KXY)
+        fmxy  = fit_map_xy_df(selection_map = KXY,
+                              event_map     = nXY,
+                              n_time_bins   = 1,
+                              time_diffs    = dst.time.values,
+                              nbins_z       = nbins_z,
+                              nbins_e       = nbins_e,
+                              range_z       = z_range,
+                              range_e       = e_range,
+                              energy        = 'S2e',
+                              z             = 'Z',
+                              fit           = fit_type,
+                              n_min         = nmin)
     tsm   = tsmap_from_fmap(fmxy)
     am    = amap_from_tsmap(tsm,
                             ts         = 0,
                             range_e    = e_range,
                             range_chi2 = chi2_range,
                             range_lt   = lt_range)
+    if lt_zones is not None:
+        am.lt_zones = lt_zones
 
     return am
 
@@ -507,6 +773,9 @@ def add_krevol(maps          : ASectorMap,
                nbins_dv      : int,
                zrange_dv     : Tuple[float, float],
                detector      : str,
+               prior_evol    : pd.Series = None,
+               window        : float     = None,
+               stride        : float     = None,
                **norm_options):
     """
     Adds time evolution dataframe to the map
@@ -527,6 +796,13 @@ def add_krevol(maps          : ASectorMap,
         Range for x and y for the map
     XYbins: Tuple[int, int]
         Number of bins for XY map
+    prior_evol: pd.Series (optional)
+        Expected e0, lt and dv to seed the fits (see warm_start_prior)
+    window, stride: float (optional)
+        Width and step (in seconds) of sliding time windows. If given,
+        the parameters are computed from the statistics of base bins
+        of stride seconds (see windowed_time_evolution) instead of in
+        disjoint bins of nStimeprofile seconds.
 
     Returns
     ---------
@@ -537,39 +813,65 @@ def add_krevol(maps          : ASectorMap,
     dstf      = dst[fmask]
     min_time  = dstf.time.min()
     max_time  = dstf.time.max()
-    ntimebins = get_number_of_time_bins(nStimeprofile = nStimeprofile,
-                                        tstart        = min_time,
-                                        tfinal        = max_time)
-
-    ts, masks_time = get_time_series_df(time_bins  = ntimebins,
-                                        time_range = (min_time, max_time),
-                                        dst        = dst)
-
-    masks_timef    = [mask[fmask] for mask in masks_time]
-    pars           = kr_time_evolution(ts            = ts,
-                                       masks_time    = masks_timef,
-                                       dst           = dstf,
-                                       emaps         = maps,
-                                       bootstrap_map = bootstrap_map,
-                                       norm_strategy = norm_strategy,
-                                       zslices_lt    = zslices_lt,
-                                       zrange_lt     = zrange_lt,
-                                       nbins_dv      = nbins_dv,
-                                       zrange_dv     = zrange_dv,
-                                       detector      = detector,
-                                       **norm_options)
-
-    pars_ec        = cut_time_evolution(masks_time = masks_time,
-                                        dst        = dst,
-                                        masks_cuts = masks_cuts,
-                                        pars_table = pars)
-
-    e0par       = np.array([pars['e0'].mean(), pars['e0'].var()**0.5])
-    ltpar       = np.array([pars['lt'].mean(), pars['lt'].var()**0.5])
+    if window is not None:
+        stride  = stride or nStimeprofile
+        nbase   = get_number_of_time_bins(nStimeprofile = stride,
+                                          tstart        = min_time,
+                                          tfinal        = max_time)
+        t_edges = np.linspace(min_time, max_time, nbase + 1)
+        stats   = krevol_base_stats(dst           = dst,
+                                    masks_cuts    = masks_cuts,
+                                    fiducial      = np.asarray(fmask),
+                                    t_edges       = t_edges,
+                                    emaps         = maps,
+                                    bootstrap_map = bootstrap_map,
+                                    norm_strategy = norm_strategy,
+                                    zslices_lt    = zslices_lt,
+                                    zrange_lt     = zrange_lt,
+                                    nbins_dv      = nbins_dv,
+                                    zrange_dv     = zrange_dv,
+                                    **norm_options)
+        pars_ec = windowed_time_evolution(stats      = stats,
+                                          width      = max(1, int(round(window / stride))),
+                                          stride     = 1,
+                                          zrange_lt  = zrange_lt,
+                                          zrange_dv  = zrange_dv,
+                                          detector   = detector,
+                                          prior_evol = prior_evol)
+    else:
+        ntimebins = get_number_of_time_bins(nStimeprofile = nStimeprofile,
+                                            tstart        = min_time,
+                                            tfinal        = max_time)
+
+        ts, masks_time = get_time_series_df(time_bins  = ntimebins,
+                                            time_range = (min_time, max_time),
+                                            dst        = dst)
+
+        masks_timef    = [mask[fmask] for mask in masks_time]
+        pars           = kr_time_evolution(ts            = ts,
+                                           masks_time    = masks_timef,
+                                           dst           = dstf,
+                                           emaps         = maps,
+                                           bootstrap_map = bootstrap_map,
+                                           norm_strategy = norm_strategy,
+                                           zslices_lt    = zslices_lt,
+                                           zrange_lt     = zrange_lt,
+                                           nbins_dv      = nbins_dv,
+                                           zrange_dv     = zrange_dv,
+                                           detector      = detector,
+                                           prior_evol    = prior_evol,
+                                           **norm_options)
+
+        pars_ec        = cut_time_evolution(masks_time = masks_time,
+                                            dst        = dst,
+                                            masks_cuts = masks_cuts,
+                                            pars_table = pars)
+
+    e0par       = np.array([pars_ec['e0'].mean(), pars_ec['e0'].var()**0.5])
+    ltpar       = np.array([pars_ec['lt'].mean(), pars_ec['lt'].var()**0.5])
     print("    Mean core E0: {0:.1f}+-{1:.1f} pes".format(*e0par))
     print("    Mean core Lt: {0:.1f}+-{1:.1f} mus".format(*ltpar))
 
-
     maps.t_evol = pars_ec
 
     return
@@ -618,65 +920,386 @@ def compute_map(dst          : pd.DataFrame,
                 r_max        : float,
                 x_range      : Tuple[float, float],
                 y_range      : Tuple[float, float],
-                dv_maxFailed : float) -> ASectorMap:
-
-    maps = calculate_map (dst      = dst,
-                          XYbins   = XYbins,
-                          nbins_z  = nbins_z,
-                          nbins_e  = nbins_e,
-                          z_range  = z_range,
-                          e_range  = e_range,
-                          chi2_range = chi2_range,
-                          lt_range = lt_range,
-                          fit_type = fit_type,
-                          nmin     = nmin,
-                          x_range  = x_range,
-                          y_range  = y_range)
+                dv_maxFailed : float,
+                profiler     : stage_profiler = None,
+                fit_params   : dict           = None) -> ASectorMap:
+
+    with profile_stage(profiler, "fit", rows_in=len(dst)) as stage:
+        maps = calculate_map (dst      = dst,
+                              XYbins   = XYbins,
+                              nbins_z  = nbins_z,
+                              nbins_e  = nbins_e,
+                              z_range  = z_range,
+                              e_range  = e_range,
+                              chi2_range = chi2_range,
+                              lt_range = lt_range,
+                              fit_type = fit_type,
+                              nmin     = nmin,
+                              x_range  = x_range,
+                              y_range  = y_range,
+                              fit_params = fit_params)
+        stage.rows_out = maps.e0.size
 
     check_failed_fits(maps      = maps,
                       maxFailed = maxFailed,
                       nbins     = XYbins[0],
                       rmax      = r_max,
                       rfid      = r_max)
-    regularized_maps = regularize_map(maps    = maps,
-                                      x2range = chi2_range)
 
-    no_peripheral    = remove_peripheral(regularized_maps,
-                                         XYbins[0]       ,
-                                         r_max           ,
-                                         r_max)
+    with profile_stage(profiler, "regularize", rows_in=maps.e0.size) as stage:
+        regularized_maps = regularize_map(maps    = maps,
+                                          x2range = chi2_range)
+
+        no_peripheral    = remove_peripheral(regularized_maps,
+                                             XYbins[0]       ,
+                                             r_max           ,
+                                             r_max)
+
+        no_peripheral    = add_mapinfo(asm        = no_peripheral,
+                                       xr         = x_range,
+                                       yr         = y_range,
+                                       nx         = XYbins[0],
+                                       ny         = XYbins[1],
+                                       run_number = int(run_number))
+        if hasattr(maps, 'lt_zones'):
+            no_peripheral.lt_zones = maps.lt_zones
+        stage.rows_out = no_peripheral.e0.size
 
+    return no_peripheral
+
+
+def check_and_regularize_map(maps       : ASectorMap,
+                             run_number : int,
+                             XYbins     : Tuple[int, int],
+                             chi2_range : Tuple[float, float],
+                             maxFailed  : int,
+                             r_max      : float,
+                             x_range    : Tuple[float, float],
+                             y_range    : Tuple[float, float]) -> ASectorMap:
+    """
+    Checks the failed fits of a XY map and regularizes it
+    as compute_map does (outliers, peripheral bins and mapinfo).
+    """
+    check_failed_fits(maps      = maps,
+                      maxFailed = maxFailed,
+                      nbins     = XYbins[0],
+                      rmax      = r_max,
+                      rfid      = r_max)
+
+    regularized_maps = regularize_map   (maps, chi2_range)
+    no_peripheral    = remove_peripheral(regularized_maps, XYbins[0], r_max, r_max)
     no_peripheral    = add_mapinfo(asm        = no_peripheral,
                                    xr         = x_range,
                                    yr         = y_range,
                                    nx         = XYbins[0],
                                    ny         = XYbins[1],
                                    run_number = int(run_number))
-
     return no_peripheral
 
 
+def compute_quadtree_map(dst          : pd.DataFrame,
+                         run_number   : int,
+                         XYbins       : Tuple[int, int],
+                         max_depth    : int,
+                         k            : float,
+                         nbins_z      : int,
+                         z_range      : Tuple[float, float],
+                         chi2_range   : Tuple[float, float],
+                         nmin         : int,
+                         maxFailed    : int,
+                         r_max        : float,
+                         x_range      : Tuple[float, float],
+                         y_range      : Tuple[float, float],
+                         **map_params) -> ASectorMap:
+    """
+    Computes a map with density-adaptive (quadtree) XY binning, where
+    the leaves hold about nmin to k * nmin events, and resamples it in
+    the XYbins grid, which is checked and regularized as in
+    compute_map. The native tree is attached to the map as quadtree.
+
+    Parameters
+    ---------
+    dst: pd.DataFrame
+        Dst where to stract the map from
+    max_depth: int
+        Maximum number of splits of the XY range
+    k: float
+        Leaves hold up to k * nmin events
+    Rest of parameters: see compute_map (the ones not used are ignored)
+
+    Returns
+    ---------
+    Resampled map, with the tree in its quadtree attribute.
+    """
+    tree  = quadtree_map(dst       = dst,
+                         x_range   = x_range,
+                         y_range   = y_range,
+                         max_depth = max_depth,
+                         nmin      = nmin,
+                         k         = k,
+                         nbins_z   = nbins_z,
+                         range_z   = z_range)
+    maps  = amap_from_quadtree(tree, XYbins[0], x_range, y_range)
+    maps  = check_and_regularize_map(maps, run_number, XYbins, chi2_range,
+                                     maxFailed, r_max, x_range, y_range)
+    maps.quadtree = tree
+    return maps
+
+
+def compute_rphi_map(dst          : pd.DataFrame,
+                     run_number   : int,
+                     XYbins       : Tuple[int, int],
+                     nsectors     : int,
+                     nwedges      : int,
+                     nbins_z      : int,
+                     z_range      : Tuple[float, float],
+                     chi2_range   : Tuple[float, float],
+                     nmin         : int,
+                     maxFailed    : int,
+                     r_max        : float,
+                     x_range      : Tuple[float, float],
+                     y_range      : Tuple[float, float],
+                     **map_params) -> ASectorMap:
+    """
+    Computes a map in nsectors radial sectors (up to r_max) of nwedges
+    phi wedges each, and resamples it in the XYbins grid, which is
+    checked and regularized as in compute_map. The RPHI map is
+    attached to the map as rphi, with its definition in rphi.mapinfo.
+
+    Parameters
+    ---------
+    dst: pd.DataFrame
+        Dst where to stract the map from
+    nsectors: int
+        Number of radial sectors
+    nwedges: int
+        Number of phi wedges per radial sector
+    Rest of parameters: see compute_map (the ones not used are ignored)
+
+    Returns
+    ---------
+    Resampled map, with the RPHI map in its rphi attribute.
+    """
+    rpmd  = rphi_sectors_map(r_max, nsectors, nwedges)
+    fmrp  = fit_map_rphi_df(dst         = dst,
+                            rpmd        = rpmd,
+                            n_time_bins = 1,
+                            time_range  = (dst.time.min(), dst.time.max()),
+                            nbins_z     = nbins_z,
+                            range_z     = z_range,
+                            n_min       = nmin)
+    rphi  = amap_from_tsmap(tsmap_from_fmap(fmrp),
+                            ts         = 0,
+                            range_e    = None,
+                            range_chi2 = chi2_range,
+                            range_lt   = None)
+    maps  = amap_from_rphi_map(rphi, rpmd, XYbins[0], x_range, y_range)
+    maps  = check_and_regularize_map(maps, run_number, XYbins, chi2_range,
+                                     maxFailed, r_max, x_range, y_range)
+    rphi.mapinfo = pd.Series([r_max, nsectors, nwedges, int(run_number)],
+                             index=['rmax', 'nsectors', 'nwedges', 'run_number'])
+    maps.rphi    = rphi
+    return maps
+
+
+def compute_time_maps(dst         : pd.DataFrame,
+                      run_number  : int,
+                      XYbins      : Tuple[int, int],
+                      n_time_bins : int,
+                      nbins_z     : int,
+                      z_range     : Tuple[float, float],
+                      e_range     : Tuple[float, float],
+                      chi2_range  : Tuple[float, float],
+                      lt_range    : Tuple[float, float],
+                      nmin        : int,
+                      r_max       : float,
+                      x_range     : Tuple[float, float],
+                      y_range     : Tuple[float, float]) -> ASectorMapTS:
+    """
+    Computes a time series of XY maps (unbined lifetime fits) dividing
+    the run in n_time_bins time bins, all of them in one pass over the
+    dst. Each map is regularized as the one from compute_map.
+
+    Parameters
+    ---------
+    dst: pd.DataFrame
+        Dst where to stract the maps from
+    n_time_bins: int
+        Number of time bins
+    Rest of parameters: see compute_map
+
+    Returns
+    ---------
+    ASectorMapTS with the central times and a map per time bin.
+    """
+    xbins = np.linspace(*x_range, XYbins[0]+1)
+    ybins = np.linspace(*y_range, XYbins[1]+1)
+    fmxyt = fit_map_xyt_df(dst         = dst,
+                           bins_x      = xbins,
+                           bins_y      = ybins,
+                           n_time_bins = n_time_bins,
+                           time_range  = (dst.time.min(), dst.time.max()),
+                           nbins_z     = nbins_z,
+                           range_z     = z_range,
+                           n_min       = nmin)
+    tsm   = tsmap_from_fmap(fmxyt)
+
+    maps  = []
+    for its in range(n_time_bins):
+        am = amap_from_tsmap(tsm,
+                             ts         = its,
+                             range_e    = e_range,
+                             range_chi2 = chi2_range,
+                             range_lt   = lt_range)
+        am = regularize_map   (am, chi2_range)
+        am = remove_peripheral(am, XYbins[0], r_max, r_max)
+        am = add_mapinfo(asm        = am,
+                         xr         = x_range,
+                         yr         = y_range,
+                         nx         = XYbins[0],
+                         ny         = XYbins[1],
+                         run_number = int(run_number))
+        maps.append(am)
+
+    return ASectorMapTS(ts = fmxyt[0][0].ts, maps = maps)
+
+
+def compute_map_pyramid(dst        : pd.DataFrame,
+                        run_number : int,
+                        XYbins     : Sequence[int],
+                        nbins_z    : int,
+                        z_range    : Tuple[float, float],
+                        chi2_range : Tuple[float, float],
+                        nmin       : int,
+                        r_max      : float,
+                        x_range    : Tuple[float, float],
+                        y_range    : Tuple[float, float]) -> Dict[int, ASectorMap]:
+    """
+    Computes square XY maps (unbined lifetime fits) with several
+    binnings in one pass over the dst. The lifetime statistics are
+    accumulated in the finest grid and the coarser maps are obtained
+    summing blocks of cells, so every binning must divide the finest
+    one. Each map is regularized as the one from compute_map.
+
+    Parameters
+    ---------
+    dst: pd.DataFrame
+        Dst where to stract the maps from
+    XYbins: sequence of int
+        Number of bins in each direction of each map (e.g. 200, 100, 50)
+    Rest of parameters: see compute_map
+
+    Returns
+    ---------
+    Dict of number of bins to map.
+    """
+    finest      = max(XYbins)
+    xbins       = np.linspace(*x_range, finest + 1)
+    ybins       = np.linspace(*y_range, finest + 1)
+    nevt, stats = xy_lifetime_stats(dst, xbins, ybins, nbins_z, z_range)
+
+    maps = {}
+    for nbins in sorted(XYbins, reverse=True):
+        if finest % nbins:
+            raise ValueError(f'Map binning {nbins} does not divide the finest one ({finest})')
+        factor = finest // nbins
+        fits   = fit_lifetime_from_stats(coarsen_stats(stats, factor), z_range)
+        am     = amap_from_fit_arrays(fits, coarsen_stats(nevt, factor) > nmin)
+        am     = regularize_map   (am, chi2_range)
+        am     = remove_peripheral(am, nbins, r_max, r_max)
+        maps[nbins] = add_mapinfo(asm        = am,
+                                  xr         = x_range,
+                                  yr         = y_range,
+                                  nx         = nbins,
+                                  ny         = nbins,
+                                  run_number = int(run_number))
+    return maps
+
+
+def compute_bootstrap_spread(dst         : pd.DataFrame,
+                             amap        : ASectorMap,
+                             XYbins      : Tuple[int, int],
+                             nbins_z     : int,
+                             z_range     : Tuple[float, float],
+                             x_range     : Tuple[float, float],
+                             y_range     : Tuple[float, float],
+                             n_bootstrap : int,
+                             seed        : int = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Poisson-bootstrap uncertainties of the e0 and lt of a XY map:
+    the spread of the unbined lifetime fit of each cell over
+    n_bootstrap replicas of the dst (see bootstrap_lifetime_spread).
+
+    Returns
+    ---------
+    Tables e0u_boot and ltu_boot with the layout and units of amap.e0u
+    and amap.ltu (relative errors in %), NaN where amap has no value.
+    """
+    xbins    = np.linspace(*x_range, XYbins[0] + 1)
+    ybins    = np.linspace(*y_range, XYbins[1] + 1)
+    e0s, lts = xy_bootstrap_spread(dst, xbins, ybins, nbins_z, z_range, n_bootstrap, seed)
+    def table(values, reference):
+        return pd.DataFrame(100 * values.T / reference.values)
+
+    return table(e0s, amap.e0), table(lts, amap.lt)
+
+
+def diffusion_band_selection(dt         : np.array,
+                             zrms       : np.array,
+                             lower      : Callable,
+                             upper      : Callable,
+                             bins_dt    : np.array,
+                             bins_zrms  : np.array) -> Tuple[np.array, np.array]:
+    """
+    Selection of the events in the diffusion band,
+    lower(DT) <= Zrms**2 < upper(DT), on the raw column arrays: the band
+    expressions are evaluated once on the DT array and the DTrms2_vs_DT
+    control histogram of the selected events (uniform bins) is filled
+    in the same pass, without building any intermediate DataFrame.
+
+    Returns
+    -------
+        The mask of the selected rows and the entries of the control
+        histogram, shape (len(bins_dt) - 1, len(bins_zrms) - 1), as
+        np.histogram2d(dt[mask], zrms[mask], (bins_dt, bins_zrms)).
+    """
+    zrms2 = zrms * zrms
+    mask  = (zrms2 >= lower(dt)) & (zrms2 < upper(dt))
+
+    shape = len(bins_dt) - 1, len(bins_zrms) - 1
+    ix    = uniform_bin_index(dt  [mask], bins_dt  )
+    iy    = uniform_bin_index(zrms[mask], bins_zrms)
+    ok    = (ix >= 0) & (iy >= 0)
+    histo = np.bincount(ix[ok] * shape[1] + iy[ok], minlength=shape[0] * shape[1])
+    return mask, histo.reshape(shape).astype(float)
+
+
+def diffusion_histo_edges(diff_histo_params : dict) -> List[np.array]:
+    """Bin edges of the DTrms2_vs_DT control histogram."""
+    nbins = np.broadcast_to(diff_histo_params['n_bins'], 2)
+    return [np.linspace(*r, n + 1) for r, n in zip(diff_histo_params['range_hist'], nbins)]
+
+
 def select_physical_events(dst              : pd.DataFrame,
                            lower            : Callable,
                            upper            : Callable,
                            eff_interval     : Tuple[float, float],
                            output           : pd.HDFStore,
                            diff_histo_params: dict) -> (pd.DataFrame, np.ndarray):
-    n0   = dst.event.nunique()
-    mask = in_range(dst.Zrms**2, lower(dst.DT), upper(dst.DT))
-    dst  = dst[mask].copy()
-    n1   = dst.event.nunique()
+    events      = dst.event.values
+    edges       = diffusion_histo_edges(diff_histo_params)
+    mask, histo = diffusion_band_selection(dst.DT.values, dst.Zrms.values,
+                                           lower, upper, *edges)
+    n0   = len(pd.unique(events))
+    n1   = len(pd.unique(events[mask]))
     eff  = n1/n0
-    compute_and_save_hist2d_as_pd(values    = (dst.DT, dst.Zrms),
-                                  out_file  = output,
-                                  hist_name = "DTrms2_vs_DT",
-                                  **diff_histo_params)
+    save_hist2d_as_pd(histo, *edges, output, "DTrms2_vs_DT", diff_histo_params['norm'])
 
     message  = f"Selection efficiency of diffusion band ({eff}) out of range:"
     message += f"({eff_interval[0]} - {eff_interval[1]})"
     check_if_values_in_interval(np.array(eff), *eff_interval, message)
 
-    return dst, mask
+    return dst[mask], mask
 
 
 def recompute_npeaks(dst):
@@ -703,6 +1326,7 @@ def apply_cuts(dst              : pd.DataFrame       ,
                nsigmas_Zdst     : float              ,
                bootstrapmap     : ASectorMap         ,
                band_sel_params  : dict               ,
+               Z_references     : Dict[str, ref_hist] = None
                ) -> (pd.DataFrame, masks_container):
     n0    = dst.event.nunique()
     mask1 = selection_nS_mask_and_checking(dst = dst                  ,
@@ -720,9 +1344,11 @@ def apply_cuts(dst              : pd.DataFrame       ,
                                            **ns2_histo_params         )
     nS2   = dst[mask2].event.nunique()
     print("    1 S2 cut efficiency within the expectations ({0:2.2f}%)".format(nS2/nS1*100))
-    check_Z_dst(Z_vect   = dst[mask2].Z,
-                ref_hist = ref_Z_histo ,
-                n_sigmas = nsigmas_Zdst)
+    check_Z_dst(Z_vect     = dst[mask2].Z ,
+                ref_hist   = ref_Z_histo  ,
+                n_sigmas   = nsigmas_Zdst ,
+                references = Z_references ,
+                output_f   = store_hist_s2)
 
     mask3 = band_selector_and_check(dst        = dst         ,
                                     boot_map   = bootstrapmap,
@@ -737,7 +1363,156 @@ def apply_cuts(dst              : pd.DataFrame       ,
     return dst[mask3], masks
 
 
-def map_builder(config):
+@dataclass
+class preselection:
+    dst     : pd.DataFrame        # physical events, with recomputed nS1 and nS2
+    s1      : np.array            # nS1 == 1 mask
+    s2      : np.array            # nS1 == 1 and nS2 == 1 mask
+    tallies : Dict[str, int]      # number of events before any selection and after each step
+    histos  : Dict[str, np.array] # entries of the control histograms
+
+
+def preselect_events(config, dst : pd.DataFrame) -> preselection:
+    """
+    Applies the selections of map_builder that do not need the whole
+    run (diffusion band, nS1 == 1 and nS2 == 1) without checking their
+    efficiencies, so it can be applied to a part of the run. The
+    tallies (events, physical, s1 and s2) and the control histograms
+    (DTrms2_vs_DT, nS1 and nS2) add up across parts of the run.
+    """
+    tallies = dict(events = dst.event.nunique())
+    histos  = {}
+    if config.select_diffusion_band:
+        mask, histos['DTrms2_vs_DT'] = diffusion_band_selection(dst.DT.values, dst.Zrms.values,
+                                                                config.diff_band_lower,
+                                                                config.diff_band_upper,
+                                                                *diffusion_histo_edges(config.diff_histo_params))
+        dst  = dst[mask]
+
+    dst = recompute_npeaks(dst)
+    tallies['physical'] = dst.event.nunique()
+    for signal in type_of_signal:
+        params = getattr(config, signal.value.lower() + '_histo_params')
+        values = dst[['event', signal.value]].drop_duplicates()[signal.value]
+        histos[signal.value], _ = np.histogram(values, params['nbins_hist'], params['range_hist'])
+
+    mask_s1 = (dst.nS1 == 1).values
+    mask_s2 = mask_s1 & (dst.nS2 == 1).values
+    tallies['s1'] = dst[mask_s1].event.nunique()
+    tallies['s2'] = dst[mask_s2].event.nunique()
+    return preselection(dst     = dst,
+                        s1      = mask_s1,
+                        s2      = mask_s2,
+                        tallies = tallies,
+                        histos  = histos)
+
+
+def check_efficiency(tallies  : Dict[str, int],
+                     step     : str,
+                     previous : str,
+                     interval : Tuple[float, float]) -> None:
+    """Checks the selection efficiency of step from the tallies of events."""
+    eff      = tallies[step] / tallies[previous]
+    message  = "Selection efficiency of {0} ({1}) out of range ".format(step, np.round(eff, 3))
+    message += "({0} - {1}).".format(*interval)
+    check_if_values_in_interval(np.array(eff), *interval, message)
+    print("    {0} selection efficiency within the expectations ({1:2.2f}%)".format(step, eff * 100))
+
+
+def check_preselection(config                         ,
+                       tallies    : Dict[str, int]     ,
+                       histos     : Dict[str, np.array],
+                       store_hist : pd.HDFStore        ) -> None:
+    """
+    Saves the control histograms of preselect_events (added up over
+    the whole run) and checks the efficiencies of its selections.
+    """
+    if config.select_diffusion_band:
+        params = config.diff_histo_params
+        edges  = diffusion_histo_edges(params)
+        save_hist2d_as_pd(histos['DTrms2_vs_DT'], *edges, store_hist,
+                          "DTrms2_vs_DT", params['norm'])
+        check_efficiency(tallies, 'physical', 'events',
+                         (config.diff_band_eff_min, config.diff_band_eff_max))
+
+    for signal, step, previous in ((type_of_signal.nS1, 's1', 'physical'),
+                                   (type_of_signal.nS2, 's2', 's1'      )):
+        params = getattr(config, signal.value.lower() + '_histo_params')
+        edges  = np.linspace(*params['range_hist'], params['nbins_hist'] + 1)
+        save_hist_as_pd(histos[signal.value], edges, store_hist,
+                        signal.value, params['norm'])
+        check_efficiency(tallies, step, previous,
+                         (getattr(config, signal.value + '_eff_min'),
+                          getattr(config, signal.value + '_eff_max')))
+
+
+def early_validation(config                          ,
+                     dst_files    : List[str]         ,
+                     bootstrapmap : ASectorMap        ,
+                     ref_histos   : ref_hist_container) -> None:
+    """
+    Runs the selection checks (diffusion band, nS1 and nS2 efficiencies,
+    Z distribution and band efficiency) on a sample of the input files,
+    raising AbortingMapCreation before the whole run is loaded if any
+    of them fails. The rate check is not run, as it needs the full time
+    span of the run. The control histograms are kept in memory and
+    discarded.
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration. config.early_check_fraction sets
+        the fraction of files in the sample.
+    dst_files: list of str
+        Input kdst files.
+    bootstrapmap: ASectorMap
+        Bootstrap map.
+    ref_histos: ref_hist_container
+        Reference histograms.
+    """
+    sample = sample_dst_files(dst_files, config.early_check_fraction)
+    print("    Early validation on {0} of {1} files".format(len(sample), len(dst_files)))
+
+    dst = load_dst_files(sample, config.quality_ranges)
+    with pd.HDFStore("early_validation.h5", "w", driver="H5FD_CORE",
+                     driver_core_backing_store=0) as store_hist:
+        try:
+            if config.select_diffusion_band:
+                dst, _ = select_physical_events(dst,
+                                                config.diff_band_lower    ,
+                                                config.diff_band_upper    ,
+                                                (config.diff_band_eff_min,
+                                                 config.diff_band_eff_max),
+                                                store_hist                ,
+                                                config.diff_histo_params  )
+            dst = recompute_npeaks(dst)
+            apply_cuts(dst              = dst                      ,
+                       S1_signal        = type_of_signal.nS1       ,
+                       nS1_eff_interval = (config.nS1_eff_min      ,
+                                           config.nS1_eff_max)     ,
+                       store_hist_s1    = store_hist               ,
+                       ns1_histo_params = config.ns1_histo_params  ,
+                       S2_signal        = type_of_signal.nS2       ,
+                       nS2_eff_interval = (config.nS2_eff_min      ,
+                                           config.nS2_eff_max)     ,
+                       store_hist_s2    = store_hist               ,
+                       ns2_histo_params = config.ns2_histo_params  ,
+                       nsigmas_Zdst     = config.nsigmas_Zdst      ,
+                       ref_Z_histo      = ref_histos.Z_dist_hist   ,
+                       bootstrapmap     = bootstrapmap             ,
+                       band_sel_params  = config.band_sel_params   )
+        except AbortingMapCreation as error:
+            raise AbortingMapCreation("Early validation failed: " + str(error)) from error
+    print("    Early validation passed")
+
+
+def map_builder(config, references : Tuple[ASectorMap, ref_hist_container] = None):
+    """
+    Computes the map and the control histograms of a run. The bootstrap
+    map and reference histograms (as returned by load_references) can
+    be given as references when they are shared by several runs;
+    otherwise they are read from the files in config.
+    """
 
     print("Map builder starting...")
     print("Reading input files:")
@@ -745,92 +1520,367 @@ def map_builder(config):
     print("    Input boostrap map : {}".format(config.file_bootstrap_map))
     print("    Input histogram map: {}".format(config.ref_Z_histogram['ref_histo_file']))
 
+    profiler = stage_profiler() if getattr(config, "profile_stages", False) else None
+    try:
+        run_map_builder_stages(config, profiler, references)
+    finally:
+        if profiler is not None:
+            report_file = profile_report_filename(config.file_out_hists)
+            write_profile_report(profiler, report_file)
+            print("Profile report saved in                : {0}".format(report_file))
+
+
+def run_selection_stages(config                          ,
+                         dst          : pd.DataFrame      ,
+                         bootstrapmap : ASectorMap        ,
+                         ref_histos   : ref_hist_container,
+                         profiler     : stage_profiler = None
+                         ) -> Tuple[np.array, pd.DataFrame, masks_container]:
+    """
+    Runs the rate checks and the selections (diffusion band, nS1, nS2
+    and Z band) of map_builder, writing the control histograms in
+    config.file_out_hists.
 
-    dst, bootstrapmap, ref_histos  = load_data(input_path         = config.folder            ,
-                                               input_dsts         = config.file_in           ,
-                                               file_bootstrap_map = config.file_bootstrap_map,
-                                               quality_ranges     = config.quality_ranges    ,
-                                               **config.ref_Z_histogram                      )
-
+    Returns
+    ---------
+    The mask of the physical events (diffusion band) in dst, the
+    physical events and the masks of the cuts applied to them.
+    """
     with pd.HDFStore(config.file_out_hists, "w", complib=str("zlib"), complevel=4) as store_hist:
         print("Checking the dst and appling 1S1, 1S2 and z-band selections:")
 
         nev_before = dst.event.nunique()
         print("    Number of events before any selection: {0}".format(nev_before))
-        check_rate_and_hist(times      = dst.time         ,
-                            output_f   = store_hist       ,
-                            name_table = "rate_before_sel",
-                            n_dev      = config.n_dev_rate,
-                            **config.rate_histo_params    )
-
-        if config.select_diffusion_band:
-            dst_phys, mask = select_physical_events(dst,
-                                                    config.diff_band_lower    ,
-                                                    config.diff_band_upper    ,
-                                                    (config.diff_band_eff_min,
-                                                     config.diff_band_eff_max),
-                                                    store_hist                ,
-                                                    config.diff_histo_params  )
-        else:
-            dst_phys = dst
-
-        dst_phys = recompute_npeaks(dst_phys)
-
-        nev_phys = dst_phys.event.nunique()
-        ratio    = nev_phys / nev_before * 100
-        print("    Number of physical events before cuts: {0} ({1:2.2f}%)".format(nev_phys, ratio))
-
-        dst_passed_cut, masks = apply_cuts(dst       = dst_phys               ,
-                                    S1_signal        = type_of_signal.nS1     ,
-                                    nS1_eff_interval = (config.nS1_eff_min    ,
-                                                        config.nS1_eff_max)   ,
-                                    store_hist_s1    = store_hist             ,
-                                    ns1_histo_params = config.ns1_histo_params,
-                                    S2_signal        = type_of_signal.nS2     ,
-                                    nS2_eff_interval = (config.nS2_eff_min    ,
-                                                        config.nS2_eff_max)   ,
-                                    store_hist_s2    = store_hist             ,
-                                    ns2_histo_params = config.ns2_histo_params,
-                                    nsigmas_Zdst     = config.nsigmas_Zdst    ,
-                                    ref_Z_histo      = ref_histos.Z_dist_hist ,
-                                    bootstrapmap     = bootstrapmap           ,
-                                    band_sel_params  = config.band_sel_params
-                                    )
-
-        check_rate_and_hist(times      = dst_passed_cut.time,
-                            output_f   = store_hist         ,
-                            name_table = "rate_after_sel"   ,
-                            n_dev      = config.n_dev_rate  ,
-                            **config.rate_histo_params      )
+        with profile_stage(profiler, "rate check", rows_in=len(dst)):
+            check_rate_and_hist(times      = dst.time         ,
+                                output_f   = store_hist       ,
+                                name_table = "rate_before_sel",
+                                n_dev      = config.n_dev_rate,
+                                **config.rate_histo_params    )
+
+        with profile_stage(profiler, "diffusion band", rows_in=len(dst)) as stage:
+            if config.select_diffusion_band:
+                dst_phys, mask = select_physical_events(dst,
+                                                        config.diff_band_lower    ,
+                                                        config.diff_band_upper    ,
+                                                        (config.diff_band_eff_min,
+                                                         config.diff_band_eff_max),
+                                                        store_hist                ,
+                                                        config.diff_histo_params  )
+            else:
+                dst_phys, mask = dst, np.ones(len(dst), dtype=bool)
+            stage.rows_out = len(dst_phys)
+
+        with profile_stage(profiler, "cuts", rows_in=len(dst_phys)) as stage:
+            dst_phys = recompute_npeaks(dst_phys)
+
+            nev_phys = dst_phys.event.nunique()
+            ratio    = nev_phys / nev_before * 100
+            print("    Number of physical events before cuts: {0} ({1:2.2f}%)".format(nev_phys, ratio))
+
+            dst_passed_cut, masks = apply_cuts(dst       = dst_phys               ,
+                                        S1_signal        = type_of_signal.nS1     ,
+                                        nS1_eff_interval = (config.nS1_eff_min    ,
+                                                            config.nS1_eff_max)   ,
+                                        store_hist_s1    = store_hist             ,
+                                        ns1_histo_params = config.ns1_histo_params,
+                                        S2_signal        = type_of_signal.nS2     ,
+                                        nS2_eff_interval = (config.nS2_eff_min    ,
+                                                            config.nS2_eff_max)   ,
+                                        store_hist_s2    = store_hist             ,
+                                        ns2_histo_params = config.ns2_histo_params,
+                                        nsigmas_Zdst     = config.nsigmas_Zdst    ,
+                                        ref_Z_histo      = ref_histos.Z_dist_hist ,
+                                        bootstrapmap     = bootstrapmap           ,
+                                        band_sel_params  = config.band_sel_params ,
+                                        Z_references     = read_Z_references(config, ref_histos)
+                                        )
+            stage.rows_out = len(dst_passed_cut)
+
+        with profile_stage(profiler, "rate check", rows_in=len(dst_passed_cut)):
+            check_rate_and_hist(times      = dst_passed_cut.time,
+                                output_f   = store_hist         ,
+                                name_table = "rate_after_sel"   ,
+                                n_dev      = config.n_dev_rate  ,
+                                **config.rate_histo_params      )
 
         nev_after = dst_passed_cut.event.nunique()
         ratio     = nev_after/nev_phys*100
         print("    Number of events passing the cuts: {0} ({1:2.2f}%)".format(nev_after, ratio))
 
+    return np.asarray(mask), dst_phys, masks
+
+
+@dataclass
+class warm_start_prior:
+    e0        : pd.DataFrame        # e0 of the prior XY map
+    lt        : pd.DataFrame        # lt of the prior XY map
+    evol      : Optional[pd.Series] # median e0, lt and dv of the prior time evolution
+    tolerance : float               # maximum distance to accept the prior of a cell
 
+
+def read_warm_start_prior(config) -> Optional[warm_start_prior]:
+    """
+    Reads the prior of the warm start from the map file of a previous
+    run, given by warm_start_params = dict(prior_map = filename,
+    tolerance = ...). None if the option is not set.
+    """
+    warm_start_params = getattr(config, "warm_start_params", None)
+    if not warm_start_params:
+        return None
+    filename = os.path.expandvars(warm_start_params['prior_map'])
+    try:
+        evol = pd.read_hdf(filename, 'time_evolution')[['e0', 'lt', 'dv']].median()
+    except KeyError:
+        evol = None
+    return warm_start_prior(e0        = pd.read_hdf(filename, 'e0'),
+                            lt        = pd.read_hdf(filename, 'lt'),
+                            evol      = evol,
+                            tolerance = warm_start_params.get('tolerance', 6.))
+
+
+FIT_TYPE_PARAMETERS = dict(robust_fit_params = FitType.robust,
+                           ml_fit_params     = FitType.ml    ,
+                           joint_fit_params  = FitType.joint )
+
+
+def map_fit_type(config) -> Tuple[FitType, dict]:
+    """
+    Fit type of the XY map and its parameters, given by the option of
+    FIT_TYPE_PARAMETERS that is set (FitType.unbined if none of them).
+    """
+    options = [name for name in FIT_TYPE_PARAMETERS if getattr(config, name, None) is not None]
+    if len(options) > 1:
+        raise ValueError(f"Lifetime fit options {options} are exclusive")
+    if options:
+        return FIT_TYPE_PARAMETERS[options[0]], getattr(config, options[0])
+    return FitType.unbined, None
+
+
+def compute_map_products(config                  ,
+                         dst      : pd.DataFrame,
+                         nevt_sel : int         ,
+                         profiler : stage_profiler = None) -> ASectorMap:
+    """
+    Computes the map of the selected events with the configured mode
+    (XY, quadtree or RPHI) and binning, and the optional bootstrap
+    uncertainties (XY maps only), time maps and map pyramid attached
+    to it.
+    """
     print("Map computation:")
-    number_of_bins = get_binning_auto(nevt_sel                = dst_passed_cut.event.nunique()  ,
-                                      thr_events_for_map_bins = config.thr_evts_for_sel_map_bins,
-                                      n_bins                  = config.default_n_bins           )
+    with profile_stage(profiler, "binning", rows_in=len(dst)):
+        number_of_bins = get_binning_auto(nevt_sel                = nevt_sel                        ,
+                                          thr_events_for_map_bins = config.thr_evts_for_sel_map_bins,
+                                          n_bins                  = config.default_n_bins           )
 
     print("    Number of bins: {0}x{0}".format(number_of_bins))
 
-    final_map      = compute_map(dst        = dst_passed_cut   ,
-                                 run_number = config.run_number,
-                                 XYbins     = (number_of_bins  ,
-                                               number_of_bins) ,
-                                 fit_type   = FitType.unbined  ,
-                                 **config.map_params           )
+    quadtree_params = getattr(config, "quadtree_params", None)
+    rphi_params     = getattr(config, "rphi_params"    , None)
+    if rphi_params:
+        with profile_stage(profiler, "rphi fit", rows_in=len(dst)) as stage:
+            final_map      = compute_rphi_map(dst        = dst              ,
+                                              run_number = config.run_number,
+                                              XYbins     = (number_of_bins  ,
+                                                            number_of_bins) ,
+                                              **rphi_params                 ,
+                                              **config.map_params           )
+            stage.rows_out = final_map.rphi.e0.size
+        print("    RPHI map: {nsectors} sectors x {nwedges} wedges".format(**rphi_params))
+        if getattr(config, "warm_start_params", None):
+            print("    Prior map not used: RPHI maps are not warm-started")
+    elif quadtree_params:
+        with profile_stage(profiler, "quadtree fit", rows_in=len(dst)) as stage:
+            final_map      = compute_quadtree_map(dst        = dst              ,
+                                                  run_number = config.run_number,
+                                                  XYbins     = (number_of_bins  ,
+                                                                number_of_bins) ,
+                                                  **quadtree_params             ,
+                                                  **config.map_params           )
+            stage.rows_out = len(final_map.quadtree)
+        print("    Number of quadtree leaves: {0}".format(len(final_map.quadtree)))
+        if getattr(config, "warm_start_params", None):
+            print("    Prior map not used: quadtree maps are not warm-started")
+    else:
+        fit_type, fit_params = map_fit_type(config)
+        prior                = read_warm_start_prior(config)
+        if prior is not None and fit_type not in WARM_FITS:
+            print("    Prior map not used: the {0} fit is not warm-started".format(fit_type.name))
+        elif prior is not None:
+            if prior.e0.shape == (number_of_bins, number_of_bins):
+                fit_params = dict(fit_params or {},
+                                  prior_e0  = prior.e0.values.T,
+                                  prior_lt  = prior.lt.values.T,
+                                  tolerance = prior.tolerance)
+                print("    Map fits warm-started from the prior map")
+            else:
+                print("    Prior map binning {0} differs, map fits not warm-started".format(prior.e0.shape))
+        final_map      = compute_map(dst        = dst              ,
+                                     run_number = config.run_number,
+                                     XYbins     = (number_of_bins  ,
+                                                   number_of_bins) ,
+                                     fit_type   = fit_type         ,
+                                     profiler   = profiler         ,
+                                     fit_params = fit_params       ,
+                                     **config.map_params           )
+        if fit_type != FitType.unbined:
+            options = {k: v for k, v in fit_params.items() if k not in ('prior_e0', 'prior_lt')}
+            print("    Lifetime fit: {0} {1}".format(fit_type.name, options))
+
+    bootstrap_params = getattr(config, "bootstrap_params", None)
+    if bootstrap_params and not (quadtree_params or rphi_params):
+        with profile_stage(profiler, "bootstrap", rows_in=len(dst)) as stage:
+            map_params = config.map_params
+            e0u_boot, ltu_boot = compute_bootstrap_spread(dst     = dst                  ,
+                                                          amap    = final_map            ,
+                                                          XYbins  = (number_of_bins      ,
+                                                                     number_of_bins)     ,
+                                                          nbins_z = map_params['nbins_z'],
+                                                          z_range = map_params['z_range'],
+                                                          x_range = map_params['x_range'],
+                                                          y_range = map_params['y_range'],
+                                                          **bootstrap_params             )
+            final_map.e0u_boot = e0u_boot
+            final_map.ltu_boot = ltu_boot
+            stage.rows_out = bootstrap_params['n_bootstrap']
+        print("    Bootstrap replicas: {0}".format(bootstrap_params['n_bootstrap']))
+
+    map_time_bins = getattr(config, "map_time_bins", None)
+    if map_time_bins:
+        with profile_stage(profiler, "time maps", rows_in=len(dst)) as stage:
+            map_params        = config.map_params
+            final_map.t_maps  = compute_time_maps(dst         = dst                     ,
+                                                  run_number  = config.run_number       ,
+                                                  XYbins      = (number_of_bins         ,
+                                                                 number_of_bins)        ,
+                                                  n_time_bins = map_time_bins           ,
+                                                  nbins_z     = map_params['nbins_z']   ,
+                                                  z_range     = map_params['z_range']   ,
+                                                  e_range     = map_params['e_range']   ,
+                                                  chi2_range  = map_params['chi2_range'],
+                                                  lt_range    = map_params['lt_range']  ,
+                                                  nmin        = map_params['nmin']      ,
+                                                  r_max       = map_params['r_max']     ,
+                                                  x_range     = map_params['x_range']   ,
+                                                  y_range     = map_params['y_range']   )
+            stage.rows_out = map_time_bins
+        print("    Number of time bins of the time maps: {0}".format(map_time_bins))
+        if getattr(config, "warm_start_params", None):
+            print("    Prior map not used for the time maps")
+
+    map_pyramid_bins = getattr(config, "map_pyramid_bins", None)
+    if map_pyramid_bins:
+        with profile_stage(profiler, "map pyramid", rows_in=len(dst)) as stage:
+            map_params          = config.map_params
+            final_map.pyramid   = compute_map_pyramid(dst        = dst                     ,
+                                                      run_number = config.run_number       ,
+                                                      XYbins     = map_pyramid_bins        ,
+                                                      nbins_z    = map_params['nbins_z']   ,
+                                                      z_range    = map_params['z_range']   ,
+                                                      chi2_range = map_params['chi2_range'],
+                                                      nmin       = map_params['nmin']      ,
+                                                      r_max      = map_params['r_max']     ,
+                                                      x_range    = map_params['x_range']   ,
+                                                      y_range    = map_params['y_range']   )
+            stage.rows_out = len(map_pyramid_bins)
+        print("    Map pyramid binnings: {0}".format(sorted(map_pyramid_bins, reverse=True)))
+
+    return final_map
+
+
+def checkpoint_inputs(config, dst_files : List[str]) -> Dict[str, List[str]]:
+    """
+    Input files read by each checkpointed stage: the kdsts by the load,
+    the bootstrap map and the reference histograms by the cuts and the
+    warm start prior map (if any) by the map.
+    """
+    warm_start_params = getattr(config, "warm_start_params", None)
+    return dict(load = dst_files,
+                cuts = [config.file_bootstrap_map, config.ref_Z_histogram['ref_histo_file']],
+                map  = [warm_start_params['prior_map']] if warm_start_params else [])
+
 
-    add_krevol(maps          = final_map,
-               dst           = dst_phys,
-               masks_cuts    = masks,
-               bootstrap_map = bootstrapmap,
-               **config.krevol_params)
+def run_map_builder_stages(config                                                    ,
+                           profiler   : stage_profiler                         = None,
+                           references : Tuple[ASectorMap, ref_hist_container] = None):
+    """
+    Runs the map production stages (load, checks, cuts, map fit,
+    time evolution and writing), measuring each of them with profiler.
+    If config.pipeline_params is set, the load and the selections
+    run as a pipeline (see pipelined_selection).
+    If config.checkpoint_dir is set, the products of the load, cuts,
+    map and krevol stages are saved there, and the stages with a
+    checkpoint from a previous run with the same configuration and
+    inputs for that stage and the previous ones are skipped.
+    """
+    with profile_stage(profiler, "load") as stage:
+        dst_files                = get_dst_files(config.folder, config.file_in)
+        bootstrapmap, ref_histos = references or load_references(config.file_bootstrap_map,
+                                                                 **config.ref_Z_histogram )
+        checkpoint_dir           = getattr(config, "checkpoint_dir", None)
+        checkpoints              = {stage: checkpoint_folder(checkpoint_dir, key) for stage, key in
+                                    checkpoint_keys(config, checkpoint_inputs(config, dst_files)).items()}
+
+        dst  = load_checkpoint(checkpoints["load"], "load")
+        cuts = load_checkpoint(checkpoints["cuts"], "cuts") if dst is not None else None
+        if cuts is not None:
+            restore_checkpoint_file(checkpoints["cuts"], "cuts", config.file_out_hists)
+
+        if dst is None:
+            if getattr(config, "early_check_fraction", None):
+                early_validation(config, dst_files, bootstrapmap, ref_histos)
+
+            pipeline_params = getattr(config, "pipeline_params", None)
+            if pipeline_params:
+                # imported here, pipeline_functions is built on this module.
+                # The pipeline loads and selects at once: the physical events
+                # play the role of the loaded dst
+                from . pipeline_functions import pipelined_selection
+                dst, masks = pipelined_selection(config, dst_files, bootstrapmap, ref_histos,
+                                                 **pipeline_params)
+                cuts       = np.ones(len(dst), dtype=bool), masks
+                save_checkpoint     (checkpoints["cuts"], "cuts", cuts)
+                save_checkpoint_file(checkpoints["cuts"], "cuts", config.file_out_hists)
+            else:
+                dst = load_dst_files(dst_files, config.quality_ranges)
+            save_checkpoint(checkpoints["load"], "load", dst)
+        stage.rows_out = len(dst)
+
+    if cuts is None:
+        phys_mask, dst_phys, masks = run_selection_stages(config, dst, bootstrapmap, ref_histos, profiler)
+        save_checkpoint     (checkpoints["cuts"], "cuts", (phys_mask, masks))
+        save_checkpoint_file(checkpoints["cuts"], "cuts", config.file_out_hists)
+    else:
+        phys_mask, masks = cuts
+        dst_phys = recompute_npeaks(dst[phys_mask])
+    dst_passed_cut = dst_phys[masks.band]
+
+    final_map = load_checkpoint(checkpoints["map"], "map")
+    if final_map is None:
+        final_map = compute_map_products(config, dst_passed_cut,
+                                         dst_passed_cut.event.nunique(), profiler)
+        save_checkpoint(checkpoints["map"], "map", final_map)
+
+    t_evol = load_checkpoint(checkpoints["krevol"], "krevol")
+    if t_evol is None:
+        prior = read_warm_start_prior(config)
+        with profile_stage(profiler, "krevol", rows_in=len(dst_phys)) as stage:
+            add_krevol(maps          = final_map,
+                       dst           = dst_phys,
+                       masks_cuts    = masks,
+                       bootstrap_map = bootstrapmap,
+                       prior_evol    = None if prior is None else prior.evol,
+                       **config.krevol_params,
+                       **(getattr(config, "krevol_windows", None) or {}))
+            stage.rows_out = len(final_map.t_evol)
+        save_checkpoint(checkpoints["krevol"], "krevol", final_map.t_evol)
+    else:
+        final_map.t_evol = t_evol
 
     check_drift_v_computation(final_map.t_evol.dv, config.map_params["dv_maxFailed"])
 
-    write_complete_maps(asm      = final_map          ,
-                        filename = config.file_out_map)
+    with profile_stage(profiler, "write"):
+        write_complete_maps(asm      = final_map          ,
+                            filename = config.file_out_map)
     print("Map successfully computed and saved in : {0}".format(config.file_out_map))
     print("Control histograms saved in            : {0}".format(config.file_out_hists))
@@ -5,6 +5,7 @@ import tables as tb
 import pandas as pd
 from pytest        import mark
 from pytest        import fixture
+from pytest        import raises
 from numpy.testing import assert_raises
 
 from invisible_cities.io  .dst_io          import load_dst
@@ -15,6 +16,14 @@ from invisible_cities.reco.corrections     import ASectorMap
 from invisible_cities.reco.corrections     import maps_coefficient_getter
 
 from . map_builder_functions import map_builder
+from . map_builder_functions import sample_dst_files
+from . map_builder_functions import diffusion_band_selection
+from . map_builder_functions import run_selection_stages
+from . map_builder_functions import load_references
+from . map_builder_functions import load_dst_files
+from . map_builder_functions import read_reference_histogram
+from . map_builder_functions import compare_Z_references
+from .. core.histo_functions import ref_hist
 from . checking_functions    import AbortingMapCreation
 
 from hypothesis            import settings
@@ -308,3 +317,106 @@ def test_exception_drift_v(folder_test_dst, test_dst_file, output_maps_tmdir):
     assert_raises(AbortingMapCreation,
                   map_builder        ,
                   conf.as_namespace  )
+
+def test_early_validation_aborts(folder_test_dst, test_dst_file, output_maps_tmdir):
+    """
+    This test checks that the checks run on a sample of the files
+    when early_check_fraction is set, before the output is written.
+    """
+    conf = configure('maps $ICARO/conf/next-white/config_LBphys.conf'.split())
+    map_file_out   = os.path.join(output_maps_tmdir, 'test_out_map_early.h5'  )
+    histo_file_out = os.path.join(output_maps_tmdir, 'test_out_histo_early.h5')
+    run_number     = 7517
+    conf.update(dict(folder               = folder_test_dst,
+                     file_in              = test_dst_file  ,
+                     file_out_map         = map_file_out   ,
+                     file_out_hists       = histo_file_out ,
+                     nS1_eff_min          = 0.             ,
+                     nS1_eff_max          = 0.8            ,
+                     early_check_fraction = 0.1            ,
+                     run_number           = run_number     ))
+
+    with raises(AbortingMapCreation, match="Early validation"):
+        map_builder(conf.as_namespace)
+    assert not os.path.exists(histo_file_out)
+
+
+@mark.parametrize("nfiles fraction nsample".split(),
+                  ((10, 0.1 ,  1),
+                   (10, 0.25,  3),
+                   (10, 1.  , 10),
+                   ( 3, 0.01,  1)))
+def test_sample_dst_files(nfiles, fraction, nsample):
+    files  = [f"file_{i}.h5" for i in range(nfiles)]
+    sample = sample_dst_files(files, fraction)
+    assert len(sample) == nsample
+    assert sample[0] == files[0]
+    if nsample > 1:
+        assert sample[-1] == files[-1]
+
+
+def test_diffusion_band_selection_same_as_pandas():
+    n     = 10000
+    dst   = pd.DataFrame(dict(DT = np.random.uniform(0, 1300, n), Zrms = np.random.uniform(0, 50, n)))
+    lower = lambda dt: -0.7 + 0.030 * (dt-20)
+    upper = lambda dt:  2.6 + 0.036 * (dt-20)
+    edges = np.linspace(0, 1300, 101), np.linspace(0, 50, 101)
+
+    mask, histo = diffusion_band_selection(dst.DT.values, dst.Zrms.values, lower, upper, *edges)
+    expected    = (dst.Zrms**2 >= lower(dst.DT)) & (dst.Zrms**2 < upper(dst.DT))
+    assert np.all(mask == expected.values)
+    assert np.all(histo == np.histogram2d(dst.DT[expected], dst.Zrms[expected], edges)[0])
+
+
+def test_run_selection_stages_saves_Z_reference_deviations(folder_test_dst, test_dst_file, output_maps_tmdir):
+    """
+    The Z distribution of the run is compared with the extra references
+    from the histogram used in the Z check, and the deviations are saved
+    with the control histograms.
+    """
+    conf = configure('maps $ICARO/conf/next-white/config_LBphys.conf'.split())
+    histo_file_out = os.path.join(output_maps_tmdir, 'test_out_histo_Zref.h5')
+    ref_Z_histogram = conf.as_namespace.ref_Z_histogram
+    conf.update(dict(folder           = folder_test_dst,
+                     file_in          = test_dst_file  ,
+                     file_out_hists   = histo_file_out ,
+                     run_number       = 7517           ,
+                     ref_Z_comparison = dict(same = (ref_Z_histogram['ref_histo_file'],
+                                                     ref_Z_histogram['key_Z_histo']))))
+    config = conf.as_namespace
+
+    bootstrapmap, ref_histos = load_references(config.file_bootstrap_map, **config.ref_Z_histogram)
+    dst = load_dst_files([os.path.join(folder_test_dst, test_dst_file)], config.quality_ranges)
+    run_selection_stages(config, dst, bootstrapmap, ref_histos)
+
+    deviations = pd.read_hdf(histo_file_out, "Z_reference_deviations")
+    assert deviations.reference.tolist() == ["reference", "same"]
+    assert deviations.max_sigmas[0] == deviations.max_sigmas[1]
+    assert deviations.max_sigmas[0] < config.nsigmas_Zdst
+
+
+def test_compare_Z_references_requires_the_same_binning():
+    centres    = np.arange(5) + 0.5
+    reference  = ref_hist(centres, np.full(5, 0.2), np.full(5, 0.01), np.arange(6.))
+    other      = ref_hist(centres * 2, np.full(5, 0.2), np.full(5, 0.01), np.arange(6.) * 2)
+    N, b       = np.array([10, 9, 11, 10, 10]), np.arange(6.)
+
+    deviations = compare_Z_references(N, b, dict(reference = reference))
+    assert deviations.index.tolist() == ["reference"]
+    with raises(ValueError, match="binning"):
+        compare_Z_references(N, b, dict(reference = reference, other = other))
+
+
+def test_read_reference_histogram_rereads_modified_file(tmp_path):
+    filename = str(tmp_path / "z_ref.h5")
+    def write_reference(entries, mtime):
+        table = pd.DataFrame(dict(bin_centres     = np.arange(4) + 0.5,
+                                  bin_entries     = np.full(4, entries),
+                                  err_bin_entries = np.full(4, 0.01)  ))
+        table.to_hdf(filename, key="histo_Z_dst", mode="w", format="table")
+        os.utime(filename, ns=(mtime, mtime))
+
+    write_reference(0.25, 10**18)
+    assert np.all(read_reference_histogram(filename, "histo_Z_dst").bin_entries == 0.25)
+    write_reference(0.50, 2 * 10**18)
+    assert np.all(read_reference_histogram(filename, "histo_Z_dst").bin_entries == 0.50)
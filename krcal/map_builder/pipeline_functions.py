@@ -0,0 +1,286 @@
+"""Module pipeline_functions.
+This module runs the load and selection of map_builder as a pipeline,
+so the reading of the kdst files overlaps with the selection of the
+files already read.
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    Stages, connected by bounded queues (a stage waits when the next
+    one is queue_size chunks behind, so memory stays bounded):
+        reader     : n_readers threads reading one kdst file (chunk) each
+                     and applying the quality cut. HDF5 is not thread
+                     safe, so the reads hold HDF5_LOCK one at a time: the
+                     readers overlap the reading of a file with the
+                     decoding and quality cut of others and with the
+                     selection, not two reads.
+        selection  : one thread applying the diffusion band, nS1 and nS2
+                     selections to each chunk (preselect_events).
+        accumulator: the calling thread, adding up the tallies and the
+                     control histograms and keeping the selected events.
+    The band selection and the checks need the whole run, so they are
+    applied at the end on the accumulated events and histograms, and
+    the map statistics and fits, which need the band selection, run
+    after the pipeline.
+
+    The stages share a stop event, set when the accumulator returns or
+    raises. The stages wait on the queues in POLL_INTERVAL steps and
+    return when it is set, so a failing stage does not leave the
+    others blocked on a full (or empty) queue.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import threading
+
+import numpy  as np
+import pandas as pd
+
+from queue       import Queue
+from queue       import Empty
+from queue       import Full
+from typing      import Callable
+from typing      import Dict
+from typing      import List
+from typing      import Tuple
+from dataclasses import dataclass
+from dataclasses import field
+
+from .. core.kr_types        import masks_container
+from .. core.histo_functions import histo_accumulator
+from .. core.histo_functions import new_histo_accumulator
+from .. core.histo_functions import fill_histo_accumulator
+
+from . map_builder_functions import sort_and_quality_cut
+from . map_builder_functions import preselection
+from . map_builder_functions import preselect_events
+from . map_builder_functions import check_preselection
+from . map_builder_functions import check_accumulated_rate_and_hist
+from . map_builder_functions import check_rate_and_hist
+from . map_builder_functions import check_Z_dst
+from . map_builder_functions import read_Z_references
+from . map_builder_functions import band_selector_and_check
+from . map_builder_functions import ref_hist_container
+
+from invisible_cities.io  .dst_io      import load_dsts
+from invisible_cities.reco.corrections import ASectorMap
+
+
+END_OF_STREAM  = None
+RATE_BIN_WIDTH = 1   # s, fine bins of the event time histogram
+POLL_INTERVAL  = 0.1 # s, between two looks at the stop event of a waiting stage
+HDF5_LOCK      = threading.Lock() # serializes the kdst reads (HDF5 is not thread safe)
+
+
+@dataclass
+class selection_accumulator:
+    rate    : histo_accumulator
+    tallies : Dict[str, int]          = field(default_factory=dict)
+    histos  : Dict[str, np.array]     = field(default_factory=dict)
+    chunks  : List[preselection]      = field(default_factory=list)
+
+
+def start_thread(target : Callable, *args) -> threading.Thread:
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def put_unless_stopped(queue : Queue          ,
+                       item  : object         ,
+                       stop  : threading.Event) -> bool:
+    """Puts item in queue, unless stop is set first. Returns whether it was put."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def get_unless_stopped(queue : Queue          ,
+                       stop  : threading.Event) -> object:
+    """Next item of queue, or END_OF_STREAM if stop is set first."""
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            pass
+    return END_OF_STREAM
+
+
+def read_stage(dst_files      : List[str]      ,
+               quality_ranges : dict           ,
+               n_readers      : int            ,
+               outputs        : Queue          ,
+               stop           : threading.Event) -> None:
+    """
+    Starts n_readers threads that read the kdst files (one chunk per
+    file) into outputs, followed by END_OF_STREAM. Errors are passed
+    downstream as exceptions in the queue. The threads return when
+    stop is set.
+    """
+    files = Queue()
+    for filename in dst_files:
+        files.put(filename)
+
+    lock    = threading.Lock()
+    running = [n_readers]
+    def read():
+        try:
+            while not stop.is_set():
+                try:
+                    filename = files.get_nowait()
+                except Empty:
+                    break
+                with HDF5_LOCK:
+                    dst = load_dsts([filename], "DST", "Events")
+                put_unless_stopped(outputs, sort_and_quality_cut(dst, quality_ranges), stop)
+        except Exception as error:
+            put_unless_stopped(outputs, error, stop)
+        finally:
+            with lock:
+                running[0] -= 1
+                if not running[0]:
+                    put_unless_stopped(outputs, END_OF_STREAM, stop)
+
+    for _ in range(n_readers):
+        start_thread(read)
+
+
+def map_stage(function : Callable       ,
+              inputs   : Queue          ,
+              outputs  : Queue          ,
+              stop     : threading.Event) -> None:
+    """
+    Applies function to each chunk of inputs and puts the result in
+    outputs, until END_OF_STREAM or an error, which are passed on, or
+    until stop is set.
+    """
+    while True:
+        chunk = get_unless_stopped(inputs, stop)
+        if chunk is END_OF_STREAM or isinstance(chunk, Exception):
+            put_unless_stopped(outputs, chunk, stop)
+            return
+        try:
+            result = function(chunk)
+        except Exception as error:
+            put_unless_stopped(outputs, error, stop)
+            return
+        if not put_unless_stopped(outputs, result, stop):
+            return
+
+
+def accumulate_chunk(acc   : selection_accumulator,
+                     chunk : Tuple[np.array, preselection]) -> None:
+    """Adds the times, tallies, histograms and events of a chunk."""
+    times, presel = chunk
+    fill_histo_accumulator(acc.rate, times)
+    for name, value in presel.tallies.items():
+        acc.tallies[name] = acc.tallies.get(name, 0) + value
+    for name, value in presel.histos.items():
+        acc.histos [name] = acc.histos .get(name, 0) + value
+    acc.chunks.append(presel)
+
+
+def pipelined_preselection(config                ,
+                           dst_files  : List[str],
+                           n_readers  : int = 4  ,
+                           queue_size : int = 8  ) -> selection_accumulator:
+    """
+    Reads dst_files and applies preselect_events to each of them in
+    a pipeline (see module notes).
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration.
+    dst_files: list of str
+        Input kdst files.
+    n_readers: int
+        Number of reader threads.
+    queue_size: int
+        Maximum number of chunks waiting between two stages.
+
+    Returns
+    -------
+        The accumulated times, tallies, histograms and selected chunks.
+    """
+    raw      = Queue(maxsize=queue_size)
+    selected = Queue(maxsize=queue_size)
+    stop     = threading.Event()
+    read_stage(dst_files, config.quality_ranges, n_readers, raw, stop)
+    start_thread(map_stage, lambda dst: (dst.time.values, preselect_events(config, dst)),
+                 raw, selected, stop)
+
+    acc = selection_accumulator(rate = new_histo_accumulator(RATE_BIN_WIDTH))
+    try:
+        while True:
+            chunk = selected.get()
+            if chunk is END_OF_STREAM:
+                return acc
+            if isinstance(chunk, Exception):
+                raise chunk
+            accumulate_chunk(acc, chunk)
+    finally:
+        stop.set()
+
+
+def pipelined_selection(config                          ,
+                        dst_files    : List[str]         ,
+                        bootstrapmap : ASectorMap        ,
+                        ref_histos   : ref_hist_container,
+                        n_readers    : int = 4           ,
+                        queue_size   : int = 8
+                        ) -> Tuple[pd.DataFrame, masks_container]:
+    """
+    Pipelined equivalent of loading the kdst files and running the
+    selection stages of map_builder: the files are read and
+    preselected in a pipeline, then the run checks, the Z band
+    selection and the control histograms are done as in map_builder.
+
+    Returns
+    -------
+        The physical events (sorted by time) and the masks of the cuts
+        applied to them, as the selection stages of map_builder.
+    """
+    acc     = pipelined_preselection(config, dst_files, n_readers, queue_size)
+    tallies = acc.tallies
+    if not acc.chunks:
+        raise ValueError("No kdst files to process")
+
+    dst     = pd.concat([chunk.dst for chunk in acc.chunks], ignore_index=True)
+    order   = np.argsort(dst.time.values, kind='stable')
+    dst     = dst.iloc[order]
+    mask_s1 = np.concatenate([chunk.s1 for chunk in acc.chunks])[order]
+    mask_s2 = np.concatenate([chunk.s2 for chunk in acc.chunks])[order]
+
+    with pd.HDFStore(config.file_out_hists, "w", complib=str("zlib"), complevel=4) as store_hist:
+        print("Checking the dst and appling 1S1, 1S2 and z-band selections:")
+        print("    Number of events before any selection: {0}".format(tallies['events']))
+        check_accumulated_rate_and_hist(acc.rate, store_hist, "rate_before_sel",
+                                        config.n_dev_rate, **config.rate_histo_params)
+        check_preselection(config, tallies, acc.histos, store_hist)
+        check_Z_dst(dst[mask_s2].Z, ref_histos.Z_dist_hist, config.nsigmas_Zdst,
+                    read_Z_references(config, ref_histos), store_hist)
+
+        mask_band = band_selector_and_check(dst        = dst         ,
+                                            boot_map   = bootstrapmap,
+                                            input_mask = mask_s2     ,
+                                            **config.band_sel_params )
+        check_rate_and_hist(times      = dst[mask_band].time,
+                            output_f   = store_hist         ,
+                            name_table = "rate_after_sel"   ,
+                            n_dev      = config.n_dev_rate  ,
+                            **config.rate_histo_params      )
+
+        nev_after = dst[mask_band].event.nunique()
+        ratio     = nev_after / tallies['physical'] * 100
+        print("    Number of events passing the cuts: {0} ({1:2.2f}%)".format(nev_after, ratio))
+
+    return dst, masks_container(s1   = mask_s1,
+                                s2   = mask_s2,
+                                band = mask_band)
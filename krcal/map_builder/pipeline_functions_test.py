@@ -0,0 +1,84 @@
+import time
+import threading
+
+import numpy  as np
+import pandas as pd
+
+from types  import SimpleNamespace
+from pytest import fixture
+from pytest import raises
+
+from .. core.testing_utils   import kr_dst_experiment
+from . map_builder_functions import preselect_events
+from . import pipeline_functions
+from . pipeline_functions    import pipelined_preselection
+
+
+@fixture(scope='module')
+def chunks():
+    dst = kr_dst_experiment(nevt = 5000, frac_multi_s2 = 0.1, seed = 3)
+    return {f'file_{i}.h5': chunk for i, (_, chunk) in
+            enumerate(dst.groupby(dst.event // 700))}
+
+
+@fixture
+def config():
+    return SimpleNamespace(quality_ranges        = dict(r_max = 500),
+                           select_diffusion_band = False,
+                           ns1_histo_params      = dict(nbins_hist = 10, range_hist = (0, 10)),
+                           ns2_histo_params      = dict(nbins_hist = 10, range_hist = (0, 10)))
+
+
+def test_pipelined_preselection_same_as_whole_run(chunks, config, monkeypatch):
+    monkeypatch.setattr(pipeline_functions, 'load_dsts',
+                        lambda files, group, node: chunks[files[0]])
+    acc    = pipelined_preselection(config, list(chunks), n_readers = 3, queue_size = 2)
+    presel = preselect_events(config, pd.concat(chunks.values()))
+
+    assert acc.tallies == presel.tallies
+    for name, histo in presel.histos.items():
+        assert np.all(acc.histos[name] == histo)
+    assert acc.rate.counts.sum() == sum(map(len, chunks.values()))
+    assert sum(np.count_nonzero(chunk.s2) for chunk in acc.chunks) == np.count_nonzero(presel.s2)
+
+
+def test_pipelined_preselection_raises_reader_errors(chunks, config, monkeypatch):
+    def load(files, group, node):
+        if files[0] == 'file_2.h5':
+            raise OSError('cannot read file_2.h5')
+        return chunks[files[0]]
+
+    monkeypatch.setattr(pipeline_functions, 'load_dsts', load)
+    with raises(OSError):
+        pipelined_preselection(config, list(chunks), n_readers = 2, queue_size = 1)
+
+
+def test_pipelined_preselection_stops_upstream_stages_on_error(chunks, config, monkeypatch):
+    def preselect(config, dst):
+        raise ValueError('selection failed')
+
+    monkeypatch.setattr(pipeline_functions, 'load_dsts',
+                        lambda files, group, node: chunks[files[0]])
+    monkeypatch.setattr(pipeline_functions, 'preselect_events', preselect)
+    before = set(threading.enumerate())
+    with raises(ValueError):
+        pipelined_preselection(config, list(chunks) * 10, n_readers = 3, queue_size = 1)
+
+    deadline = time.time() + 5
+    while set(threading.enumerate()) - before and time.time() < deadline:
+        time.sleep(0.05)
+    assert not set(threading.enumerate()) - before
+
+
+def test_pipelined_preselection_reads_one_file_at_a_time(chunks, config, monkeypatch):
+    reading = []
+    def load(files, group, node):
+        reading.append(files[0])
+        assert len(reading) == 1, 'concurrent HDF5 reads'
+        time.sleep(0.01)
+        reading.remove(files[0])
+        return chunks[files[0]]
+
+    monkeypatch.setattr(pipeline_functions, 'load_dsts', load)
+    acc = pipelined_preselection(config, list(chunks), n_readers = 4, queue_size = 2)
+    assert acc.tallies['events'] == pd.concat(chunks.values()).event.nunique()
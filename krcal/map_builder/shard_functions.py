@@ -0,0 +1,427 @@
+"""Module shard_functions.
+This module splits the map production in shards that can run in
+different processes or nodes (map step), each one producing a
+mergeable partial result, and builds the map from the merged
+partial results (reduce step).
+
+Notes
+-----
+    Public functions are documented using numpy style convention
+
+    A partial result holds everything the map production needs from
+    the events: selection tallies, control histogram entries, event
+    times, lifetime statistics of the selected events in each XY cell
+    of the map grid and per-time-bin counters, lifetime statistics, Z
+    histograms and S1/S2 parameter moments for the time evolution. All
+    of them add up across shards.
+
+    The Kr band of the whole run is needed to select the events of a
+    shard, so the map step runs in two passes: the band pass
+    accumulates the Z vs E histogram of each shard (see
+    shard_band_histogram), and the selection pass fits the band on the
+    sum of those histograms, so every shard applies the same band and
+    the map does not depend on the number of shards. A shard without
+    input files produces an empty partial result (see
+    empty_map_partial).
+
+    Differences with map_builder: the Kr band is fitted on the Z vs E
+    histogram of the run (see selection_in_band_histogram), the
+    selection efficiencies are checked once on the merged tallies,
+    and the time evolution has fixed-width time bins (nStimeprofile)
+    with the efficiencies, the S1/S2 averages, the drift velocity and
+    the lifetime of the fiducial events (energy corrected with the
+    bootstrap map), without energy resolution.
+
+Documentation
+-------------
+    Insert documentation https
+"""
+import numpy  as np
+import pandas as pd
+
+from typing      import Dict
+from typing      import List
+from typing      import Optional
+from dataclasses import dataclass
+from functools   import reduce
+
+from .. core.lt_stats_functions      import xy_lifetime_stats
+from .. core.lt_stats_functions      import lifetime_stats
+from .. core.lt_stats_functions      import coarsen_stats
+from .. core.lt_stats_functions      import fit_lifetime_from_stats
+from .. core.map_functions           import amap_from_fit_arrays
+from .. core.correction_functions    import e0_xy_correction
+from .. core.selection_functions     import band_histogram
+from .. core.selection_functions     import selection_in_band_histogram
+from .. core.histo_functions         import histo_accumulator
+from .. core.histo_functions         import new_histo_accumulator
+from .. core.histo_functions         import fill_histo_accumulator
+from .. core.histo_functions         import merge_histo_accumulators
+from .. core.histo_functions         import compute_similar_histo
+from .. core.io_functions            import write_complete_maps
+from .. core.fit_functions           import drift_v_from_histogram
+from .. core.kr_parevol_functions    import histograms_in_time_bins
+from .. core.kr_parevol_functions    import parameter_moments
+from .. core.kr_parevol_functions    import parameter_averages
+
+from . map_builder_functions         import load_dst_files
+from . map_builder_functions         import preselect_events
+from . map_builder_functions         import check_preselection
+from . map_builder_functions         import check_efficiency
+from . map_builder_functions         import check_Z_histogram
+from . map_builder_functions         import check_accumulated_rate_and_hist
+from . map_builder_functions         import get_binning_auto
+from . map_builder_functions         import check_and_regularize_map
+from . map_builder_functions         import check_drift_v_computation
+from . map_builder_functions         import ref_hist_container
+
+from invisible_cities.reco.corrections    import ASectorMap
+from invisible_cities.types.symbols       import NormStrategy
+
+
+SELECTION_STEPS = ('events', 'physical', 's1', 's2', 'band')
+TIME_COUNTERS   = ('physical', 's1', 's2', 'band')
+TIME_ARRAYS     = ('t_counts', 't_stats', 't_z_histo', 't_moments')
+RATE_BIN_WIDTH  = 1 # s, fine bins of the event time histograms
+
+
+@dataclass
+class map_partial:
+    tallies   : Dict[str, int]                # number of events after each selection step
+    histos    : Dict[str, np.array]           # entries of the control histograms
+    rates     : Dict[str, histo_accumulator]  # event times before and after the selection
+    nevt      : np.array                      # selected rows in each XY cell
+    stats     : np.array                      # lifetime statistics in each XY cell
+    t_first   : int                           # first time bin (time // nStimeprofile)
+    t_counts  : np.array                      # events in each time bin after each TIME_COUNTERS step
+    t_stats   : np.array                      # lifetime statistics of fiducial events in each time bin
+    t_z_histo : np.array                      # Z histogram of fiducial events in each time bin
+    t_moments : np.array                      # moments of the S1/S2 parameters of fiducial events in each time bin
+
+
+def shard_files(dst_files : List[str],
+                nshards   : int,
+                ishard    : int) -> List[str]:
+    """Files of shard ishard out of nshards (round robin on the sorted list)."""
+    return dst_files[ishard::nshards]
+
+
+def shard_map_bins(config) -> int:
+    """
+    Number of XY bins of the grid where the partial results accumulate
+    the map statistics: the configured one or 100, from which the
+    automatic 50x50 binning is obtained summing 2x2 blocks.
+    """
+    return config.default_n_bins or 100
+
+
+def unique_event_mask(events : np.array,
+                      mask   : np.array) -> np.array:
+    """Mask of the first row of each event among the rows in mask."""
+    first       = np.zeros(len(events), dtype=bool)
+    index       = np.flatnonzero(mask)
+    first[index[~pd.Series(events[index]).duplicated().values]] = True
+    return first
+
+
+def empty_map_partial() -> map_partial:
+    """
+    Partial result of a shard without input files. merge_map_partials
+    returns the other partial result when merging it.
+    """
+    empty = np.zeros(0)
+    return map_partial(tallies   = {step: 0 for step in SELECTION_STEPS},
+                       histos    = {},
+                       rates     = {},
+                       nevt      = empty,
+                       stats     = empty,
+                       t_first   = 0,
+                       **{name: empty for name in TIME_ARRAYS})
+
+
+def is_empty_partial(partial : map_partial) -> bool:
+    return partial.nevt.size == 0
+
+
+def empty_band_histogram(config) -> np.array:
+    band_params = config.band_sel_params
+    return np.zeros((band_params['nbins_z'], band_params['nbins_e']))
+
+
+def selected_band_histogram(config                 ,
+                            dst     : pd.DataFrame ,
+                            energy  : np.array     ,
+                            mask_s2 : np.array     ) -> np.array:
+    """Z vs E histogram (see band_histogram) of the events in mask_s2."""
+    band_params = config.band_sel_params
+    return band_histogram(dst.Z.values[mask_s2], energy[mask_s2],
+                          band_params['range_Z'], band_params['range_E'],
+                          band_params['nbins_z'], band_params['nbins_e'])
+
+
+def shard_energy(dst          : pd.DataFrame,
+                 bootstrapmap : ASectorMap  ) -> np.array:
+    """S2 energy corrected with the bootstrap map (as in band_selection)."""
+    emaps = e0_xy_correction(bootstrapmap, NormStrategy.max)
+    return dst.S2e.values * emaps(dst.X.values, dst.Y.values)
+
+
+def shard_band_histogram(config                   ,
+                         dst_files    : List[str] ,
+                         bootstrapmap : ASectorMap) -> np.array:
+    """
+    Band pass of the map step: Z vs E histogram (see band_histogram)
+    of the nS1 == 1 and nS2 == 1 events of dst_files. The band of the
+    run is fitted on the sum of the histograms of all the shards.
+    """
+    if not dst_files:
+        return empty_band_histogram(config)
+    presel = preselect_events(config, load_dst_files(dst_files, config.quality_ranges))
+    return selected_band_histogram(config, presel.dst,
+                                   shard_energy(presel.dst, bootstrapmap), presel.s2)
+
+
+def process_shard(config                                    ,
+                  dst_files    : List[str]                   ,
+                  bootstrapmap : ASectorMap                  ,
+                  ref_histos   : ref_hist_container          ,
+                  band_histo   : Optional[np.array] = None) -> map_partial:
+    """
+    Map step: applies the map_builder selection to the events of
+    dst_files and accumulates the partial result.
+
+    Parameters
+    ----------
+    config: namespace
+        Map builder configuration.
+    dst_files: list of str
+        Input kdst files of the shard.
+    bootstrapmap: ASectorMap
+        Bootstrap map.
+    ref_histos: ref_hist_container
+        Reference histograms (for the Z histogram binning).
+    band_histo: np.array (optional)
+        Z vs E histogram the Kr band is fitted on, the sum of the
+        shard_band_histogram of all the shards of the run. By default
+        the band is fitted on the events of the shard.
+    """
+    if not dst_files:
+        return empty_map_partial()
+
+    dst     = load_dst_files(dst_files, config.quality_ranges)
+    rates   = dict(rate_before_sel = new_histo_accumulator(RATE_BIN_WIDTH),
+                   rate_after_sel  = new_histo_accumulator(RATE_BIN_WIDTH))
+    fill_histo_accumulator(rates['rate_before_sel'], dst.time.values)
+
+    presel  = preselect_events(config, dst)
+    dst     = presel.dst
+    tallies = presel.tallies
+    histos  = presel.histos
+    mask_s1 = presel.s1
+    mask_s2 = presel.s2
+
+    histos ['Z'], _ = compute_similar_histo(dst[mask_s2].Z, ref_histos.Z_dist_hist)
+
+    energy      = shard_energy(dst, bootstrapmap)
+    histos['band_ZE'] = selected_band_histogram(config, dst, energy, mask_s2)
+    band_histo  = histos['band_ZE'] if band_histo is None else band_histo
+    band_params = config.band_sel_params
+    mask_band   = np.zeros(len(dst), dtype=bool)
+    mask_band[mask_s2], *_ = selection_in_band_histogram(dst.Z.values[mask_s2], energy[mask_s2],
+                                                         band_histo,
+                                                         band_params['range_Z'],
+                                                         band_params['range_E'],
+                                                         band_params['nsigma_sel'],
+                                                         band_params.get('method', 'gauss'))
+    selected    = dst[mask_band]
+    tallies['band'] = selected.event.nunique()
+    fill_histo_accumulator(rates['rate_after_sel'], selected.time.values)
+
+    nbins       = shard_map_bins(config)
+    map_params  = config.map_params
+    nevt, stats = xy_lifetime_stats(selected,
+                                    np.linspace(*map_params['x_range'], nbins + 1),
+                                    np.linspace(*map_params['y_range'], nbins + 1),
+                                    map_params['nbins_z'], map_params['z_range'])
+
+    krevol      = config.krevol_params
+    tbin        = (dst.time.values // krevol['nStimeprofile']).astype(int)
+    t_first     = tbin.min() if len(tbin) else 0
+    nt          = tbin.max() - t_first + 1 if len(tbin) else 0
+    t_counts    = np.stack([np.bincount(tbin[unique_event_mask(dst.event.values, mask)] - t_first,
+                                        minlength=nt)
+                            for mask in (np.ones(len(dst), dtype=bool), mask_s1, mask_s2, mask_band)],
+                           axis=-1)
+
+    fiducial    = mask_band & (dst.R < krevol['r_fid']).values
+    ftbin       = np.where(fiducial, tbin - t_first, -1)
+    t_stats     = lifetime_stats(ftbin, nt, dst.Z.values, energy,
+                                 krevol['zslices_lt'], krevol['zrange_lt'])
+    t_z_histo   = histograms_in_time_bins(ftbin, nt, dst.Z.values,
+                                          np.linspace(*krevol['zrange_dv'], krevol['nbins_dv'] + 1))
+    t_moments   = parameter_moments(dst, ftbin, nt)
+
+    return map_partial(tallies   = tallies,
+                       histos    = histos,
+                       rates     = rates,
+                       nevt      = nevt,
+                       stats     = stats,
+                       t_first   = int(t_first),
+                       t_counts  = t_counts,
+                       t_stats   = t_stats,
+                       t_z_histo = t_z_histo,
+                       t_moments = t_moments)
+
+
+def merge_map_partials(p1 : map_partial,
+                       p2 : map_partial) -> map_partial:
+    """Partial result of the union of the events of p1 and p2."""
+    if is_empty_partial(p1): return p2
+    if is_empty_partial(p2): return p1
+    filled   = [p for p in (p1, p2) if len(p.t_counts)] or [p1]
+    t_first  = min(p.t_first                  for p in filled)
+    t_last   = max(p.t_first + len(p.t_counts) for p in filled)
+    t_arrays = {}
+    for name in TIME_ARRAYS:
+        first = getattr(p1, name)
+        total = np.zeros((t_last - t_first,) + first.shape[1:], dtype=first.dtype)
+        for p in filled:
+            start = p.t_first - t_first
+            total[start: start + len(p.t_counts)] += getattr(p, name)
+        t_arrays[name] = total
+
+    return map_partial(tallies  = {k: p1.tallies[k] + p2.tallies[k] for k in p1.tallies},
+                       histos   = {k: p1.histos [k] + p2.histos [k] for k in p1.histos },
+                       rates    = {k: merge_histo_accumulators(p1.rates[k], p2.rates[k])
+                                   for k in p1.rates},
+                       nevt     = p1.nevt  + p2.nevt,
+                       stats    = p1.stats + p2.stats,
+                       t_first  = t_first,
+                       **t_arrays)
+
+
+def write_map_partial(partial  : map_partial,
+                      filename : str) -> None:
+    """Writes a partial result in a .npz file."""
+    arrays = dict(nevt     = partial.nevt,
+                  stats    = partial.stats,
+                  t_first  = partial.t_first)
+    arrays.update({name: getattr(partial, name) for name in TIME_ARRAYS})
+    arrays.update({f'tally/{k}': v for k, v in partial.tallies.items()})
+    arrays.update({f'histo/{k}': v for k, v in partial.histos .items()})
+    for name, acc in partial.rates.items():
+        arrays.update({f'rate/{name}/{field}': getattr(acc, field)
+                       for field in ('bin_width', 'origin', 'counts', 'vmin', 'vmax')})
+    np.savez_compressed(filename, **arrays)
+
+
+def read_map_partial(filename : str) -> map_partial:
+    """Reads a partial result written by write_map_partial."""
+    with np.load(filename) as f:
+        def group(prefix):
+            return {key[len(prefix):]: f[key] for key in f.files if key.startswith(prefix)}
+        rates = {}
+        for key, value in group('rate/').items():
+            name, field = key.split('/')
+            rates.setdefault(name, {})[field] = value if field == 'counts' else value.item()
+        return map_partial(tallies  = {k: int(v) for k, v in group('tally/').items()},
+                           histos   = group('histo/'),
+                           rates    = {k: histo_accumulator(**v) for k, v in rates.items()},
+                           nevt     = f['nevt'],
+                           stats    = f['stats'],
+                           t_first  = int(f['t_first']),
+                           **{name: f[name] for name in TIME_ARRAYS})
+
+
+def time_evolution_from_partial(partial       : map_partial,
+                                nStimeprofile : float,
+                                zrange_lt     : tuple,
+                                zrange_dv     : tuple,
+                                detector      : str) -> pd.DataFrame:
+    """
+    Time evolution table (ts, e0, lt, dv, their errors, chi2, the S1/S2
+    parameter averages and the S1, S2 and band efficiencies) of the
+    time bins with events.
+    """
+    fits    = fit_lifetime_from_stats(partial.t_stats, zrange_lt)
+    counts  = dict(zip(TIME_COUNTERS, partial.t_counts.T))
+    ts      = (partial.t_first + np.arange(len(partial.t_counts)) + 0.5) * nStimeprofile
+    filled  = counts['physical'] > 0
+    z_edges = np.linspace(*zrange_dv, partial.t_z_histo.shape[1] + 1)
+    dv      = np.full((len(ts), 2), np.nan)
+    for i in np.flatnonzero(filled):
+        dv[i] = drift_v_from_histogram(partial.t_z_histo[i], z_edges, zrange_dv, detector)
+
+    pars = dict(ts   = ts,
+                e0   = fits.e0,
+                lt   = fits.lt,
+                dv   = dv[:, 0],
+                e0u  = fits.e0u,
+                ltu  = fits.ltu,
+                dvu  = dv[:, 1],
+                chi2 = fits.chi2)
+    pars.update(parameter_averages(partial.t_moments))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pars['S1eff'  ] = counts['s1'  ] / counts['physical']
+        pars['S2eff'  ] = counts['s2'  ] / counts['s1']
+        pars['Bandeff'] = counts['band'] / counts['s2']
+    return pd.DataFrame(pars)[filled].reset_index(drop=True)
+
+
+def reduce_map_partials(config                        ,
+                        partials   : List[map_partial],
+                        ref_histos : ref_hist_container) -> ASectorMap:
+    """
+    Reduce step: merges the partial results, runs the map_builder
+    checks on the merged histograms and tallies, and computes and
+    writes the map (config.file_out_map) and the control histograms
+    (config.file_out_hists).
+    """
+    partial = reduce(merge_map_partials, partials)
+    if is_empty_partial(partial):
+        raise ValueError("No kdst files to process")
+    tallies = partial.tallies
+    print("    Number of events before any selection: {0}".format(tallies['events']))
+
+    with pd.HDFStore(config.file_out_hists, "w", complib=str("zlib"), complevel=4) as store_hist:
+        check_accumulated_rate_and_hist(partial.rates['rate_before_sel'], store_hist,
+                                        "rate_before_sel", config.n_dev_rate,
+                                        **config.rate_histo_params)
+        check_preselection(config, tallies, partial.histos, store_hist)
+
+        _, z_edges = compute_similar_histo(np.array([]), ref_histos.Z_dist_hist)
+        check_Z_histogram(partial.histos['Z'], z_edges, ref_histos.Z_dist_hist, config.nsigmas_Zdst)
+        check_efficiency(tallies, 'band', 's2',
+                         (config.band_sel_params['eff_min'], config.band_sel_params['eff_max']))
+        check_accumulated_rate_and_hist(partial.rates['rate_after_sel'], store_hist,
+                                        "rate_after_sel", config.n_dev_rate,
+                                        **config.rate_histo_params)
+
+    map_params = config.map_params
+    nbins      = get_binning_auto(nevt_sel                = tallies['band']                 ,
+                                  thr_events_for_map_bins = config.thr_evts_for_sel_map_bins,
+                                  n_bins                  = config.default_n_bins           )
+    print("    Number of bins: {0}x{0}".format(nbins))
+    factor     = shard_map_bins(config) // nbins
+    fits       = fit_lifetime_from_stats(coarsen_stats(partial.stats, factor), map_params['z_range'])
+    maps       = amap_from_fit_arrays(fits, coarsen_stats(partial.nevt, factor) > map_params['nmin'])
+    final_map  = check_and_regularize_map(maps       = maps                    ,
+                                          run_number = config.run_number       ,
+                                          XYbins     = (nbins, nbins)          ,
+                                          chi2_range = map_params['chi2_range'],
+                                          maxFailed  = map_params['maxFailed'] ,
+                                          r_max      = map_params['r_max']     ,
+                                          x_range    = map_params['x_range']   ,
+                                          y_range    = map_params['y_range']   )
+
+    krevol           = config.krevol_params
+    final_map.t_evol = time_evolution_from_partial(partial,
+                                                   krevol['nStimeprofile'],
+                                                   krevol['zrange_lt'],
+                                                   krevol['zrange_dv'],
+                                                   krevol['detector'])
+    check_drift_v_computation(final_map.t_evol.dv, map_params['dv_maxFailed'])
+    write_complete_maps(asm = final_map, filename = config.file_out_map)
+    print("Map successfully computed and saved in : {0}".format(config.file_out_map))
+    print("Control histograms saved in            : {0}".format(config.file_out_hists))
+    return final_map
@@ -0,0 +1,195 @@
+import os
+import numpy  as np
+import pandas as pd
+
+from types         import SimpleNamespace
+from functools     import reduce
+
+from numpy.testing import assert_array_equal
+from numpy.testing import assert_allclose
+
+from .. core.histo_functions    import new_histo_accumulator
+from .. core.histo_functions    import fill_histo_accumulator
+from .. core.lt_stats_functions   import lifetime_stats
+from .. core.kr_parevol_functions import KREVOL_AVERAGES
+from .. core.kr_parevol_functions import histograms_in_time_bins
+from .. core.kr_parevol_functions import parameter_moments
+from .. core.histo_functions      import ref_hist
+
+from . shard_functions import SELECTION_STEPS
+from . shard_functions import TIME_COUNTERS
+from . shard_functions import map_partial
+from . shard_functions import shard_files
+from . shard_functions import merge_map_partials
+from . shard_functions import write_map_partial
+from . shard_functions import read_map_partial
+from . shard_functions import time_evolution_from_partial
+from . shard_functions import empty_map_partial
+from . shard_functions import shard_band_histogram
+from . shard_functions import process_shard
+from . map_builder_functions import ref_hist_container
+from . import shard_functions
+
+
+def random_partial(t_first, nt, seed):
+    rng   = np.random.default_rng(seed)
+    times = rng.uniform(t_first, t_first + nt, 100)
+    rates = dict(rate_before_sel = new_histo_accumulator(1),
+                 rate_after_sel  = new_histo_accumulator(1))
+    fill_histo_accumulator(rates['rate_before_sel'], times)
+    fill_histo_accumulator(rates['rate_after_sel' ], times[:50])
+
+    z     = rng.uniform(0, 500, 100)
+    e     = rng.normal(1e4, 100, 100)
+    tbin  = (times - t_first).astype(int)
+    data  = pd.DataFrame({parameter: rng.uniform(1, 10, 100) for parameter in KREVOL_AVERAGES})
+    return map_partial(tallies   = {step: int(n) for step, n in zip(SELECTION_STEPS,
+                                                                     rng.integers(0, 100, 5))},
+                       histos    = dict(nS1     = rng.integers(0, 10, 10),
+                                        Z       = rng.integers(0, 10, 20),
+                                        band_ZE = rng.integers(0, 10, (2, 2))),
+                       rates     = rates,
+                       nevt      = rng.integers(0, 10, (4, 4)),
+                       stats     = rng.uniform(0, 1, (4, 4, 3, 6)),
+                       t_first   = t_first,
+                       t_counts  = rng.integers(1, 10, (nt, len(TIME_COUNTERS))),
+                       t_stats   = lifetime_stats(tbin, nt, z, e, 3, (0, 500)),
+                       t_z_histo = histograms_in_time_bins(tbin, nt, z, np.linspace(0, 500, 11)),
+                       t_moments = parameter_moments(data, tbin, nt))
+
+
+def test_shard_files_cover_all_files_once():
+    files  = [f'file_{i}.h5' for i in range(11)]
+    shards = [shard_files(files, 3, i) for i in range(3)]
+    assert sorted(sum(shards, [])) == sorted(files)
+
+
+def test_merge_map_partials_adds_up_aligned_time_bins():
+    p1     = random_partial(t_first = 10, nt = 5, seed = 1)
+    p2     = random_partial(t_first = 13, nt = 4, seed = 2)
+    merged = merge_map_partials(p1, p2)
+
+    assert merged.t_first == 10
+    assert len(merged.t_counts) == 7
+    assert_array_equal(merged.t_counts[:3] , p1.t_counts[:3])
+    assert_array_equal(merged.t_counts[3:5], p1.t_counts[3:] + p2.t_counts[:2])
+    assert_array_equal(merged.t_counts[5:] , p2.t_counts[2:])
+    assert_allclose   (merged.t_stats.sum(axis=0), p1.t_stats.sum(axis=0) + p2.t_stats.sum(axis=0))
+    assert_array_equal(merged.t_z_histo[3:5], p1.t_z_histo[3:] + p2.t_z_histo[:2])
+    assert_allclose   (merged.t_moments[3:5], p1.t_moments[3:] + p2.t_moments[:2])
+    assert_array_equal(merged.nevt , p1.nevt + p2.nevt)
+    assert_allclose   (merged.stats, p1.stats + p2.stats)
+    assert merged.tallies == {k: p1.tallies[k] + p2.tallies[k] for k in SELECTION_STEPS}
+    assert merged.rates['rate_before_sel'].counts.sum() == 200
+
+
+def test_merge_map_partials_is_symmetric():
+    p1 = random_partial(t_first = 10, nt = 5, seed = 1)
+    p2 = random_partial(t_first =  3, nt = 4, seed = 2)
+    m1 = merge_map_partials(p1, p2)
+    m2 = merge_map_partials(p2, p1)
+    assert m1.t_first == m2.t_first == 3
+    assert_array_equal(m1.t_counts, m2.t_counts)
+    assert_allclose   (m1.t_stats , m2.t_stats )
+    assert_array_equal(m1.t_z_histo, m2.t_z_histo)
+    assert_allclose   (m1.t_moments, m2.t_moments)
+
+
+def test_write_and_read_map_partial(tmpdir_factory):
+    filename = os.path.join(tmpdir_factory.mktemp('shards'), 'partial.npz')
+    partial  = random_partial(t_first = 10, nt = 5, seed = 1)
+    write_map_partial(partial, filename)
+    read     = read_map_partial(filename)
+
+    assert read.tallies == partial.tallies
+    assert read.t_first == partial.t_first
+    for name in partial.histos:
+        assert_array_equal(read.histos[name], partial.histos[name])
+    for name, acc in partial.rates.items():
+        assert read.rates[name].origin    == acc.origin
+        assert read.rates[name].bin_width == acc.bin_width
+        assert read.rates[name].vmin      == acc.vmin
+        assert read.rates[name].vmax      == acc.vmax
+        assert_array_equal(read.rates[name].counts, acc.counts)
+    assert_array_equal(read.nevt    , partial.nevt    )
+    assert_array_equal(read.stats   , partial.stats   )
+    assert_array_equal(read.t_counts, partial.t_counts)
+    assert_array_equal(read.t_stats , partial.t_stats )
+    assert_array_equal(read.t_z_histo, partial.t_z_histo)
+    assert_array_equal(read.t_moments, partial.t_moments)
+
+
+def test_time_evolution_from_partial_has_drift_velocity_and_averages():
+    partial = random_partial(t_first = 10, nt = 5, seed = 1)
+    t_evol  = time_evolution_from_partial(partial, 60, (0, 500), (0, 500), "next100")
+
+    assert len(t_evol) == 5
+    assert {'dv', 'dvu', 's1e', 's1eu', 'Nsipm', 'S1eff', 'Bandeff'} <= set(t_evol.columns)
+    n, s, _ = np.moveaxis(partial.t_moments, 1, 0)
+    assert_allclose(t_evol.s2e, s[:, KREVOL_AVERAGES.index('S2e')] / n[:, 0])
+
+
+def test_empty_map_partial_merges_and_round_trips(tmpdir_factory):
+    filename = os.path.join(tmpdir_factory.mktemp('shards'), 'partial.npz')
+    partial  = random_partial(t_first = 10, nt = 5, seed = 1)
+    assert merge_map_partials(empty_map_partial(), partial) is partial
+    assert merge_map_partials(partial, empty_map_partial()) is partial
+
+    write_map_partial(empty_map_partial(), filename)
+    assert merge_map_partials(read_map_partial(filename), partial) is partial
+
+
+def synthetic_kdst(nevents, seed):
+    rng  = np.random.default_rng(seed)
+    x, y = rng.uniform(-200, 200, (2, nevents))
+    z    = rng.uniform(0, 500, nevents)
+    dst  = pd.DataFrame(dict(event   = np.arange(nevents) + seed * nevents,
+                             time    = rng.uniform(0, 3600, nevents),
+                             s1_peak = 0, s2_peak = 0,
+                             X = x, Y = y, Z = z, R = np.hypot(x, y),
+                             S2e     = 10000 * np.exp(-z / 5000) * rng.normal(1, 0.03, nevents)))
+    for parameter in KREVOL_AVERAGES:
+        if parameter not in dst:
+            dst[parameter] = rng.uniform(1, 10, nevents)
+    return dst.sort_values('time', ignore_index=True)
+
+
+def test_sharded_map_does_not_depend_on_the_number_of_shards(monkeypatch):
+    files = {f'kdst_{i}.h5': synthetic_kdst(20000, i) for i in range(4)}
+    monkeypatch.setattr(shard_functions, 'load_dst_files',
+                        lambda dst_files, quality_ranges: pd.concat([files[f] for f in dst_files]))
+    monkeypatch.setattr(shard_functions, 'e0_xy_correction',
+                        lambda amap, norm_strat: (lambda x, y: np.ones_like(x)))
+
+    histo_params = dict(nbins_hist = 10, range_hist = (0, 10))
+    config       = SimpleNamespace(
+        quality_ranges        = dict(r_max = 200),
+        select_diffusion_band = False,
+        ns1_histo_params      = histo_params,
+        ns2_histo_params      = histo_params,
+        default_n_bins        = 10,
+        band_sel_params       = dict(range_Z = (0, 500), range_E = (5000, 12000),
+                                     nbins_z = 20, nbins_e = 100, nsigma_sel = 2,
+                                     method  = 'quantile'),
+        map_params            = dict(x_range = (-200, 200), y_range = (-200, 200),
+                                     nbins_z = 10, z_range = (0, 500)),
+        krevol_params         = dict(nStimeprofile = 600, r_fid = 100, zslices_lt = 10,
+                                     zrange_lt = (0, 500), zrange_dv = (0, 500), nbins_dv = 10))
+    centres    = np.arange(10) * 50 + 25.
+    ref_histos = ref_hist_container(ref_hist(centres, np.full(10, 0.1), np.full(10, 0.01),
+                                             np.arange(11) * 50.))
+
+    def sharded_partial(nshards):
+        shards     = [shard_files(sorted(files), nshards, i) for i in range(nshards)]
+        band_histo = sum(shard_band_histogram(config, shard, None) for shard in shards)
+        return reduce(merge_map_partials, [process_shard(config, shard, None, ref_histos, band_histo)
+                                           for shard in shards])
+
+    one = sharded_partial(1)
+    assert 0 < one.tallies['band'] < one.tallies['s2']
+    for nshards in (3, 6):
+        partial = sharded_partial(nshards)
+        assert partial.tallies == one.tallies
+        assert_array_equal(partial.nevt    , one.nevt    )
+        assert_allclose   (partial.stats   , one.stats   )
+        assert_array_equal(partial.t_counts, one.t_counts)